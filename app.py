@@ -12,20 +12,35 @@ from telegram.ext import ApplicationBuilder
 from telegram import Update
 from config import Config
 from datetime import datetime, time
-from water_reminders import reset_daily_water  # Añade esto con los otros imports
+from water_reminders import restore_water_reminders
+from premium import PaymentInbox, notify_premium_activated
+from entitlements import sweep_expired_premium, warm_entitlement_cache
+from broadcast import resume_broadcasts
+from plan_catalog import load_catalog
 from flask import Flask, request, jsonify
-from telegram.request import HTTPXRequest
+from bot_api import RoutedRequest
+from overload import overload_controller
+from conversation_state import purge_conversation_states
+from migrations import pending_migrations
+from database import get_read_session, replica_router, user_scope
+from repository import warm_language_cache
+from stats import admin_stats, reconcile_admin_stats
+from throttling import throttling_snapshot
+from message_edits import edit_manager
+from tracing import tracer
+from loop_watchdog import loop_watchdog
+from profiler import ProfilerBusy, sampling_profiler
+from logging_setup import configure_logging, log_context, logging_snapshot
+from i18n import SUPPORTED_LANGUAGES, language_cache
+import hmac
 import threading
 import time
 import requests
 import logging
 import os
 
-# Configuración básica de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging asíncrono: el formato y la escritura ocurren en el hilo del listener
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -35,33 +50,72 @@ class BotManager:
     def __init__(self):
         self.application = None
         self.loop = asyncio.new_event_loop()
-        self.request = HTTPXRequest(
-            connection_pool_size=10,
-            read_timeout=20.0,
-            write_timeout=20.0,
-            connect_timeout=20.0,
-            pool_timeout=30.0
-        )
+        # Pools separados para respuestas interactivas, envíos masivos y documentos
+        self.request = RoutedRequest.from_config()
         self._init_lock = threading.Lock()
         self._async_init_lock = None
         self._start_background_loop()
         self.initialize()
     
-    async def _setup_daily_reset(self):
-        """Configura el job de reinicio diario"""
+    async def _restore_water_reminders(self):
+        """Reprograma los recordatorios de agua (los jobs no sobreviven a un reinicio)"""
+        try:
+            restored = restore_water_reminders(self.application.job_queue)
+            logger.info(f"Recordatorios de agua restaurados: {restored}")
+        except Exception as e:
+            logger.error(f"Error restaurando recordatorios: {e}")
+
+    async def _warm_language_cache(self):
+        """Precarga el idioma de los usuarios: los handlers no lo consultan en la base de datos"""
+        db = get_read_session()
+        try:
+            cached = warm_language_cache(db)
+            logger.info(f"Idiomas en caché: {cached} usuarios ({', '.join(SUPPORTED_LANGUAGES)})")
+        except Exception as e:
+            logger.error(f"Error precargando idiomas: {e}")
+        finally:
+            db.close()
+
+    async def _setup_premium_sweeper(self):
+        """Configura el barrido periódico de suscripciones vencidas"""
+        try:
+            if not any(job.name == "premium_sweeper" for job in self.application.job_queue.jobs()):
+                self.application.job_queue.run_repeating(
+                    callback=sweep_expired_premium,
+                    interval=Config.PREMIUM_SWEEP_INTERVAL,
+                    first=10,
+                    name="premium_sweeper"
+                )
+            cached = warm_entitlement_cache()
+            logger.info(f"Barrido premium configurado ({cached} usuarios premium en caché)")
+        except Exception as e:
+            logger.error(f"Error configurando el barrido premium: {e}")
+
+    async def _setup_state_purge(self):
+        """Configura la limpieza periódica de estados de conversación abandonados"""
         try:
-            # Verifica si ya existe un job de reinicio
-            if not any(job.name == "daily_reset" for job in self.application.job_queue.jobs()):
-                # Configura para ejecutarse diariamente a las 00:00 (medianoche)
-                self.application.job_queue.run_daily(
-                    callback=reset_daily_water,
-                    time=time(0, 0),  # 00:00 (medianoche)
-                    days=(0, 1, 2, 3, 4, 5, 6),  # Todos los días de la semana
-                    name="daily_reset"
+            if not any(job.name == "conversation_state_purge" for job in self.application.job_queue.jobs()):
+                self.application.job_queue.run_repeating(
+                    callback=purge_conversation_states,
+                    interval=Config.CONVERSATION_STATE_TTL,
+                    first=60,
+                    name="conversation_state_purge"
                 )
-                logger.info("Job de reinicio diario configurado correctamente")
         except Exception as e:
-            logger.error(f"Error configurando el reinicio diario: {e}")
+            logger.error(f"Error configurando la limpieza de estados: {e}")
+
+    async def _setup_stats_reconcile(self):
+        """Configura la reconciliación periódica de las estadísticas de administración"""
+        try:
+            if not any(job.name == "stats_reconcile" for job in self.application.job_queue.jobs()):
+                self.application.job_queue.run_repeating(
+                    callback=reconcile_admin_stats,
+                    interval=Config.STATS_RECONCILE_INTERVAL,
+                    first=5,  # Carga inicial de los contadores
+                    name="stats_reconcile"
+                )
+        except Exception as e:
+            logger.error(f"Error configurando la reconciliación de estadísticas: {e}")
 
     def _start_background_loop(self):
         def run_loop():
@@ -98,11 +152,29 @@ class BotManager:
                     from handlers import setup_handlers
                     setup_handlers(self.application)
                     
+                    # Catálogo de planes en memoria: sin lecturas de disco por solicitud
+                    load_catalog()
+                    
                     await self.application.initialize()
                     await self.application.start()
                     
-                    # Configurar el reinicio diario después de iniciar
-                    await self._setup_daily_reset()
+                    # El día de agua se reinicia por usuario al primer acceso
+                    # (ver roll_over_water_day); no hay job a medianoche
+                    await self._restore_water_reminders()
+                    await self._warm_language_cache()
+                    await self._setup_premium_sweeper()
+                    await self._setup_state_purge()
+                    await self._setup_stats_reconcile()
+                    
+                    # Medición continua del retraso del loop para el control de sobrecarga
+                    self.application.create_task(overload_controller.monitor_loop_lag())
+                    if Config.LOOP_WATCHDOG_ENABLED:
+                        # Registra la pila de cualquier llamada que bloquee el loop
+                        loop_watchdog.start()
+                    
+                    resumed = resume_broadcasts(self.application)
+                    if resumed:
+                        logger.info(f"Difusiones reanudadas: {resumed}")
                     
                     logger.info("Bot inicializado correctamente")
 
@@ -139,21 +211,61 @@ class BotManager:
             logger.error(f"Error configurando webhook: {str(e)}")
             raise
 
-    async def _process_update(self, update_data):
-        update = Update.de_json(update_data, self.application.bot)
-        await self.application.process_update(update)
+    async def _process_update(self, update_data, trace=None):
+        root = trace.root if trace else None
+        if root is not None:
+            # Desde la recepción en el hilo del servidor hasta que el loop lo atiende
+            queue_wait = root.child('queue_wait')
+            queue_wait.timestamp = root.timestamp
+            queue_wait.finish(root.elapsed_us())
+        try:
+            with tracer.activate(root), log_context(update_id=update_data.get('update_id')):
+                update = Update.de_json(update_data, self.application.bot)
+                if root is not None:
+                    root.tag('update.kind', describe_update(update))
+                    if update.effective_user:
+                        root.tag('user.id', update.effective_user.id)
+                user_id = update.effective_user.id if update.effective_user else None
+                # Las lecturas de este usuario ven sus propias escrituras recientes
+                with user_scope(user_id), log_context(user_id=user_id):
+                    with tracer.span('handler'):
+                        await overload_controller.process(self.application, update)
+        finally:
+            tracer.finish_trace(trace)
         return True
 
     def process_update(self, update_data):
+        """Encola el update en el loop del bot y vuelve sin esperar al handler.
+
+        Los hilos del servidor web solo reciben: si esperasen el resultado,
+        los updates en curso nunca pasarían del número de hilos y el control
+        de sobrecarga (pendientes y cola por prioridad) no llegaría a actuar.
+        """
+        # Cuenta desde la recepción: incluye los updates que aún esperan al loop
+        overload_controller.enter()
+        update_id = update_data.get('update_id')
+        trace = tracer.start_trace('update', **{'update.id': update_id})
         future = asyncio.run_coroutine_threadsafe(
-            self._process_update(update_data),
+            self._process_update(update_data, trace),
             self.loop
         )
-        try:
-            return future.result(timeout=30)
-        except Exception as e:
-            logger.error(f"Error procesando update: {str(e)}")
-            return False
+
+        def on_done(done):
+            overload_controller.leave()
+            if not done.cancelled() and done.exception() is not None:
+                logger.error(f"Error procesando update {update_id}: {done.exception()}")
+
+        future.add_done_callback(on_done)
+        return True
+
+def describe_update(update: Update) -> str:
+    """Tipo de update para las trazas, sin incluir texto escrito por el usuario"""
+    if update.callback_query:
+        return f"callback:{update.callback_query.data}"
+    message = update.message
+    if message and message.text and message.text.startswith('/'):
+        return f"command:{message.text.split()[0]}"
+    return 'message' if message else 'other'
 
 def keep_alive():
     """Función para mantener activa la instancia con pings periódicos"""
@@ -169,6 +281,28 @@ def keep_alive():
             logger.error(f"Error en keep-alive: {str(e)}")
         time.sleep(240)
 
+def on_payment_fulfilled(payment):
+    """Programa el aviso al usuario en el loop del bot sin esperar el resultado"""
+    if bot_manager.application:
+        asyncio.run_coroutine_threadsafe(
+            notify_premium_activated(bot_manager.application.bot, payment['telegram_id']),
+            bot_manager.loop
+        )
+
+# El esquema no se toca al arrancar (lo migra el paso release del Procfile);
+# con migraciones pendientes la app no arranca en lugar de fallar en cada update
+try:
+    pending = pending_migrations()
+except Exception as e:
+    logger.critical(f"No se pudo comprobar el estado de las migraciones: {e}")
+    raise
+if pending:
+    logger.critical(
+        f"Migraciones pendientes: {', '.join(m.name for m in pending)}. "
+        "Ejecuta 'python migrations.py upgrade' antes de arrancar."
+    )
+    raise RuntimeError("Esquema de base de datos desactualizado")
+
 # Inicialización del bot
 try:
     bot_manager = BotManager()
@@ -177,6 +311,13 @@ except Exception as e:
     logger.critical(f"Fallo al iniciar el bot: {str(e)}")
     raise
 
+# El retraso de las réplicas se mide en su propio hilo, fuera del loop
+replica_router.start()
+
+# Los pagos se aplican en su propio hilo desde la bandeja persistente
+payment_inbox = PaymentInbox(on_fulfilled=on_payment_fulfilled)
+payment_inbox.start()
+
 # Endpoints Flask
 @app.route('/')
 def home():
@@ -190,22 +331,78 @@ def webhook():
     
     try:
         update_data = request.get_json()
-        logger.info(f"Update recibido (type: {update_data.get('update_id')})")
-        success = bot_manager.process_update(update_data)
-        return "ok" if success else "error", 200
+        with log_context(update_id=update_data.get('update_id')):
+            logger.info("Update recibido")
+            bot_manager.process_update(update_data)
+        return "ok", 200
     except Exception as e:
         logger.error(f"Error en webhook: {str(e)}", exc_info=True)
         return "server error", 500
 
+@app.post('/payments/webhook')
+def payments_webhook():
+    """Recibe eventos del proveedor de pagos, los verifica y los guarda en la bandeja"""
+    return payment_inbox.receive(request.get_data(), request.headers.get('Stripe-Signature', ''))
+
 @app.get('/health')
 def health_check():
     """Endpoint para verificaciones de salud y keep-alive"""
     return jsonify({
         "status": "healthy",
         "bot": "running" if bot_manager.application else "starting",
+        "bot_api_pools": bot_manager.request.stats_snapshot(),
+        "bot_api_resilience": bot_manager.request.resilience_snapshot(),
+        "overload": overload_controller.snapshot(),
+        "throttling": throttling_snapshot(),
+        "message_edits": edit_manager.snapshot(),
+        "tracing": tracer.snapshot(),
+        "loop_watchdog": loop_watchdog.snapshot(),
+        "logging": logging_snapshot(),
+        "i18n": {"languages": list(SUPPORTED_LANGUAGES), "cached_users": len(language_cache)},
+        "database": replica_router.snapshot(),
         "timestamp": time.time()
     }), 200
 
+def admin_denied():
+    """Respuesta de error si la solicitud no trae el token de administración; None si lo trae"""
+    if not Config.ADMIN_API_TOKEN:
+        return "Not found", 404
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(token.encode(), Config.ADMIN_API_TOKEN.encode()):
+        logger.warning(f"Intento de acceso no autorizado a {request.path}")
+        return "Unauthorized", 401
+    return None
+
+@app.get('/admin/stats')
+def admin_stats_endpoint():
+    """Estadísticas de operación desde contadores en memoria: tiempo constante, sin consultas"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify(admin_stats.snapshot()), 200
+
+@app.get('/debug/profile')
+def debug_profile():
+    """Perfil por muestreo de ?seconds=N en formato collapsed stacks (?view=tasks: corrutinas del bot)"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return "seconds inválido", 400
+    view = request.args.get('view', 'threads')
+    if view not in ('threads', 'tasks'):
+        return "view debe ser threads o tasks", 400
+
+    try:
+        collapsed = sampling_profiler.profile(seconds, view=view, loop=bot_manager.loop)
+    except ProfilerBusy:
+        return "Ya hay un perfil en curso", 409
+    except RuntimeError as e:
+        return str(e), 503
+    return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 def run_server():
     """Inicia el servidor web"""
     from waitress import serve
@@ -0,0 +1,105 @@
+"""Compara entidades ORM completas con las proyecciones de repository.py.
+
+Crea una base SQLite en memoria con N usuarios y mide, para cada variante,
+el tiempo de CPU y el pico de memoria (tracemalloc):
+
+  - lote: cargar el estado de hidratación de todos los usuarios
+  - por llamada: una consulta por usuario sobre una muestra
+
+Uso:
+    python bench_projections.py --users 20000 --sample 2000
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import joinedload, sessionmaker
+from models import Base, User, UserSettings
+from repository import BATCH_SIZE, get_hydration_state, get_hydration_states
+
+def populate(engine, users: int):
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'id': i, 'telegram_id': 10_000_000 + i, 'first_name': f"Usuario {i}",
+             'weight': 60 + i % 40, 'water_goal': (60 + i % 40) * 35, 'current_water': i % 2500}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(UserSettings), [
+            {'user_id': i, 'water_reminders_enabled': i % 10 != 0}
+            for i in range(1, users + 1)
+        ])
+
+def orm_batch(db, telegram_ids):
+    users = {}
+    for start in range(0, len(telegram_ids), BATCH_SIZE):
+        chunk = telegram_ids[start:start + BATCH_SIZE]
+        # joinedload: la comparación es con el ORM bien usado, sin N+1
+        for user in db.query(User).options(joinedload(User.settings)).filter(User.telegram_id.in_(chunk)):
+            enabled = user.settings.water_reminders_enabled if user.settings else True
+            users[user.telegram_id] = (user.current_water, user.water_goal, enabled)
+    return users
+
+def orm_single(db, telegram_id):
+    user = db.query(User).options(joinedload(User.settings)).filter_by(telegram_id=telegram_id).first()
+    enabled = user.settings.water_reminders_enabled if user.settings else True
+    return user.current_water, user.water_goal, enabled
+
+def measure(label: str, calls: int, Session, fn):
+    """Devuelve (etiqueta, CPU total, CPU por llamada, pico de memoria).
+
+    CPU y memoria se miden en pasadas separadas (tracemalloc ralentiza) y
+    cada pasada usa su propia sesión, sin identity map compartido.
+    """
+    db = Session()
+    try:
+        started = time.process_time()
+        fn(db)
+        cpu = time.process_time() - started
+    finally:
+        db.close()
+
+    db = Session()
+    try:
+        tracemalloc.start()
+        fn(db)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        db.close()
+    return label, cpu, cpu / calls, peak
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de proyecciones frente a entidades ORM")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=2000, help="Usuarios para la prueba por llamada")
+    args = parser.parse_args(argv)
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    populate(engine, args.users)
+    Session = sessionmaker(bind=engine)
+
+    telegram_ids = [10_000_000 + i for i in range(1, args.users + 1)]
+    sample = random.Random(42).sample(telegram_ids, min(args.sample, args.users))
+
+    results = [
+        measure('lote ORM', args.users, Session, lambda db: orm_batch(db, telegram_ids)),
+        measure('lote proyección', args.users, Session, lambda db: get_hydration_states(db, telegram_ids)),
+        measure('por llamada ORM', len(sample), Session, lambda db: [orm_single(db, t) for t in sample]),
+        measure('por llamada proyección', len(sample), Session,
+                lambda db: [get_hydration_state(db, t) for t in sample]),
+    ]
+
+    print(f"{'variante':<24}{'CPU total':>12}{'CPU/llamada':>14}{'pico memoria':>16}")
+    for label, cpu, per_call, peak in results:
+        print(f"{label:<24}{cpu:>10.3f} s{per_call * 1e6:>11.1f} µs{peak / 1024 / 1024:>13.2f} MB")
+
+    for orm, projection in ((results[0], results[1]), (results[2], results[3])):
+        print(f"{projection[0]}: {orm[1] / projection[1]:.1f}x menos CPU, "
+              f"{orm[3] / projection[3]:.1f}x menos memoria que {orm[0]}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,441 @@
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+import httpx
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+from config import Config
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Clases de tráfico hacia la Bot API, cada una con su propio pool de conexiones:
+#   interactive: respuestas a usuarios (edit_message_text, answer_callback_query...)
+#   bulk: recordatorios, difusiones y avisos masivos
+#   media: envío de documentos (planes en PDF)
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+MEDIA = 'media'
+
+MEDIA_METHODS = {'sendDocument', 'sendPhoto', 'sendVideo', 'sendAudio', 'sendMediaGroup'}
+
+# Solicitudes simultáneas por conexión HTTP/2 (multiplexadas en streams)
+HTTP2_STREAMS_PER_CONNECTION = 10
+
+_traffic_class = contextvars.ContextVar('bot_api_traffic_class', default=None)
+
+@contextmanager
+def traffic_class(name: str):
+    """Marca las llamadas a la Bot API hechas dentro del bloque con una clase de tráfico"""
+    token = _traffic_class.set(name)
+    try:
+        yield
+    finally:
+        _traffic_class.reset(token)
+
+# Métodos que entregan algo nuevo: repetirlos tras una respuesta perdida puede duplicar el mensaje
+NON_IDEMPOTENT_PREFIXES = ('send', 'forward', 'copy')
+
+class PoolTimeout(TimedOut):
+    """No hubo conexión libre en el pool: la solicitud no llegó a enviarse"""
+
+class CircuitOpen(NetworkError):
+    """El endpoint falla de forma sostenida; la llamada se rechaza sin intentarla"""
+
+    def __init__(self, endpoint: str):
+        super().__init__(f"Circuito abierto para {endpoint}: la Bot API no responde, se reintentará más tarde")
+
+def is_idempotent(endpoint: str) -> bool:
+    return not endpoint.startswith(NON_IDEMPOTENT_PREFIXES)
+
+def was_not_sent(error: BaseException) -> bool:
+    """¿El error ocurrió antes de que Telegram recibiera la solicitud?"""
+    return isinstance(error, PoolTimeout) or isinstance(
+        error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    )
+
+def retry_after_seconds(payload: bytes) -> Optional[float]:
+    try:
+        return float(json.loads(payload)['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial con jitter completo: evita que los reintentos lleguen sincronizados"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class CircuitBreaker:
+    """Circuito por endpoint: cerrado -> abierto tras ``failure_threshold`` fallos seguidos.
+
+    Abierto rechaza las llamadas durante ``reset_timeout`` segundos; después
+    deja pasar una sola llamada de prueba (semiabierto) que lo cierra si tiene
+    éxito o lo vuelve a abrir si falla. Se usa solo desde el loop del bot.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+        if self.state == 'closed':
+            return True
+        if self.state == 'half_open' and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    def record_neutral(self):
+        """Resultado que no dice nada de la salud del endpoint (p.ej. pool local lleno)"""
+        self._probing = False
+
+    def snapshot(self) -> dict:
+        return {'state': self.state, 'failures': self.failures, 'trips': self.trips, 'rejected': self.rejected}
+
+class RetryBudget:
+    """Cada solicitud original aporta ``ratio`` fichas y cada reintento gasta una.
+
+    Así los reintentos nunca superan esa fracción del tráfico (más una
+    pequeña reserva de ``max_tokens``), y una caída de la API no multiplica
+    la carga con tormentas de reintentos.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def snapshot(self) -> dict:
+        return {'ratio': self.ratio, 'tokens': round(self.tokens, 2), 'retries': self.retries,
+                'exhausted': self.exhausted}
+
+class PoolStats:
+    """Métricas de un pool: esperas por conexión, timeouts y conexiones activas"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.pool_timeouts = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+
+    def record_pool_timeout(self):
+        with self._lock:
+            self.pool_timeouts += 1
+
+    def record_start(self):
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def record_end(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self.active -= 1
+            if isinstance(error, TimedOut):
+                self.timeouts += 1
+            elif error is not None:
+                self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'size': self.size,
+                'requests': self.requests,
+                'active': self.active,
+                'max_active': self.max_active,
+                'waits': self.waits,
+                'avg_wait_ms': round(self.wait_seconds / self.waits * 1000, 1) if self.waits else 0.0,
+                'pool_timeouts': self.pool_timeouts,
+                'timeouts': self.timeouts,
+                'errors': self.errors
+            }
+
+class TunedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest con tiempo de vida configurable para las conexiones keep-alive"""
+
+    def __init__(self, keepalive_expiry: float = 30.0, **kwargs):
+        super().__init__(**kwargs)
+        limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._client = self._build_client()
+
+def build_pool(size: int, pool_timeout: float, read_timeout: float, write_timeout: float,
+               http2: bool = False) -> HTTPXRequest:
+    """Crea un pool; si HTTP/2 no está disponible (falta el paquete h2) se usa HTTP/1.1"""
+    kwargs = dict(
+        keepalive_expiry=Config.BOT_API_KEEPALIVE_EXPIRY,
+        connection_pool_size=size,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        connect_timeout=10.0,
+        pool_timeout=pool_timeout
+    )
+    if http2:
+        try:
+            return TunedHTTPXRequest(http_version='2', **kwargs)
+        except RuntimeError as e:
+            logger.warning(f"HTTP/2 no disponible, se usa HTTP/1.1: {e}")
+    return TunedHTTPXRequest(**kwargs)
+
+class RoutedRequest(BaseRequest):
+    """Transporte de la Bot API que reparte las llamadas en pools por clase de tráfico.
+
+    La clase se toma de :func:`traffic_class` si está activa y, si no, del
+    método (documentos -> media, el resto -> interactive). Así un envío masivo
+    de recordatorios nunca ocupa las conexiones de las respuestas interactivas.
+
+    Es también la capa de resiliencia de todas las llamadas: reintenta con
+    backoff exponencial y jitter los errores transitorios (5xx, timeouts y
+    errores de red; en los métodos ``send*`` solo si la solicitud no llegó a
+    enviarse), espera los RetryAfter cortos, abre un circuito por endpoint
+    cuando falla de forma sostenida y limita los reintentos con un
+    :class:`RetryBudget`. Los errores permanentes (4xx) no se reintentan.
+    """
+
+    def __init__(self, pools: Dict[str, HTTPXRequest], pool_timeouts: Dict[str, float],
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 max_retry_after: float = 5.0, retry_budget: Optional[RetryBudget] = None,
+                 breaker_failures: int = 5, breaker_reset: float = 30.0):
+        self.pools = pools
+        self.pool_timeouts = pool_timeouts
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.retry_budget = retry_budget or RetryBudget(0.1)
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.breakers = {}  # endpoint -> CircuitBreaker
+        self.stats = {}
+        for name, pool in pools.items():
+            limit = pool._client_kwargs['limits'].max_connections
+            if pool.http_version == '2':
+                limit *= HTTP2_STREAMS_PER_CONNECTION
+            self.stats[name] = PoolStats(limit)
+        self._slots = None
+
+    @classmethod
+    def from_config(cls) -> 'RoutedRequest':
+        http2 = Config.BOT_API_HTTP2
+        specs = {
+            INTERACTIVE: (Config.BOT_API_INTERACTIVE_POOL, 5.0, 20.0, 20.0),
+            BULK: (Config.BOT_API_BULK_POOL, 30.0, 20.0, 20.0),
+            MEDIA: (Config.BOT_API_MEDIA_POOL, 30.0, 60.0, 60.0)
+        }
+        pools = {
+            name: build_pool(size, pool_timeout, read_timeout, write_timeout, http2=http2)
+            for name, (size, pool_timeout, read_timeout, write_timeout) in specs.items()
+        }
+        return cls(
+            pools, {name: spec[1] for name, spec in specs.items()},
+            max_retries=Config.BOT_API_MAX_RETRIES,
+            backoff_base=Config.BOT_API_BACKOFF_BASE,
+            backoff_cap=Config.BOT_API_BACKOFF_CAP,
+            max_retry_after=Config.BOT_API_MAX_RETRY_AFTER,
+            retry_budget=RetryBudget(Config.BOT_API_RETRY_BUDGET),
+            breaker_failures=Config.BOT_API_BREAKER_FAILURES,
+            breaker_reset=Config.BOT_API_BREAKER_RESET
+        )
+
+    async def initialize(self) -> None:
+        # Los semáforos se crean dentro del loop del bot
+        self._slots = {name: asyncio.Semaphore(stats.size) for name, stats in self.stats.items()}
+        for pool in self.pools.values():
+            await pool.initialize()
+
+    async def shutdown(self) -> None:
+        for pool in self.pools.values():
+            await pool.shutdown()
+
+    def classify(self, url: str) -> str:
+        explicit = _traffic_class.get()
+        if explicit in self.pools:
+            return explicit
+        endpoint = url.rsplit('/', 1)[-1]
+        return MEDIA if endpoint in MEDIA_METHODS else INTERACTIVE
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return breaker
+
+    async def _retry(self, endpoint: str, attempt: int, reason: str, delay: Optional[float] = None) -> bool:
+        """Espera antes de un reintento; False si se agotaron los intentos o el presupuesto"""
+        if attempt >= self.max_retries or not self.retry_budget.withdraw():
+            return False
+        if delay is None:
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+        logger.info(f"Reintento {attempt + 1} de {endpoint} en {delay:.2f}s ({reason})")
+        await asyncio.sleep(delay)
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        breaker = self.breaker(endpoint)
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpen(endpoint)
+            try:
+                with tracer.span(f"bot_api {endpoint}", kind='CLIENT', attempt=attempt) as span:
+                    status, payload = await self._send(
+                        url, method, request_data,
+                        read_timeout=read_timeout,
+                        write_timeout=write_timeout,
+                        connect_timeout=connect_timeout,
+                        pool_timeout=pool_timeout
+                    )
+                    if span is not None:
+                        span.tag('http.status_code', status)
+            except PoolTimeout:
+                # Congestión local, no de la API: sin reintento (ya esperó pool_timeout)
+                breaker.record_neutral()
+                raise
+            except NetworkError as e:  # Incluye TimedOut
+                breaker.record_failure()
+                retryable = is_idempotent(endpoint) or was_not_sent(e)
+                if not retryable or not await self._retry(endpoint, attempt, e.__class__.__name__):
+                    raise
+                attempt += 1
+                continue
+
+            if status >= 500:
+                breaker.record_failure()
+                if is_idempotent(endpoint) and await self._retry(endpoint, attempt, f"HTTP {status}"):
+                    attempt += 1
+                    continue
+                return status, payload
+
+            # Cualquier respuesta por debajo de 500 demuestra que la API funciona
+            breaker.record_success()
+            if status == 429:
+                retry_after = retry_after_seconds(payload)
+                # Esperas largas se devuelven como RetryAfter para que decida quien llama
+                if retry_after is not None and retry_after <= self.max_retry_after and await self._retry(
+                        endpoint, attempt, 'RetryAfter', retry_after + random.uniform(0, 0.5)):
+                    attempt += 1
+                    continue
+            return status, payload
+
+    async def _send(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData,
+        read_timeout,
+        write_timeout,
+        connect_timeout,
+        pool_timeout,
+    ) -> Tuple[int, bytes]:
+        name = self.classify(url)
+        stats = self.stats[name]
+        slots = self._slots[name]
+
+        if isinstance(pool_timeout, (int, float)):
+            wait_limit = pool_timeout
+        else:
+            wait_limit = self.pool_timeouts[name]
+
+        # Un semáforo con la capacidad del pool permite medir la espera por conexión
+        if slots.locked():
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(slots.acquire(), wait_limit)
+            except asyncio.TimeoutError:
+                stats.record_pool_timeout()
+                raise PoolTimeout(message=f"Pool timeout: pool '{name}' ocupado; la solicitud no se envió")
+            stats.record_wait(time.monotonic() - started)
+        else:
+            await slots.acquire()
+
+        stats.record_start()
+        error = None
+        try:
+            return await self.pools[name].do_request(
+                url, method, request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stats.record_end(error)
+            slots.release()
+
+    def stats_snapshot(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+    def resilience_snapshot(self) -> dict:
+        return {
+            'retry_budget': self.retry_budget.snapshot(),
+            'breakers': {endpoint: breaker.snapshot() for endpoint, breaker in list(self.breakers.items())}
+        }
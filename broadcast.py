@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+from sqlalchemy import and_, func, or_, update
+from telegram import Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import CallbackContext
+from database import SessionFactory, User
+from models import Broadcast
+from config import Config
+from bot_api import traffic_class, BULK
+from i18n import DEFAULT_LANGUAGE, language_cache, user_language, t
+
+logger = logging.getLogger(__name__)
+
+# Difusiones en curso en este proceso (evita lanzar dos veces la misma)
+_running = set()
+
+# Identifica a esta instancia como propietaria de las difusiones que envía
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+class RateLimiter:
+    """Espacia los envíos para no superar un número de mensajes por segundo"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class BulkSendResult:
+    """Resultado de un envío masivo"""
+
+    __slots__ = ('sent', 'failed', 'blocked_ids')
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.blocked_ids = []
+
+async def send_bulk(bot, chat_ids: Iterable[int], text: str, reply_markup=None, parse_mode=None,
+                    limiter: Optional[RateLimiter] = None,
+                    concurrency: int = Config.BROADCAST_CONCURRENCY) -> BulkSendResult:
+    """Envía el mismo mensaje a varios chats con concurrencia y ritmo limitados.
+
+    Los usuarios que bloquearon al bot se devuelven en ``blocked_ids``; un
+    RetryAfter de Telegram pausa el envío el tiempo indicado y se reintenta.
+    """
+    limiter = limiter or RateLimiter(Config.BROADCAST_RATE)
+    semaphore = asyncio.Semaphore(concurrency)
+    result = BulkSendResult()
+
+    async def send_one(chat_id: int):
+        async with semaphore:
+            for attempt in range(3):
+                await limiter.acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text,
+                                           reply_markup=reply_markup, parse_mode=parse_mode)
+                    result.sent += 1
+                    return
+                except RetryAfter as e:
+                    logger.warning(f"Límite de Telegram alcanzado, pausa de {e.retry_after}s")
+                    await asyncio.sleep(e.retry_after)
+                except Forbidden:
+                    result.blocked_ids.append(chat_id)
+                    return
+                except BadRequest as e:
+                    if 'chat not found' in str(e).lower():
+                        result.blocked_ids.append(chat_id)
+                    else:
+                        logger.warning(f"Envío rechazado para {chat_id}: {e}")
+                        result.failed += 1
+                    return
+                except Exception as e:
+                    logger.warning(f"Error enviando a {chat_id}: {e}")
+                    result.failed += 1
+                    return
+            result.failed += 1
+
+    with traffic_class(BULK):
+        await asyncio.gather(*(send_one(chat_id) for chat_id in chat_ids))
+    return result
+
+def mark_blocked(telegram_ids: List[int]):
+    """Marca en bloque a los usuarios que bloquearon al bot"""
+    if not telegram_ids:
+        return
+    db = SessionFactory()
+    try:
+        db.execute(
+            update(User)
+            .where(User.telegram_id.in_(telegram_ids))
+            .values(is_blocked=True)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error marcando usuarios bloqueados: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+def _next_recipients(db, after_user_id: int, limit: int) -> List[tuple]:
+    """Siguiente página de destinatarios (id, telegram_id) posterior al punto de control"""
+    query = (
+        db.query(User.id, User.telegram_id)
+        .filter(User.id > after_user_id, User.is_blocked.isnot(True))
+        .order_by(User.id)
+        .limit(limit)
+        .execution_options(stream_results=True, yield_per=limit)
+    )
+    return [(row.id, row.telegram_id) for row in query]
+
+def claim_broadcast(broadcast_id: int, lease: float = Config.BROADCAST_LEASE) -> Optional[Broadcast]:
+    """Toma la difusión para esta instancia; None si la tiene otra o ya terminó.
+
+    El UPDATE con la condición en el WHERE es atómico: de varias instancias
+    que reanudan la misma difusión solo una la obtiene. Una difusión cuyo
+    propietario lleva ``lease`` segundos sin avanzar se considera abandonada.
+    """
+    now = datetime.utcnow()
+    db = SessionFactory()
+    try:
+        claimed = db.execute(
+            update(Broadcast)
+            .where(
+                Broadcast.id == broadcast_id,
+                or_(
+                    Broadcast.status == 'pending',
+                    and_(
+                        Broadcast.status == 'running',
+                        or_(Broadcast.heartbeat_at.is_(None),
+                            Broadcast.heartbeat_at < now - timedelta(seconds=lease))
+                    )
+                )
+            )
+            .values(status='running', owner=INSTANCE_ID, heartbeat_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        return db.get(Broadcast, broadcast_id) if claimed else None
+    finally:
+        db.close()
+
+def _save_progress(broadcast_id: int, checkpoint: int, result: BulkSendResult) -> Optional[Broadcast]:
+    """Guarda el punto de control si esta instancia sigue siendo la propietaria"""
+    db = SessionFactory()
+    try:
+        saved = db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.owner == INSTANCE_ID)
+            .values(
+                last_user_id=checkpoint,
+                sent=func.coalesce(Broadcast.sent, 0) + result.sent,
+                failed=func.coalesce(Broadcast.failed, 0) + result.failed,
+                blocked=func.coalesce(Broadcast.blocked, 0) + len(result.blocked_ids),
+                heartbeat_at=datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        return db.get(Broadcast, broadcast_id) if saved else None
+    finally:
+        db.close()
+
+def _finish(broadcast_id: int) -> Optional[Broadcast]:
+    db = SessionFactory()
+    try:
+        finished = db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.owner == INSTANCE_ID)
+            .values(status='completed', finished_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        return db.get(Broadcast, broadcast_id) if finished else None
+    finally:
+        db.close()
+
+def _load_page(after_user_id: int, limit: int) -> List[tuple]:
+    db = SessionFactory()
+    try:
+        return _next_recipients(db, after_user_id, limit)
+    finally:
+        db.close()
+
+async def run_broadcast(bot, broadcast_id: int, page_size: int = Config.BROADCAST_PAGE_SIZE):
+    """Envía una difusión a todos los usuarios, guardando un punto de control por página.
+
+    Los destinatarios se recorren por páginas ordenadas por users.id, así la
+    memoria no depende del tamaño de la audiencia. Tras un reinicio se
+    continúa desde la última página confirmada; como mucho se repite una
+    página parcial. Cada paso usa su propia sesión (nunca la sesión del hilo
+    del loop, que comparten los handlers) y ninguna queda abierta durante los
+    envíos.
+    """
+    if broadcast_id in _running:
+        return
+    _running.add(broadcast_id)
+
+    try:
+        broadcast = claim_broadcast(broadcast_id)
+        if broadcast is None:
+            logger.info(f"Difusión {broadcast_id} terminada o en curso en otra instancia")
+            return
+
+        text = broadcast.text
+        checkpoint = broadcast.last_user_id or 0
+        limiter = RateLimiter(Config.BROADCAST_RATE)
+        started = time.monotonic()
+        processed = 0
+        logger.info(f"Difusión {broadcast_id} iniciada desde users.id > {checkpoint} ({INSTANCE_ID})")
+
+        while True:
+            recipients = _load_page(checkpoint, page_size)
+            if not recipients:
+                break
+
+            result = await send_bulk(bot, [telegram_id for _, telegram_id in recipients], text, limiter=limiter)
+            mark_blocked(result.blocked_ids)
+
+            checkpoint = recipients[-1][0]
+            broadcast = _save_progress(broadcast_id, checkpoint, result)
+            if broadcast is None:
+                logger.warning(f"Difusión {broadcast_id}: la retomó otra instancia; se detiene aquí")
+                return
+
+            processed += len(recipients)
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Difusión {broadcast_id}: {processed} procesados "
+                f"({processed / elapsed:.1f} msg/s), enviados={broadcast.sent} "
+                f"fallidos={broadcast.failed} bloqueados={broadcast.blocked}"
+            )
+
+        broadcast = _finish(broadcast_id)
+        if broadcast is None:
+            return
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Difusión {broadcast_id} completada en {elapsed:.0f}s: enviados={broadcast.sent} "
+            f"fallidos={broadcast.failed} bloqueados={broadcast.blocked}"
+        )
+        if broadcast.created_by:
+            lang = language_cache.get(broadcast.created_by) or DEFAULT_LANGUAGE
+            report = t(
+                'broadcast.report', lang,
+                broadcast_id=broadcast_id,
+                seconds=elapsed,
+                sent=broadcast.sent,
+                failed=broadcast.failed,
+                blocked=broadcast.blocked
+            )
+            await bot.send_message(chat_id=broadcast.created_by, text=report)
+    except Exception as e:
+        logger.error(f"Error en la difusión {broadcast_id}: {e}")
+    finally:
+        _running.discard(broadcast_id)
+
+def resume_broadcasts(application) -> int:
+    """Reanuda las difusiones interrumpidas por un reinicio o despliegue.
+
+    Cada instancia lo intenta; ``claim_broadcast`` decide cuál la envía.
+    """
+    db = SessionFactory()
+    try:
+        pending = [
+            broadcast_id for (broadcast_id,) in
+            db.query(Broadcast.id).filter(Broadcast.status.in_(('pending', 'running'))).order_by(Broadcast.id)
+        ]
+    finally:
+        db.close()
+
+    for broadcast_id in pending:
+        application.create_task(run_broadcast(application.bot, broadcast_id))
+    return len(pending)
+
+async def handle_broadcast_command(update: Update, context: CallbackContext):
+    """Manejador del comando /difundir <mensaje> (solo administradores)"""
+    user_id = update.effective_user.id
+    if user_id not in Config.ADMIN_IDS:
+        return
+
+    lang = user_language(update.effective_user)
+    text = update.message.text.partition(' ')[2].strip()
+    if not text:
+        await update.message.reply_text(t('broadcast.usage', lang))
+        return
+
+    db = SessionFactory()
+    try:
+        broadcast = Broadcast(text=text, created_by=user_id, status='pending')
+        db.add(broadcast)
+        db.commit()
+        broadcast_id = broadcast.id
+    finally:
+        db.close()
+
+    context.application.create_task(run_broadcast(context.bot, broadcast_id))
+    await update.message.reply_text(t('broadcast.started', lang, broadcast_id=broadcast_id))
@@ -11,13 +11,93 @@ class Config:
     # URL para el webhook (debes configurar esto en tu servidor)
     WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'https://nutrition-bot-y646.onrender.com/')
     
-    # Configuración de la base de datos
-    DATABASE_URL = os.getenv('DATABASE_URL', 'DATABASE_URL')
+    # Configuración de la base de datos (sin DATABASE_URL se usa SQLite local en modo WAL)
+    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///nutrition_bot.db')
+    SQLITE_WRITE_TIMEOUT = float(os.getenv('SQLITE_WRITE_TIMEOUT', 30))  # Segundos que un escritor espera el bloqueo (busy_timeout)
+    # Réplicas de solo lectura (URLs separadas por comas); vacío = todo va a la primaria
+    DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+    REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))  # Segundos de retraso tolerados en una réplica
+    REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 10))  # Segundos entre mediciones
+    READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 30))  # Lecturas a la primaria tras escribir
     
     # Configuración de pagos (Stripe, PayPal, etc.)
     STRIPE_API_KEY = os.getenv('STRIPE_API_KEY', '')
+    STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')  # Secreto de firma del webhook (whsec_...)
+    PAYMENT_BATCH_SIZE = int(os.getenv('PAYMENT_BATCH_SIZE', 50))  # Eventos de pago procesados por transacción
     PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID', '')
     
+    # Suscripciones premium
+    PREMIUM_SWEEP_INTERVAL = int(os.getenv('PREMIUM_SWEEP_INTERVAL', 300))  # Segundos entre barridos de expiración
+    ENTITLEMENT_CACHE_TTL = int(os.getenv('ENTITLEMENT_CACHE_TTL', 60))  # Segundos que se confía en la caché premium
+    
+    # Administración y difusiones (por debajo del límite global de ~30 mensajes/s de Telegram)
+    ADMIN_IDS = {int(i) for i in os.getenv('ADMIN_IDS', '').split(',') if i.strip()}  # telegram_id separados por comas
+    ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')  # Bearer para /admin/stats; vacío = endpoint desactivado
+    STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', 600))  # Segundos entre reconciliaciones
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))  # Mensajes por segundo
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 4))
+    BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', 500))  # Destinatarios por punto de control
+    BROADCAST_LEASE = int(os.getenv('BROADCAST_LEASE', 300))  # Segundos sin progreso tras los que otra instancia la retoma
+    
+    # Conexiones a la Bot API por clase de tráfico (ver bot_api.py)
+    BOT_API_INTERACTIVE_POOL = int(os.getenv('BOT_API_INTERACTIVE_POOL', 8))
+    BOT_API_BULK_POOL = int(os.getenv('BOT_API_BULK_POOL', 4))
+    BOT_API_MEDIA_POOL = int(os.getenv('BOT_API_MEDIA_POOL', 4))
+    BOT_API_HTTP2 = os.getenv('BOT_API_HTTP2', 'false').lower() == 'true'  # Requiere el paquete h2
+    BOT_API_KEEPALIVE_EXPIRY = float(os.getenv('BOT_API_KEEPALIVE_EXPIRY', 30))  # Segundos
+    BOT_API_MAX_RETRIES = int(os.getenv('BOT_API_MAX_RETRIES', 3))  # Reintentos por llamada ante errores transitorios
+    BOT_API_BACKOFF_BASE = float(os.getenv('BOT_API_BACKOFF_BASE', 0.5))  # Segundos; se duplica en cada intento
+    BOT_API_BACKOFF_CAP = float(os.getenv('BOT_API_BACKOFF_CAP', 8))  # Espera máxima entre reintentos
+    BOT_API_MAX_RETRY_AFTER = float(os.getenv('BOT_API_MAX_RETRY_AFTER', 5))  # RetryAfter mayores se propagan
+    BOT_API_RETRY_BUDGET = float(os.getenv('BOT_API_RETRY_BUDGET', 0.1))  # Reintentos máximos por solicitud original
+    BOT_API_BREAKER_FAILURES = int(os.getenv('BOT_API_BREAKER_FAILURES', 5))  # Fallos seguidos que abren el circuito
+    BOT_API_BREAKER_RESET = float(os.getenv('BOT_API_BREAKER_RESET', 30))  # Segundos con el circuito abierto
+    
+    # Control de sobrecarga del webhook (ver overload.py)
+    OVERLOAD_MAX_PENDING = int(os.getenv('OVERLOAD_MAX_PENDING', 40))  # Updates en curso antes de descartar
+    OVERLOAD_MAX_LAG_MS = float(os.getenv('OVERLOAD_MAX_LAG_MS', 250))  # Retraso tolerado del event loop
+    OVERLOAD_MAX_CONCURRENT = int(os.getenv('OVERLOAD_MAX_CONCURRENT', 16))  # Handlers simultáneos
+    OVERLOAD_DEFER_MAX_AGE = float(os.getenv('OVERLOAD_DEFER_MAX_AGE', 120))  # Segundos que espera un mensaje aplazado
+    
+    # Límite por usuario y agrupación de pulsaciones (ver throttling.py)
+    RATE_LIMIT_RATE = float(os.getenv('RATE_LIMIT_RATE', 2))  # Updates por segundo sostenidos por usuario
+    RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', 10))  # Ráfaga máxima por usuario
+    RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', 50000))  # Buckets en memoria
+    WATER_TAP_WINDOW = float(os.getenv('WATER_TAP_WINDOW', 0.7))  # Segundos en que se suman pulsaciones de agua
+    
+    # Ediciones de mensajes (ver message_edits.py)
+    EDIT_CACHE_SIZE = int(os.getenv('EDIT_CACHE_SIZE', 20000))  # Mensajes cuyo último contenido se recuerda
+    
+    # Trazas por update en formato Zipkin v2 (ver tracing.py)
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))  # Fracción de updates exportados (0 = desactivado)
+    TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 0))  # Exporta además los updates más lentos que esto
+    TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')  # Destino si no hay colector
+    TRACE_COLLECTOR_URL = os.getenv('TRACE_COLLECTOR_URL', '')  # Ej: http://zipkin:9411/api/v2/spans
+    TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', 1000))  # Trazas en espera de exportar
+    
+    # Detector de bloqueos del event loop (ver loop_watchdog.py)
+    LOOP_WATCHDOG_ENABLED = os.getenv('LOOP_WATCHDOG_ENABLED', 'true').lower() == 'true'
+    LOOP_BLOCK_THRESHOLD_MS = float(os.getenv('LOOP_BLOCK_THRESHOLD_MS', 100))  # Bloqueo mínimo que se registra
+    
+    # Profiler por muestreo de /debug/profile (ver profiler.py)
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))  # Duración máxima de un perfil
+    PROFILE_HZ = float(os.getenv('PROFILE_HZ', 100))  # Muestras por segundo
+    
+    # Logging (ver logging_setup.py)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_JSON = os.getenv('LOG_JSON', 'false').lower() == 'true'  # Una línea JSON por registro
+    LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')  # Ej: 'app=0.1,database=0.2' (fracción de INFO conservada)
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # Registros en espera; si se llena se descartan
+    
+    # Idiomas (ver i18n.py)
+    LANGUAGE_CACHE_SIZE = int(os.getenv('LANGUAGE_CACHE_SIZE', 100000))  # Usuarios cuyo idioma se guarda en memoria
+    
+    # Estado de conversación (ver conversation_state.py)
+    CONVERSATION_STATE_BACKEND = os.getenv('CONVERSATION_STATE_BACKEND', 'database')  # 'database' o 'memory'
+    CONVERSATION_STATE_TTL = int(os.getenv('CONVERSATION_STATE_TTL', 3600))  # Segundos de inactividad antes de descartar
+    CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 10000))  # Entradas en memoria por proceso
+    CONVERSATION_CACHE_TTL = float(os.getenv('CONVERSATION_CACHE_TTL', 5))  # Segundos que se confía en la copia local
+    
     # Mega (para los PDFs)    
     MEGA_EMAIL = os.getenv('MEGA_EMAIL', 'MEGA_EMAIL')
     MEGA_PASSWORD = os.getenv('MEGA_PASSWORD', 'MEGA_PASSWORD')
\ No newline at end of file
@@ -0,0 +1,212 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+from sqlalchemy import delete
+from telegram.ext import CallbackContext
+from database import SessionFactory
+from models import ConversationState
+from repository import expired_states_condition
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Estados conocidos
+AWAITING_WEIGHT = 'awaiting_weight'
+
+class StateEntry(NamedTuple):
+    state: str
+    data: Optional[dict]
+    expires_at: datetime
+
+class DatabaseStateBackend:
+    """Estados en la tabla conversation_states (SQLite o Postgres), compartidos entre instancias.
+
+    Cada operación abre su propia sesión: cerrar la sesión compartida del hilo
+    descartaría los cambios sin confirmar del handler que consulta el estado.
+    """
+
+    def get(self, telegram_id: int) -> Optional[StateEntry]:
+        db = SessionFactory()
+        try:
+            row = db.get(ConversationState, telegram_id)
+            if row is None:
+                return None
+            return StateEntry(row.state, json.loads(row.data) if row.data else None, row.expires_at)
+        finally:
+            db.close()
+
+    def set(self, telegram_id: int, entry: StateEntry):
+        values = {
+            'telegram_id': telegram_id,
+            'state': entry.state,
+            'data': json.dumps(entry.data, separators=(',', ':')) if entry.data else None,
+            'expires_at': entry.expires_at
+        }
+        db = SessionFactory()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect in ('postgresql', 'sqlite'):
+                if dialect == 'postgresql':
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                stmt = insert(ConversationState).values(**values)
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=['telegram_id'],
+                    set_={key: stmt.excluded[key] for key in ('state', 'data', 'expires_at')}
+                ))
+            else:
+                db.merge(ConversationState(**values))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def delete(self, telegram_id: int):
+        db = SessionFactory()
+        try:
+            db.execute(delete(ConversationState).where(ConversationState.telegram_id == telegram_id))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def purge_expired(self, now: datetime) -> int:
+        db = SessionFactory()
+        try:
+            result = db.execute(delete(ConversationState).where(expired_states_condition(now)))
+            db.commit()
+            return result.rowcount
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+class MemoryStateBackend:
+    """Estados solo en memoria (una instancia, desarrollo); se pierden al reiniciar"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int) -> Optional[StateEntry]:
+        return self._entries.get(telegram_id)
+
+    def set(self, telegram_id: int, entry: StateEntry):
+        with self._lock:
+            self._entries[telegram_id] = entry
+
+    def delete(self, telegram_id: int):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def purge_expired(self, now: datetime) -> int:
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+class ConversationStateStore:
+    """Estado de conversación por usuario con una caché LRU acotada delante del backend.
+
+    La caché local guarda también la ausencia de estado, y sus entradas duran
+    poco (``cache_ttl``) para que un cambio hecho por otra instancia se vea
+    enseguida. Los estados sin actividad durante ``state_ttl`` segundos se
+    descartan, así ni la memoria ni la tabla crecen con el número de usuarios.
+    """
+
+    def __init__(self, backend, state_ttl: float, max_entries: int = 10000, cache_ttl: float = 5):
+        self.backend = backend
+        self.state_ttl = state_ttl
+        self.max_entries = max_entries
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()  # telegram_id -> (StateEntry o None, cargado_en)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'ConversationStateStore':
+        if Config.CONVERSATION_STATE_BACKEND == 'memory':
+            backend = MemoryStateBackend()
+        else:
+            backend = DatabaseStateBackend()
+        return cls(
+            backend,
+            state_ttl=Config.CONVERSATION_STATE_TTL,
+            max_entries=Config.CONVERSATION_CACHE_SIZE,
+            cache_ttl=Config.CONVERSATION_CACHE_TTL
+        )
+
+    def _remember(self, telegram_id: int, entry: Optional[StateEntry]):
+        with self._lock:
+            self._cache[telegram_id] = (entry, time.monotonic())
+            self._cache.move_to_end(telegram_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _cached(self, telegram_id: int):
+        """Devuelve (encontrado, entrada)"""
+        with self._lock:
+            cached = self._cache.get(telegram_id)
+            if cached is None:
+                return False, None
+            entry, loaded_at = cached
+            if time.monotonic() - loaded_at > self.cache_ttl:
+                del self._cache[telegram_id]
+                return False, None
+            self._cache.move_to_end(telegram_id)
+            return True, entry
+
+    def get(self, telegram_id: int) -> Optional[StateEntry]:
+        found, entry = self._cached(telegram_id)
+        if not found:
+            entry = self.backend.get(telegram_id)
+            self._remember(telegram_id, entry)
+        if entry is not None and entry.expires_at <= datetime.utcnow():
+            return None
+        return entry
+
+    def get_state(self, telegram_id: int) -> Optional[str]:
+        entry = self.get(telegram_id)
+        return entry.state if entry else None
+
+    def set(self, telegram_id: int, state: str, data: Optional[dict] = None):
+        entry = StateEntry(state, data, datetime.utcnow() + timedelta(seconds=self.state_ttl))
+        self.backend.set(telegram_id, entry)
+        self._remember(telegram_id, entry)
+
+    def clear(self, telegram_id: int):
+        self.backend.delete(telegram_id)
+        self._remember(telegram_id, None)
+
+    def purge_expired(self) -> int:
+        """Elimina del backend y de la caché los estados inactivos"""
+        now = datetime.utcnow()
+        with self._lock:
+            for telegram_id in [key for key, (entry, _) in self._cache.items()
+                                if entry is not None and entry.expires_at <= now]:
+                del self._cache[telegram_id]
+        return self.backend.purge_expired(now)
+
+    def __len__(self):
+        return len(self._cache)
+
+conversation_states = ConversationStateStore.from_config()
+
+async def purge_conversation_states(context: CallbackContext):
+    """Job periódico: descarta los estados de conversación abandonados"""
+    try:
+        purged = conversation_states.purge_expired()
+        if purged:
+            logger.info(f"Estados de conversación expirados eliminados: {purged}")
+    except Exception as e:
+        logger.error(f"Error purgando estados de conversación: {e}")
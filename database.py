@@ -1,50 +1,284 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, func, select, text, update
+from sqlalchemy.orm import Session as BaseSession, sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.dml import UpdateBase
 import logging
+from datetime import date, datetime, timezone
 from typing import Optional
-from zoneinfo import ZoneInfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # Importamos los modelos consolidados desde models.py
-from models import Base, User, WaterLog, PlanDownload, Payment, UserSettings, utcnow
+from models import User, WaterLog, PlanDownload, Payment, UserSettings, utcnow, DEFAULT_TIMEZONE
+from config import Config
+from tracing import instrument_engine
+from repository import last_water_log_query
 
-# Configuración básica de logging
-logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Obtener URL de la base de datos
-DATABASE_URL = os.getenv('DATABASE_URL')
+DATABASE_URL = Config.DATABASE_URL
 
 # Ajustar URL para SQLAlchemy (postgres:// → postgresql://)
 if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 
+# Pragmas de SQLite: WAL permite lectores simultáneos a un escritor y
+# synchronous=NORMAL es seguro con WAL (solo se puede perder la última
+# transacción ante un corte de energía, nunca corromper la base)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'busy_timeout': int(Config.SQLITE_WRITE_TIMEOUT * 1000),
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,  # ~20 MB
+    'mmap_size': 134217728  # 128 MB
+}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def build_engine(url: str):
+    """Motor para Postgres o SQLite (archivo o memoria) con la configuración adecuada"""
+    if not url.startswith('sqlite'):
+        pg_engine = create_engine(
+            url,
+            pool_size=5,
+            max_overflow=10,
+            pool_pre_ping=True,
+            pool_recycle=300,
+            echo=False  # Cambiar a True para debug
+        )
+        instrument_engine(pg_engine)
+        return pg_engine
+
+    # SQLite admite un único escritor. sqlite3 abre la transacción justo antes
+    # de la primera escritura (las lecturas previas no quedan dentro) y con
+    # isolation_level='IMMEDIATE' lo hace con BEGIN IMMEDIATE: el bloqueo de
+    # escritura se toma al empezar y, si lo tiene otro, SQLite espera hasta
+    # busy_timeout en lugar de fallar al promover una transacción de lectura.
+    # La espera ocurre dentro de SQLite, sin locks de Python que el hilo del
+    # loop pueda retener entre dos await.
+    in_memory = url in ('sqlite://', 'sqlite:///:memory:')
+    sqlite_engine = create_engine(
+        url,
+        connect_args={
+            'check_same_thread': False,
+            'timeout': Config.SQLITE_WRITE_TIMEOUT,
+            'isolation_level': 'IMMEDIATE'
+        },
+        # En memoria todos los hilos deben compartir la misma conexión
+        poolclass=StaticPool if in_memory else None,
+        echo=False
+    )
+    event.listen(sqlite_engine, 'connect', _set_sqlite_pragmas)
+    instrument_engine(sqlite_engine)
+    return sqlite_engine
+
 # Configuración del motor de base de datos
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=False  # Cambiar a True para debug
-)
-
-# Crear todas las tablas si no existen
-if os.getenv('RESET_DB_ON_START', 'false').lower() == 'true':
-    Base.metadata.drop_all(engine)  # ¡Cuidado! Esto borrará todas las tablas
-    logger.warning("⚠️ Base de datos reiniciada - TODAS LAS TABLAS ELIMINADAS")
-
-Base.metadata.create_all(engine)
+engine = build_engine(DATABASE_URL)
+
+# El esquema se crea y actualiza con migraciones: python migrations.py upgrade
+
+def _replica_url(url: str) -> str:
+    return url.replace('postgres://', 'postgresql://', 1) if url.startswith('postgres://') else url
+
+# Réplicas de solo lectura
+replica_engines = [build_engine(_replica_url(url)) for url in Config.DATABASE_REPLICA_URLS]
+
+# Usuario cuyo update se está procesando (para leer sus propias escrituras)
+_current_user = contextvars.ContextVar('db_current_user', default=None)
+
+@contextmanager
+def user_scope(telegram_id: Optional[int]):
+    """Asocia las sesiones abiertas dentro del bloque a un usuario de Telegram"""
+    token = _current_user.set(telegram_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+class RecentWrites:
+    """Usuarios con escrituras recientes: sus lecturas van a la primaria durante un tiempo"""
+
+    def __init__(self, window: float, max_entries: int = 100000):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # telegram_id -> momento de la última escritura
+        self._lock = threading.Lock()
+
+    def record(self, telegram_id: int):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[telegram_id] = now
+            self._entries.move_to_end(telegram_id)
+            # Las entradas están ordenadas por antigüedad: se podan por delante
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or now - next(iter(self._entries.values())) > self.window):
+                self._entries.popitem(last=False)
+
+    def is_recent(self, telegram_id: int) -> bool:
+        with self._lock:
+            written_at = self._entries.get(telegram_id)
+        return written_at is not None and time.monotonic() - written_at <= self.window
+
+recent_writes = RecentWrites(Config.READ_YOUR_WRITES_SECONDS)
+
+class ReplicaRouter:
+    """Reparte las lecturas entre las réplicas cuyo retraso está dentro de la tolerancia.
+
+    El retraso se mide en un hilo propio cada ``check_interval`` segundos;
+    ``pick`` solo consulta el último resultado y nunca hace E/S en el hilo
+    que atiende el update (el loop del bot).
+    """
+
+    def __init__(self, engines, max_lag: float, check_interval: float):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = [0.0] * len(engines)
+        self.healthy = [True] * len(engines)
+        self.reads = [0] * len(engines)
+        self.primary_reads = 0
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.engines and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='ReplicaLagThread')
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.check_interval)
+
+    def _measure_lag(self, replica_engine) -> float:
+        if replica_engine.dialect.name != 'postgresql':
+            return 0.0  # SQLite y otros motores locales no replican
+        with replica_engine.connect() as conn:
+            lag = conn.execute(text(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )).scalar()
+        return float(lag or 0)
+
+    def refresh(self):
+        """Mide el retraso de cada réplica y excluye las que superan la tolerancia"""
+        for index, replica_engine in enumerate(self.engines):
+            try:
+                self.lag[index] = self._measure_lag(replica_engine)
+                healthy = self.lag[index] <= self.max_lag
+            except Exception as e:
+                logger.warning(f"Réplica {index} no disponible: {e}")
+                healthy = False
+            if healthy != self.healthy[index]:
+                logger.info(f"Réplica {index} {'disponible' if healthy else 'excluida'} (retraso {self.lag[index]:.1f}s)")
+            self.healthy[index] = healthy
+
+    def pick(self):
+        """Motor para una lectura: una réplica sana por turnos, o None si no hay"""
+        if not self.engines:
+            return None
+        candidates = [index for index, healthy in enumerate(self.healthy) if healthy]
+        if not candidates:
+            return None
+        index = candidates[next(self._next) % len(candidates)]
+        with self._lock:
+            self.reads[index] += 1
+        return self.engines[index]
+
+    def count_primary_read(self):
+        # Se llama desde el loop del bot y desde otros hilos
+        with self._lock:
+            self.primary_reads += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reads = list(self.reads)
+            primary_reads = self.primary_reads
+        return {
+            'replicas': [
+                {'healthy': self.healthy[i], 'lag_s': round(self.lag[i], 2), 'reads': reads[i]}
+                for i in range(len(self.engines))
+            ],
+            'primary_reads': primary_reads
+        }
+
+replica_router = ReplicaRouter(replica_engines, Config.REPLICA_MAX_LAG, Config.REPLICA_LAG_CHECK_INTERVAL)
+
+class RoutingSession(BaseSession):
+    """Sesión que envía las escrituras a la primaria y, si es de solo lectura, las lecturas a réplicas.
+
+    Aun en modo lectura van a la primaria: las consultas marcadas con
+    ``execution_options(use_primary=True)`` (leer para luego escribir), todo
+    lo que siga a una escritura en la misma sesión y las lecturas de un
+    usuario que escribió hace menos de READ_YOUR_WRITES_SECONDS.
+    """
+
+    def __init__(self, *args, readonly: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.readonly = readonly
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if clause is not None and isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        if not self.readonly or self.info.get('wrote') or self.info.get('pinned') or self._flushing:
+            return engine
+        if clause is not None and clause.get_execution_options().get('use_primary'):
+            return engine
+        telegram_id = _current_user.get()
+        if telegram_id is not None and recent_writes.is_recent(telegram_id):
+            replica_router.count_primary_read()
+            return engine
+        return replica_router.pick() or engine
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush_write(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _record_commit(session):
+    if session.info.pop('wrote', False):
+        # Tras confirmar una escritura, la sesión sigue leyendo de la primaria
+        session.info['pinned'] = True
+        telegram_id = _current_user.get()
+        if telegram_id is not None:
+            recent_writes.record(telegram_id)
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _clear_write_mark(session):
+    session.info.pop('wrote', None)
 
 # Configuración de la sesión
-SessionFactory = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+SessionFactory = sessionmaker(bind=engine, class_=RoutingSession, autoflush=False, expire_on_commit=False)
+ReadSessionFactory = sessionmaker(bind=engine, class_=RoutingSession, autoflush=False,
+                                  expire_on_commit=False, readonly=True)
 Session = scoped_session(SessionFactory)
 
 def get_db_session():
     """Obtiene una nueva sesión de base de datos con manejo seguro"""
     return Session()
 
+def get_read_session():
+    """Sesión para rutas de solo lectura: consulta réplicas si están configuradas"""
+    return ReadSessionFactory()
+
 def user_exists(telegram_id: int) -> bool:
     """Verifica si un usuario ya está registrado"""
     db = get_db_session()
@@ -76,18 +310,20 @@ def get_or_create_user(telegram_id: int,
                 language='es'  # Valor por defecto
             )
             db.add(user)
+            db.flush()  # Necesario para disponer de user.id
             
             # Crear configuración inicial
             settings = UserSettings(
                 user_id=user.id,
                 water_reminders_enabled=True,
-                reminder_start_time='08:00',  # 8 AM UTC-4
-                reminder_end_time='22:00'     # 10 PM UTC-4
+                reminder_start_time='08:00',  # 8 AM hora local
+                reminder_end_time='22:00',    # 10 PM hora local
+                timezone=DEFAULT_TIMEZONE
             )
             db.add(settings)
             
             db.commit()
-            logger.info(f"Nuevo usuario creado: {telegram_id}")
+            logger.info("Nuevo usuario creado: %s", telegram_id)
         else:
             # Actualizar datos si es necesario
             update_needed = False
@@ -103,9 +339,9 @@ def get_or_create_user(telegram_id: int,
                 
             if update_needed:
                 db.commit()
-                logger.info(f"Usuario actualizado: {telegram_id}")
+                logger.info("Usuario actualizado: %s", telegram_id)
             else:
-                logger.info(f"Usuario existente encontrado: {telegram_id}")
+                logger.info("Usuario existente encontrado: %s", telegram_id)
         
         return user
     except Exception as e:
@@ -129,6 +365,77 @@ def get_user_settings(telegram_id: int) -> Optional[UserSettings]:
     finally:
         db.close()
 
+def local_date(tz_name: Optional[str], now_utc: Optional[datetime] = None) -> date:
+    """Fecha local actual en la zona del usuario (zona por defecto si no es válida)"""
+    now_utc = now_utc or datetime.now(timezone.utc)
+    try:
+        tz = ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = ZoneInfo(DEFAULT_TIMEZONE)
+    return now_utc.astimezone(tz).date()
+
+def roll_over_water_day(db, telegram_id: int, now_utc: Optional[datetime] = None) -> bool:
+    """Cierra el día de agua del usuario si current_water pertenece a un día anterior.
+
+    Se llama antes de leer o escribir el consumo: en el primer acceso de un
+    nuevo día local se registra el WaterLog de reset y se pone a cero el
+    contador. No depende de ningún job a medianoche, así que el reinicio es
+    correcto aunque el servicio haya estado detenido. Devuelve True si reinició.
+    """
+    now_utc = now_utc or datetime.now(timezone.utc)
+    row = db.execute(
+        select(
+            User.id,
+            func.coalesce(User.current_water, 0).label('current_water'),
+            User.water_date,
+            UserSettings.timezone
+        )
+        .outerjoin(UserSettings, UserSettings.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .execution_options(use_primary=True)  # Se lee para escribir: nunca de una réplica
+    ).first()
+    if not row:
+        return False
+
+    today = local_date(row.timezone, now_utc)
+    water_date = row.water_date
+    if water_date is None:
+        # Usuarios anteriores a la columna: el día se deduce del último registro
+        last_log = db.execute(
+            last_water_log_query(row.id).execution_options(use_primary=True)
+        ).scalar()
+        # water_logs.timestamp se guarda en UTC sin zona (models.utcnow)
+        water_date = local_date(row.timezone, last_log.replace(tzinfo=timezone.utc)) if last_log else today
+    if water_date >= today:
+        if row.water_date is None:
+            db.execute(update(User).where(User.id == row.id).values(water_date=today))
+            db.commit()
+        return False
+
+    # El UPDATE condicionado evita un doble reinicio si dos updates llegan a la vez
+    result = db.execute(
+        update(User)
+        .where(
+            User.id == row.id,
+            func.coalesce(User.current_water, 0) == row.current_water,
+            (User.water_date.is_(None)) | (User.water_date < today)
+        )
+        .values(current_water=0, water_date=today, last_water_reminder=None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        return False
+
+    db.add(WaterLog(
+        user_id=row.id,
+        amount=row.current_water,
+        is_daily_reset=True,
+        timestamp=now_utc.astimezone(timezone.utc).replace(tzinfo=None)
+    ))
+    db.commit()
+    return True
+
 def reset_user_water(telegram_id: int) -> bool:
     """Resetea el contador de agua para un usuario y registra el evento"""
     db = get_db_session()
@@ -162,6 +469,7 @@ def log_water_consumption(telegram_id: int, amount: float) -> bool:
     """Registra el consumo de agua para un usuario"""
     db = get_db_session()
     try:
+        roll_over_water_day(db, telegram_id)
         user = db.query(User).filter_by(telegram_id=telegram_id).first()
         if not user:
             return False
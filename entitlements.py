@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, List, Optional
+from sqlalchemy import update
+from telegram.ext import CallbackContext
+from database import SessionFactory, get_read_session, User
+from repository import expired_premium_condition
+from config import Config
+from broadcast import RateLimiter, send_bulk, mark_blocked
+from keyboards import renew_premium_keyboard
+from i18n import DEFAULT_LANGUAGE, language_cache, t
+from stats import admin_stats
+
+logger = logging.getLogger(__name__)
+
+# Expiración usada para premium sin fecha de fin (p.ej. asignado manualmente)
+LIFETIME = datetime.max
+
+def effective_expiry(is_premium: bool, premium_expiry: Optional[datetime]) -> Optional[datetime]:
+    """Normaliza el estado premium a una única fecha de expiración (None = sin premium)"""
+    if not is_premium:
+        return None
+    return premium_expiry or LIFETIME
+
+class EntitlementCache:
+    """Caché LRU en memoria de telegram_id -> expiración premium.
+
+    Se guarda la fecha de expiración y no un booleano, así una suscripción que
+    vence deja de contar como premium sin invalidar nada. El TTL solo cubre
+    pagos aplicados por otra instancia.
+    """
+
+    def __init__(self, max_entries: int = 100000, ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # telegram_id -> (expiración, cargado_en)
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int):
+        """Devuelve (encontrado, expiración)"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                return False, None
+            expiry, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._entries[telegram_id]
+                return False, None
+            self._entries.move_to_end(telegram_id)
+            return True, expiry
+
+    def set(self, telegram_id: int, expiry: Optional[datetime]):
+        with self._lock:
+            self._entries[telegram_id] = (expiry, time.monotonic())
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_many(self, telegram_ids: Iterable[int], expiry: Optional[datetime]):
+        for telegram_id in telegram_ids:
+            self.set(telegram_id, expiry)
+
+    def invalidate(self, telegram_id: int):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+entitlement_cache = EntitlementCache(ttl=Config.ENTITLEMENT_CACHE_TTL)
+
+def remember_user(user: User):
+    """Actualiza la caché a partir de un usuario ya cargado (sin consulta extra)"""
+    entitlement_cache.set(user.telegram_id, effective_expiry(user.is_premium, user.premium_expiry))
+
+def get_premium_expiry(telegram_id: int) -> Optional[datetime]:
+    """Expiración premium del usuario, consultando la BD solo si no está en caché"""
+    found, expiry = entitlement_cache.get(telegram_id)
+    if found:
+        return expiry
+
+    db = get_read_session()
+    try:
+        row = db.query(User.is_premium, User.premium_expiry).filter_by(telegram_id=telegram_id).first()
+        expiry = effective_expiry(row.is_premium, row.premium_expiry) if row else None
+    finally:
+        db.close()
+
+    entitlement_cache.set(telegram_id, expiry)
+    return expiry
+
+def is_premium(telegram_id: int, now: Optional[datetime] = None) -> bool:
+    """¿Tiene el usuario premium vigente en este momento?"""
+    expiry = get_premium_expiry(telegram_id)
+    return expiry is not None and expiry > (now or datetime.utcnow())
+
+def warm_entitlement_cache() -> int:
+    """Precarga en una consulta a todos los usuarios premium vigentes"""
+    db = get_read_session()
+    try:
+        rows = db.query(User.telegram_id, User.is_premium, User.premium_expiry).filter(
+            User.is_premium.is_(True)
+        ).all()
+    finally:
+        db.close()
+
+    for row in rows:
+        entitlement_cache.set(row.telegram_id, effective_expiry(row.is_premium, row.premium_expiry))
+    return len(rows)
+
+def expire_subscriptions(now: Optional[datetime] = None) -> List[int]:
+    """Marca como no premium, con un único UPDATE, las suscripciones vencidas"""
+    now = now or datetime.utcnow()
+    expired_filter = expired_premium_condition(now)
+    db = SessionFactory()
+    try:
+        stmt = update(User).where(*expired_filter).values(is_premium=False)
+        if db.get_bind().dialect.update_returning:
+            result = db.execute(stmt.returning(User.telegram_id).execution_options(synchronize_session=False))
+            expired = [row.telegram_id for row in result]
+        else:
+            # Motores sin UPDATE ... RETURNING (p.ej. SQLite < 3.35)
+            expired = [row.telegram_id for row in db.query(User.telegram_id).filter(*expired_filter)]
+            if expired:
+                db.execute(
+                    stmt.where(User.telegram_id.in_(expired)).execution_options(synchronize_session=False)
+                )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    entitlement_cache.set_many(expired, None)
+    admin_stats.record_premium_expired(len(expired))
+    return expired
+
+async def notify_expired_users(bot, telegram_ids: List[int]):
+    """Avisa a los usuarios cuya suscripción venció con un envío masivo limitado por idioma"""
+    by_language = {}
+    for telegram_id in telegram_ids:
+        lang = language_cache.get(telegram_id) or DEFAULT_LANGUAGE
+        by_language.setdefault(lang, []).append(telegram_id)
+
+    limiter = RateLimiter(Config.BROADCAST_RATE)
+    failed = 0
+    for lang, chat_ids in by_language.items():
+        result = await send_bulk(
+            bot,
+            chat_ids,
+            t('premium.expired', lang),
+            reply_markup=renew_premium_keyboard(lang),
+            limiter=limiter
+        )
+        mark_blocked(result.blocked_ids)
+        failed += result.failed
+    if failed:
+        logger.warning(f"No se pudo avisar la expiración a {failed} usuarios")
+
+async def sweep_expired_premium(context: CallbackContext):
+    """Job periódico: expira suscripciones vencidas y avisa a los afectados"""
+    try:
+        expired = expire_subscriptions()
+        if expired:
+            logger.info(f"Suscripciones premium expiradas: {len(expired)}")
+            await notify_expired_users(context.bot, expired)
+    except Exception as e:
+        logger.error(f"Error en sweep_expired_premium: {e}")
@@ -0,0 +1,280 @@
+"""Exportación en streaming de usuarios, configuración, consumo de agua y descargas.
+
+Uso:
+    python export_data.py --out exports/ --format jsonl
+    python export_data.py --out exports/ --format csv --since 2025-01-01 --until 2025-02-01
+    python export_data.py --out exports/ --resume          # continúa una exportación interrumpida
+    python export_data.py --out exports/ --user 123456789  # datos de un solo usuario
+
+Las filas se leen con cursores del lado del servidor (stream_results) y se
+escriben por bloques, cada uno como un miembro gzip independiente, por lo que
+la memoria es constante sin importar el tamaño de las tablas. Tras cada bloque
+se guarda un punto de control (último id y tamaño del archivo) en
+``.export_state.json``, junto con los filtros de la exportación; ``--resume``
+recorta el archivo a ese tamaño y sigue desde ahí, y se niega a continuar si
+los filtros no son los mismos.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from typing import Optional
+from sqlalchemy import or_, select
+from telegram import Update
+from telegram.ext import CallbackContext
+from database import engine
+from models import User, UserSettings, WaterLog, PlanDownload, Payment, PlanRotation, ConversationState
+from logging_setup import configure_logging
+from i18n import user_language, t
+
+logger = logging.getLogger(__name__)
+
+# Tabla -> columna usada para filtrar por rango de fechas (None = sin filtro)
+EXPORT_TABLES = {
+    'users': (User.__table__, User.__table__.c.registered_at),
+    'user_settings': (UserSettings.__table__, None),
+    'water_logs': (WaterLog.__table__, WaterLog.__table__.c.timestamp),
+    'plan_downloads': (PlanDownload.__table__, PlanDownload.__table__.c.downloaded_at),
+    'payments': (Payment.__table__, Payment.__table__.c.created_at)
+}
+
+# /mis_datos incluye además las tablas sin id ni fecha que guardan datos del usuario
+USER_DATA_TABLES = {
+    **EXPORT_TABLES,
+    'plan_rotations': (PlanRotation.__table__, None),
+    'conversation_states': (ConversationState.__table__, None)
+}
+
+CHUNK_ROWS = 5000
+STATE_FILE = '.export_state.json'
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"Tipo no serializable: {type(value)}")
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def build_query(name: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                telegram_id: Optional[int] = None, after_id: int = 0):
+    """Consulta ordenada por clave primaria para una tabla, con filtros de fecha, usuario y reanudación"""
+    table, date_column = USER_DATA_TABLES[name]
+    query = select(table).order_by(*table.primary_key.columns)
+    if 'id' in table.c:
+        query = query.where(table.c.id > after_id)
+    if date_column is not None:
+        if since:
+            query = query.where(date_column >= since)
+        if until:
+            query = query.where(date_column < until)
+    if telegram_id is not None:
+        user_ids = select(User.id).where(User.telegram_id == telegram_id).scalar_subquery()
+        if 'user_id' not in table.c:
+            query = query.where(table.c.telegram_id == telegram_id)
+        elif 'telegram_id' in table.c:
+            # Pagos huérfanos: sin user_id pero con el telegram_id del pagador
+            query = query.where(or_(table.c.user_id == user_ids, table.c.telegram_id == telegram_id))
+        else:
+            query = query.where(table.c.user_id == user_ids)
+    return query
+
+def stream_rows(query, chunk_rows: int = CHUNK_ROWS):
+    """Itera las filas en bloques usando un cursor del lado del servidor"""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(query)
+        for partition in result.partitions(chunk_rows):
+            yield partition
+
+def encode_chunk(rows, columns, fmt: str, write_header: bool, table_name: Optional[str] = None) -> bytes:
+    """Serializa un bloque de filas como un miembro gzip completo"""
+    text = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(text)
+        if write_header:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_csv_value(value) for value in row])
+    else:
+        for row in rows:
+            record = dict(zip(columns, row))
+            if table_name:
+                record = {'table': table_name, **record}
+            text.write(json.dumps(record, default=_json_default, ensure_ascii=False))
+            text.write('\n')
+    return gzip.compress(text.getvalue().encode('utf-8'))
+
+class ExportState:
+    """Puntos de control por tabla: último id exportado y tamaño confirmado del archivo.
+
+    Se guardan junto con los filtros (formato, fechas y usuario) con los que
+    se escribieron, para no mezclar en un archivo filas de otra exportación.
+    """
+
+    def __init__(self, path: str, filters: dict):
+        self.path = path
+        self.filters = filters
+        self.saved_filters = None
+        self.tables = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.saved_filters = data.get('filters')
+            self.tables = data.get('tables', {})
+
+    def can_resume(self) -> bool:
+        return not self.tables or self.saved_filters == self.filters
+
+    def reset(self):
+        self.tables = {}
+
+    def get(self, name: str) -> dict:
+        return self.tables.get(name, {'last_id': 0, 'bytes': 0, 'rows': 0, 'done': False})
+
+    def save(self, name: str, **values):
+        self.tables[name] = {**self.get(name), **values}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'filters': self.filters, 'tables': self.tables}, f)
+        os.replace(tmp_path, self.path)
+
+def export_table(name: str, out_dir: str, fmt: str, state: ExportState, resume: bool = False,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 telegram_id: Optional[int] = None) -> int:
+    """Exporta una tabla a <out>/<tabla>.<fmt>.gz; devuelve las filas escritas"""
+    path = os.path.join(out_dir, f"{name}.{fmt}.gz")
+    checkpoint = state.get(name) if resume else {'last_id': 0, 'bytes': 0, 'rows': 0, 'done': False}
+    if checkpoint['bytes'] and (not os.path.exists(path) or os.path.getsize(path) < checkpoint['bytes']):
+        # Sin los bloques confirmados no se puede continuar: la tabla se exporta de nuevo
+        logger.warning(f"{name}: falta {path} o es más corto que el punto de control; se empieza de cero")
+        checkpoint = {'last_id': 0, 'bytes': 0, 'rows': 0, 'done': False}
+        state.save(name, **checkpoint)
+    if resume and checkpoint['done']:
+        logger.info(f"{name}: ya exportada, se omite")
+        return 0
+
+    table = EXPORT_TABLES[name][0]
+    columns = [column.name for column in table.columns]
+    id_index = columns.index('id')
+    total_rows = checkpoint['rows']
+    written = 0
+    started = time.monotonic()
+
+    with open(path, 'r+b' if resume and os.path.exists(path) else 'wb') as f:
+        # Se descarta cualquier resto escrito después del último punto de control
+        f.seek(checkpoint['bytes'])
+        f.truncate()
+
+        query = build_query(name, since, until, telegram_id, after_id=checkpoint['last_id'])
+        for rows in stream_rows(query):
+            f.write(encode_chunk(rows, columns, fmt, write_header=f.tell() == 0))
+            f.flush()
+            os.fsync(f.fileno())
+
+            written += len(rows)
+            total_rows += len(rows)
+            state.save(name, last_id=rows[-1][id_index], bytes=f.tell(), rows=total_rows, done=False)
+
+            elapsed = time.monotonic() - started
+            logger.info(f"{name}: {total_rows} filas ({written / elapsed:.0f} filas/s)")
+
+        state.save(name, bytes=f.tell(), rows=total_rows, done=True)
+
+    elapsed = time.monotonic() - started
+    logger.info(f"{name}: completada, {written} filas nuevas en {elapsed:.1f}s "
+                f"({written / elapsed if elapsed else 0:.0f} filas/s) -> {path}")
+    return written
+
+def export_user_data(telegram_id: int, fileobj) -> int:
+    """Escribe en ``fileobj`` todos los datos de un usuario como JSONL comprimido"""
+    rows_written = 0
+    for name, (table, _) in USER_DATA_TABLES.items():
+        columns = [column.name for column in table.columns]
+        for rows in stream_rows(build_query(name, telegram_id=telegram_id)):
+            fileobj.write(encode_chunk(rows, columns, 'jsonl', write_header=False, table_name=name))
+            rows_written += len(rows)
+    return rows_written
+
+async def handle_export_my_data(update: Update, context: CallbackContext):
+    """Manejador del comando /mis_datos: envía al usuario una copia de sus datos"""
+    telegram_id = update.effective_user.id
+    lang = user_language(update.effective_user)
+    with tempfile.TemporaryFile() as f:
+        try:
+            # La lectura y compresión se hacen fuera del loop del bot
+            rows = await asyncio.to_thread(export_user_data, telegram_id, f)
+        except Exception as e:
+            logger.error(f"Error exportando datos de {telegram_id}: {e}")
+            await update.message.reply_text(t('export.error', lang))
+            return
+
+        if not rows:
+            await update.message.reply_text(t('export.empty', lang))
+            return
+
+        f.seek(0)
+        await update.message.reply_document(
+            document=f,
+            filename=f"mis_datos_{telegram_id}.jsonl.gz",
+            caption=t('export.caption', lang)
+        )
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Exporta datos en JSONL/CSV comprimidos con gzip")
+    parser.add_argument('--out', required=True, help="Directorio de salida")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    parser.add_argument('--tables', default=','.join(EXPORT_TABLES), help="Tablas separadas por comas")
+    parser.add_argument('--since', type=_parse_date, help="Fecha inicial (ISO, incluida)")
+    parser.add_argument('--until', type=_parse_date, help="Fecha final (ISO, excluida)")
+    parser.add_argument('--user', type=int, help="Solo los datos de este telegram_id")
+    parser.add_argument('--resume', action='store_true', help="Continúa desde el último punto de control")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+
+    tables = [name.strip() for name in args.tables.split(',') if name.strip()]
+    unknown = set(tables) - set(EXPORT_TABLES)
+    if unknown:
+        parser.error(f"Tablas desconocidas: {', '.join(sorted(unknown))}")
+
+    os.makedirs(args.out, exist_ok=True)
+    filters = {
+        'format': args.format,
+        'since': args.since.isoformat() if args.since else None,
+        'until': args.until.isoformat() if args.until else None,
+        'user': args.user
+    }
+    state = ExportState(os.path.join(args.out, STATE_FILE), filters)
+    if not args.resume:
+        state.reset()
+    elif not state.can_resume():
+        parser.error(f"La exportación de {args.out} se hizo con otros filtros ({state.saved_filters}); "
+                     f"repite --format/--since/--until/--user o usa otro directorio")
+    started = time.monotonic()
+    total = 0
+    for name in tables:
+        total += export_table(name, args.out, args.format, state, resume=args.resume,
+                              since=args.since, until=args.until, telegram_id=args.user)
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Exportación completada: {total} filas en {elapsed:.1f}s "
+                f"({total / elapsed if elapsed else 0:.0f} filas/s)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackContext, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import CallbackContext, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters
 import logging
-from database import get_db_session, User
+from database import get_db_session, get_read_session, User
 from keyboards import (
     main_menu_keyboard,
     water_reminder_keyboard,
@@ -18,79 +18,68 @@ from water_reminders import (
     cancel_water_reminders,
     start_water_reminders,
     handle_register_weight,
-    reset_daily_water  
+    handle_set_timezone
 )
 from nutrition_plans import handle_nutrition_plan_selection, send_random_plan
 from premium import handle_premium_payment
+from broadcast import handle_broadcast_command
+from entitlements import remember_user
+from export_data import handle_export_my_data
+from overload import overload_controller
+from repository import is_registered
+from stats import admin_stats
+from throttling import enforce_rate_limit
+from message_edits import edit_message
+from i18n import SUPPORTED_LANGUAGES, language_cache, normalize_language, user_language, t, DEFAULT_LANGUAGE
 from datetime import datetime
-import random
 import traceback
-import asyncio
 import telegram
 
 class UnregisteredUserError(Exception):
     """Excepción para usuarios no registrados"""
     pass
 
-# Configuración de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Configuración de timeout para la base de datos
 DB_TIMEOUT = 10
 
-async def send_message_with_retry(update, text, reply_markup=None, parse_mode=None, max_retries=3):
-    """Envía un mensaje con mecanismo de reintento"""
-    for attempt in range(max_retries):
-        try:
-            if update.callback_query:
-                await update.callback_query.edit_message_text(
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode
-                )
-            else:
-                await update.message.reply_text(
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode
-                )
-            return True
-        except Exception as send_error:
-            if attempt == max_retries - 1:
-                raise
-            logger.warning(f"Intento {attempt + 1} fallido: {send_error}")
-            await asyncio.sleep(1 + attempt)
-    return False
+async def send_message_with_retry(update, text, reply_markup=None, parse_mode=None):
+    """Responde editando el mensaje del botón o con un mensaje nuevo.
+
+    Los reintentos ante errores transitorios los hace el transporte
+    (bot_api.RoutedRequest) para todas las llamadas a la Bot API.
+    """
+    if update.callback_query:
+        await edit_message(
+            update.callback_query,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    else:
+        await update.message.reply_text(
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    return True
 
-def obtener_saludo_por_hora():
+def obtener_saludo_por_hora(lang: str = DEFAULT_LANGUAGE):
     """Devuelve un saludo según la hora del día"""
     hora_actual = datetime.now().hour
     if 5 <= hora_actual < 12:
-        return "☀️ Buenos días"
+        return t('greeting.morning', lang)
     elif 12 <= hora_actual < 19:
-        return "🌤 Buenas tardes"
-    return "🌙 Buenas noches"
-
-MENSAJES_NUTRICIONALES = [
-    "{saludo}, {user_name}! 💧\n\n¿Ya tomaste tu primer vaso de agua hoy?",
-    "{saludo}, {user_name}! 🎯\n\nHoy es un gran día para cumplir tus metas.",
-    "{saludo}, {user_name}! 🥕\n\n¿Incluiste vegetales en tu última comida?",
-    "{saludo}, {user_name}! 🍛\n\nLas proteínas son esenciales para tu energía.",
-    "{saludo}, {user_name}! 📅\n\n¿Planificaste tus comidas para hoy?",
-    "{saludo}, {user_name}! 🔍\n\nPequeños cambios = Grandes resultados.",
-    "{saludo}, {user_name}! 📚\n\n¿Sabías que una alimentación balanceada mejora tu productividad?",
-    "{saludo}, {user_name}! 🌙\n\nUna cena ligera ayuda a tu digestión."
-]
+        return t('greeting.afternoon', lang)
+    return t('greeting.evening', lang)
 
 async def start(update: Update, context: CallbackContext):
     """Manejador del comando /start"""
     try:
         user = update.effective_user
-        logger.info(f"Iniciando interacción con usuario ID: {user.id}")
+        lang = user_language(user)
+        logger.info("Iniciando interacción con usuario ID: %s", user.id)
         
         db = None
         try:
@@ -98,7 +87,15 @@ async def start(update: Update, context: CallbackContext):
             db_user = db.query(User).filter_by(telegram_id=user.id).first()
             
             if db_user:
-                mensaje = f"👋 ¡Hola de nuevo, {user.first_name or 'Usuario'}!"
+                # La fila ya está cargada: se refresca el idioma en caché sin otra consulta
+                lang = normalize_language(db_user.language) or DEFAULT_LANGUAGE
+                language_cache.set(user.id, lang)
+                remember_user(db_user)
+                mensaje = t('start.welcome_back', lang, name=user.first_name or t('start.default_name', lang))
+                if db_user.is_blocked:
+                    # Volvió a escribir: ya no bloquea al bot
+                    db_user.is_blocked = False
+                    db.commit()
                 # Iniciar recordatorios si ya está registrado
                 await start_water_reminders(context, user.id)
             else:
@@ -107,29 +104,39 @@ async def start(update: Update, context: CallbackContext):
                     username=user.username,
                     first_name=user.first_name,
                     last_name=user.last_name,
-                    registered_at=datetime.utcnow()
+                    registered_at=datetime.utcnow(),
+                    language=lang  # Idioma de la app de Telegram si tiene catálogo
                 )
                 db.add(db_user)
                 db.commit()
-                mensaje = f"🎉 ¡Bienvenido/a {user.first_name or 'Nuevo Usuario'}!"
+                language_cache.set(user.id, lang)
+                remember_user(db_user)
+                admin_stats.record_registration()
+                mensaje = t('start.welcome', lang, name=user.first_name or t('start.new_user_name', lang))
             
-            saludo = obtener_saludo_por_hora()
-            user_name = user.first_name or "Usuario"
-            mensaje_contextual = random.choice(MENSAJES_NUTRICIONALES).format(
-                saludo=saludo, user_name=user_name)
+            if overload_controller.overloaded:
+                # Con sobrecarga se omite el saludo personalizado: solo el menú
+                overload_controller.count('plain_greetings')
+                mensaje_contextual = mensaje
+            else:
+                mensaje_contextual = t(
+                    'start.tips', lang,
+                    greeting=obtener_saludo_por_hora(lang),
+                    name=user.first_name or t('start.default_name', lang)
+                )
             
             await send_message_with_retry(
                 update=update,
                 text=f"{mensaje_contextual}",
-                reply_markup=main_menu_keyboard(),
+                reply_markup=main_menu_keyboard(lang),
                 parse_mode="HTML"
             )
 
         except Exception as db_error:
             logger.error(f"Error en DB: {db_error}\n{traceback.format_exc()}")
             await update.message.reply_text(
-                "¡Hola! Estamos teniendo problemas técnicos. Intenta más tarde.",
-                reply_markup=main_menu_keyboard()
+                t('start.technical_problems', lang),
+                reply_markup=main_menu_keyboard(lang)
             )
         finally:
             if db:
@@ -138,19 +145,17 @@ async def start(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"Error en start: {e}\n{traceback.format_exc()}")
         if update.message:
-            await update.message.reply_text("🔴 Error al procesar tu solicitud.")
+            await update.message.reply_text(t('errors.request', user_language(update.effective_user)))
 
 async def check_user_registered(update: Update, context: CallbackContext) -> bool:
     """Verifica si el usuario está registrado"""
     user = update.effective_user
     db = None
     try:
-        db = get_db_session()
-        user_exists = db.query(User).filter_by(telegram_id=user.id).first() is not None
-        
-        if not user_exists:
+        db = get_read_session()
+        if not is_registered(db, user.id):
             await update.callback_query.answer(
-                "⚠️ Debes registrarte primero con /start",
+                t('register.required', user_language(user)),
                 show_alert=True
             )
             return False
@@ -158,7 +163,7 @@ async def check_user_registered(update: Update, context: CallbackContext) -> boo
     except Exception as e:
         logger.error(f"Error verificando registro: {e}")
         await update.callback_query.answer(
-            "🔴 Error verificando tu registro.",
+            t('register.check_error', user_language(user)),
             show_alert=True
         )
         return False
@@ -172,21 +177,18 @@ async def main_menu(update: Update, context: CallbackContext):
         query = update.callback_query
         await query.answer()
         
-        user_name = update.effective_user.first_name or "amigo/a"
-        mensaje = random.choice([
-            f"¡Hola <b>{user_name}</b>! 🌟\n\n¿En qué puedo ayudarte hoy?",
-            f"<b>{user_name}</b>, ¿listo/a para dar el siguiente paso? 💪",
-            f"¡Buen momento para cuidarse, <b>{user_name}</b>! 🌱"
-        ])
+        lang = user_language(update.effective_user)
+        mensaje = t('menu.greetings', lang, name=update.effective_user.first_name or t('menu.default_name', lang))
         
-        await query.edit_message_text(
+        await edit_message(
+            query,
             text=mensaje,
-            reply_markup=main_menu_keyboard(),
+            reply_markup=main_menu_keyboard(lang),
             parse_mode="HTML"
         )
     except Exception as e:
         logger.error(f"Error en main_menu: {e}")
-        await query.edit_message_text("❌ Error al cargar el menú.")
+        await edit_message(query, t('menu.error', user_language(update.effective_user)))
 
 async def error_handler(update: Update, context: CallbackContext):
     """Manejador de errores globales"""
@@ -194,17 +196,46 @@ async def error_handler(update: Update, context: CallbackContext):
     logger.error(f"Error global: {error}\n{traceback.format_exc()}")
     
     try:
+        lang = user_language(update.effective_user)
         if isinstance(error, UnregisteredUserError):
-            await update.effective_message.reply_text(
-                "🔐 Para usar esta función, primero debes registrarte con /start"
-            )
+            await update.effective_message.reply_text(t('errors.unregistered', lang))
         else:
-            await update.effective_message.reply_text(
-                "⚠️ Error procesando tu solicitud. Intenta nuevamente."
-            )
+            await update.effective_message.reply_text(t('errors.generic', lang))
     except Exception as e:
         logger.error(f"Error en el manejador de errores: {e}")
 
+async def handle_set_language(update: Update, context: CallbackContext):
+    """Manejador del comando /idioma <es|en>"""
+    user_id = update.effective_user.id
+    lang = normalize_language(context.args[0]) if context.args else None
+    if not lang:
+        await update.message.reply_text(t(
+            'language.usage', user_language(update.effective_user),
+            languages='|'.join(SUPPORTED_LANGUAGES)
+        ))
+        return
+
+    db = get_db_session()
+    try:
+        updated = db.query(User).filter_by(telegram_id=user_id).update(
+            {User.language: lang}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error guardando idioma: {e}")
+        db.rollback()
+        await update.message.reply_text(t('language.error', user_language(update.effective_user)))
+        return
+    finally:
+        db.close()
+
+    if not updated:
+        await update.message.reply_text(t('register.required', lang))
+        return
+
+    language_cache.set(user_id, lang)
+    await update.message.reply_text(t('language.updated', lang), reply_markup=main_menu_keyboard(lang))
+
 def add_registration_check(handler_func):
     """Decorador para verificación de registro"""
     async def wrapped(update: Update, context: CallbackContext):
@@ -215,8 +246,15 @@ def add_registration_check(handler_func):
 
 def setup_handlers(application):
     """Configura todos los handlers de la aplicación"""
+    # Límite por usuario antes de cualquier otro handler (grupo -1)
+    application.add_handler(TypeHandler(Update, enforce_rate_limit), group=-1)
+    
     # Comandos básicos
     application.add_handler(CommandHandler('start', start))
+    application.add_handler(CommandHandler('zona_horaria', handle_set_timezone))
+    application.add_handler(CommandHandler('idioma', handle_set_language))
+    application.add_handler(CommandHandler('difundir', handle_broadcast_command))
+    application.add_handler(CommandHandler('mis_datos', handle_export_my_data))
     
     # Handlers con verificación de registro
     protected_handlers = [
@@ -250,20 +288,6 @@ def setup_handlers(application):
         handle_weight_input
     ))
     
-    # Configurar el reinicio diario a las 00:00
-    try:
-        # Verificar si ya existe un job de reinicio diario
-        if not any(job.name == "daily_reset" for job in application.job_queue.jobs()):
-            application.job_queue.run_daily(
-                callback=reset_daily_water,
-                time=datetime.strptime("00:00", "%H:%M").time(),
-                name="daily_reset",
-                chat_id=None  # Job global, no asociado a un chat específico
-            )
-            logger.info("Job de reinicio diario configurado correctamente")
-    except Exception as e:
-        logger.error(f"Error al configurar el job de reinicio diario: {e}")
-    
     # Error handler
     application.add_error_handler(error_handler)
     
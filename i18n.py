@@ -0,0 +1,188 @@
+"""Catálogos de mensajes por idioma.
+
+Los textos viven en ``locales/<idioma>.json`` (fuente, una clave por texto o
+una lista de variantes que se eligen al azar). ``python i18n.py compile``
+los valida contra el idioma por defecto (mismas claves y mismos campos
+``{...}``), completa las claves que falten con el texto por defecto y escribe
+``locales/compiled.json``, que se carga una sola vez al importar el módulo.
+El Procfile lo compila antes de arrancar la app; si aun así falta o es más
+viejo que las fuentes se compila en memoria, con un aviso.
+
+En cada update solo hay búsquedas en diccionarios:
+
+    t('water.goal_reached', lang)
+    t('weight.updated', lang, weight=68.5, goal=2397.5)
+
+El idioma del usuario sale de ``language_cache`` (precargada al arrancar con
+``repository.warm_language_cache`` y actualizada al registrarse o con
+/idioma). Si el usuario no está en la caché se usa el ``language_code`` que
+envía Telegram, sin ir a la base de datos.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+from collections import OrderedDict
+from string import Formatter
+from typing import Dict, Iterable, Optional
+from config import Config
+from logging_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+COMPILED_FILE = os.path.join(LOCALES_DIR, 'compiled.json')
+DEFAULT_LANGUAGE = 'es'
+
+class CatalogError(ValueError):
+    """Un catálogo no coincide con el del idioma por defecto"""
+
+def _fields(template: str) -> set:
+    return {name for _, name, _, _ in Formatter().parse(template) if name}
+
+def _source_files() -> Dict[str, str]:
+    return {
+        name[:-len('.json')]: os.path.join(LOCALES_DIR, name)
+        for name in sorted(os.listdir(LOCALES_DIR))
+        if name.endswith('.json') and name != os.path.basename(COMPILED_FILE)
+    }
+
+def compile_catalogs(sources: Dict[str, dict], default: str = DEFAULT_LANGUAGE) -> Dict[str, dict]:
+    """Valida los catálogos fuente y devuelve uno completo por idioma"""
+    base = sources[default]
+    errors = []
+    compiled = {}
+    for lang, catalog in sources.items():
+        for key in catalog.keys() - base.keys():
+            errors.append(f"{lang}: clave desconocida '{key}'")
+        result = {}
+        for key, expected in base.items():
+            value = catalog.get(key)
+            if value is None:
+                logger.warning(f"{lang}: falta '{key}', se usa el texto en {default}")
+                value = expected
+            elif isinstance(value, list) != isinstance(expected, list):
+                errors.append(f"{lang}: '{key}' debe ser {'una lista' if isinstance(expected, list) else 'un texto'}")
+                continue
+            if isinstance(expected, list):
+                # Las variantes pueden usar solo parte de los campos, pero entre
+                # todas deben usar los mismos que las del idioma por defecto
+                allowed = set().union(*(_fields(variant) for variant in expected))
+                extra = set().union(*(_fields(variant) for variant in value)) ^ allowed
+            else:
+                allowed = _fields(expected)
+                extra = _fields(value) ^ allowed
+            if extra:
+                errors.append(f"{lang}: '{key}' con campos distintos a {default}: {sorted(extra)}")
+            result[key] = value
+        compiled[lang] = result
+    if errors:
+        raise CatalogError("Catálogos inválidos:\n" + '\n'.join(errors))
+    return compiled
+
+def compile_sources(default: str = DEFAULT_LANGUAGE) -> Dict[str, dict]:
+    sources = {}
+    for lang, path in _source_files().items():
+        with open(path, 'r', encoding='utf-8') as f:
+            sources[lang] = json.load(f)
+    return compile_catalogs(sources, default)
+
+def _is_stale() -> bool:
+    if not os.path.exists(COMPILED_FILE):
+        return True
+    compiled_at = os.path.getmtime(COMPILED_FILE)
+    return any(os.path.getmtime(path) > compiled_at for path in _source_files().values())
+
+def load_catalogs() -> Dict[str, dict]:
+    """Catálogos compilados; las variantes quedan como tuplas para ``random.choice``"""
+    if _is_stale():
+        logger.warning("locales/compiled.json falta o está desactualizado; compilando en memoria "
+                       "(ejecuta 'python i18n.py compile')")
+        catalogs = compile_sources()
+    else:
+        with open(COMPILED_FILE, 'r', encoding='utf-8') as f:
+            catalogs = json.load(f)
+    return {
+        lang: {key: tuple(value) if isinstance(value, list) else value for key, value in catalog.items()}
+        for lang, catalog in catalogs.items()
+    }
+
+CATALOGS = load_catalogs()
+SUPPORTED_LANGUAGES = tuple(sorted(CATALOGS))
+
+def t(key: str, lang: str = DEFAULT_LANGUAGE, **fields) -> str:
+    """Texto de ``key`` en ``lang`` (o en el idioma por defecto si no existe)"""
+    template = CATALOGS.get(lang, CATALOGS[DEFAULT_LANGUAGE])[key]
+    if isinstance(template, tuple):
+        template = random.choice(template)
+    return template.format(**fields) if fields else template
+
+def normalize_language(code: Optional[str]) -> Optional[str]:
+    """'en-US' -> 'en'; None si el idioma no tiene catálogo"""
+    if not code:
+        return None
+    lang = code[:2].lower()
+    return lang if lang in CATALOGS else None
+
+class LanguageCache:
+    """Caché LRU en memoria de telegram_id -> idioma.
+
+    Se actualiza en esta instancia al registrarse y con /idioma; un cambio
+    hecho en otra instancia se ve aquí tras el siguiente /start o reinicio.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int) -> Optional[str]:
+        with self._lock:
+            lang = self._entries.get(telegram_id)
+            if lang is not None:
+                self._entries.move_to_end(telegram_id)
+            return lang
+
+    def set(self, telegram_id: int, lang: str):
+        with self._lock:
+            self._entries[telegram_id] = lang
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_many(self, rows: Iterable):
+        for telegram_id, lang in rows:
+            self.set(telegram_id, lang)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+language_cache = LanguageCache(Config.LANGUAGE_CACHE_SIZE)
+
+def user_language(tg_user) -> str:
+    """Idioma de un usuario de Telegram (``update.effective_user``) sin consultar la base de datos"""
+    if tg_user is None:
+        return DEFAULT_LANGUAGE
+    return language_cache.get(tg_user.id) or normalize_language(tg_user.language_code) or DEFAULT_LANGUAGE
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compila los catálogos de locales/ en locales/compiled.json")
+    parser.add_argument('command', choices=('compile', 'check'))
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    catalogs = compile_sources()
+
+    if args.command == 'compile':
+        tmp_path = f"{COMPILED_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(catalogs, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, COMPILED_FILE)
+    logger.info(f"{len(catalogs)} idiomas, {len(catalogs[DEFAULT_LANGUAGE])} textos por idioma")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,25 +1,32 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from i18n import DEFAULT_LANGUAGE, t
 
-def main_menu_keyboard():
+# InlineKeyboardMarkup es inmutable: cada teclado se construye una vez por idioma
+
+@lru_cache(maxsize=None)
+def main_menu_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado principal del bot"""
     keyboard = [
-        [InlineKeyboardButton("💧 Recordatorios de Agua", callback_data='water_reminder')],
-        [InlineKeyboardButton("🍎 Plan Nutricional", callback_data='nutrition_plans')],
-        [InlineKeyboardButton("🌟 Premium", callback_data='premium')]
+        [InlineKeyboardButton(t('kb.water_reminders', lang), callback_data='water_reminder')],
+        [InlineKeyboardButton(t('kb.nutrition_plan', lang), callback_data='nutrition_plans')],
+        [InlineKeyboardButton(t('kb.premium', lang), callback_data='premium')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def water_reminder_keyboard():
+@lru_cache(maxsize=None)
+def water_reminder_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado para gestión de recordatorios de agua"""
     keyboard = [
-        [InlineKeyboardButton("💧 Registrar Consumo", callback_data='water_progress')],
-        [InlineKeyboardButton("⚖ Registrar Peso", callback_data='register_weight')],  # Cambiado a register_weight
-        [InlineKeyboardButton("🔕 Cancelar Recordatorios", callback_data='cancel_water_reminders')],
-        [InlineKeyboardButton("🔙 Menú Principal", callback_data='main_menu')]
+        [InlineKeyboardButton(t('kb.log_intake', lang), callback_data='water_progress')],
+        [InlineKeyboardButton(t('kb.log_weight', lang), callback_data='register_weight')],  # Cambiado a register_weight
+        [InlineKeyboardButton(t('kb.cancel_reminders', lang), callback_data='cancel_water_reminders')],
+        [InlineKeyboardButton(t('kb.main_menu', lang), callback_data='main_menu')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def water_amount_keyboard():
+@lru_cache(maxsize=None)
+def water_amount_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado para seleccionar cantidad de agua consumida"""
     keyboard = [
         [
@@ -30,11 +37,12 @@ def water_amount_keyboard():
             InlineKeyboardButton("750 ml", callback_data='water_amount_750'),
             InlineKeyboardButton("1 L", callback_data='water_amount_1000')
         ],
-        [InlineKeyboardButton("🔙 Atrás", callback_data='water_reminder')]
+        [InlineKeyboardButton(t('kb.back', lang), callback_data='water_reminder')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def water_progress_keyboard():
+@lru_cache(maxsize=None)
+def water_progress_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado para mostrar progreso de hidratación"""
     keyboard = [
         [
@@ -45,37 +53,68 @@ def water_progress_keyboard():
             InlineKeyboardButton("➕ 750ml", callback_data='water_amount_750'),
             InlineKeyboardButton("➕ 1L", callback_data='water_amount_1000')
         ],
-        [InlineKeyboardButton("⚖ Actualizar Peso", callback_data='register_weight')],
-        [InlineKeyboardButton("🔙 Menú Principal", callback_data='main_menu')]
+        [InlineKeyboardButton(t('kb.update_weight', lang), callback_data='register_weight')],
+        [InlineKeyboardButton(t('kb.main_menu', lang), callback_data='main_menu')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def nutrition_plans_keyboard():
+@lru_cache(maxsize=None)
+def nutrition_plans_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado para selección de planes nutricionales"""
     keyboard = [
-        [InlineKeyboardButton("📉 Pérdida de Peso", callback_data='plan_weightL')],
-        [InlineKeyboardButton("📈 Aumento Muscular", callback_data='plan_weightG')],
-        [InlineKeyboardButton("⚖ Mantenimiento", callback_data='plan_maintenance')],
-        [InlineKeyboardButton("🏃 Rendimiento Deportivo", callback_data='plan_sports')],
-        [InlineKeyboardButton("❤ Salud Metabólica", callback_data='plan_metabolic')],
-        [InlineKeyboardButton("💪 Objetivos Estéticos", callback_data='plan_aesthetic')],
-        [InlineKeyboardButton("🔙 Menú Principal", callback_data='main_menu')]
+        [InlineKeyboardButton(t('kb.plan_weightL', lang), callback_data='plan_weightL')],
+        [InlineKeyboardButton(t('kb.plan_weightG', lang), callback_data='plan_weightG')],
+        [InlineKeyboardButton(t('kb.plan_maintenance', lang), callback_data='plan_maintenance')],
+        [InlineKeyboardButton(t('kb.plan_sports', lang), callback_data='plan_sports')],
+        [InlineKeyboardButton(t('kb.plan_metabolic', lang), callback_data='plan_metabolic')],
+        [InlineKeyboardButton(t('kb.plan_aesthetic', lang), callback_data='plan_aesthetic')],
+        [InlineKeyboardButton(t('kb.main_menu', lang), callback_data='main_menu')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def premium_options_keyboard():
+@lru_cache(maxsize=None)
+def premium_options_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado para opciones premium"""
     keyboard = [
-        [InlineKeyboardButton("💳 Tarjeta de Crédito", callback_data='payment_credit_card')],
-        [InlineKeyboardButton("📱 PayPal", callback_data='payment_paypal')],
-        [InlineKeyboardButton("₿ Criptomonedas", callback_data='payment_crypto')],
-        [InlineKeyboardButton("🔙 Menú Principal", callback_data='main_menu')]
+        [InlineKeyboardButton(t('kb.pay_card', lang), callback_data='payment_credit_card')],
+        [InlineKeyboardButton(t('kb.pay_paypal', lang), callback_data='payment_paypal')],
+        [InlineKeyboardButton(t('kb.pay_crypto', lang), callback_data='payment_crypto')],
+        [InlineKeyboardButton(t('kb.main_menu', lang), callback_data='main_menu')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def weight_input_keyboard():
+@lru_cache(maxsize=None)
+def weight_input_keyboard(lang: str = DEFAULT_LANGUAGE):
     """Teclado para cancelar entrada de peso"""
     keyboard = [
-        [InlineKeyboardButton("❌ Cancelar", callback_data='water_reminder')]
+        [InlineKeyboardButton(t('kb.cancel', lang), callback_data='water_reminder')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=None)
+def back_to_menu_keyboard(lang: str = DEFAULT_LANGUAGE):
+    """Solo el botón de volver al menú principal"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(t('kb.home', lang), callback_data='main_menu')]])
+
+@lru_cache(maxsize=None)
+def plan_limit_keyboard(lang: str = DEFAULT_LANGUAGE):
+    """Teclado al alcanzar el límite diario de descargas"""
+    keyboard = [
+        [InlineKeyboardButton(t('kb.go_premium', lang), callback_data='premium')],
+        [InlineKeyboardButton(t('kb.main_menu', lang), callback_data='main_menu')]
     ]
-    return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=None)
+def renew_premium_keyboard(lang: str = DEFAULT_LANGUAGE):
+    """Botón para renovar tras expirar la suscripción"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(t('kb.renew_premium', lang), callback_data='premium')]])
+
+@lru_cache(maxsize=None)
+def reminders_cancelled_keyboard(lang: str = DEFAULT_LANGUAGE):
+    """Teclado tras desactivar los recordatorios"""
+    keyboard = [
+        [InlineKeyboardButton(t('kb.view_progress', lang), callback_data='water_progress')],
+        [InlineKeyboardButton(t('kb.home', lang), callback_data='main_menu')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,158 @@
+"""Configuración de logging fuera del camino crítico.
+
+Los handlers de la app solo encolan el registro (``QueueHandler``); un hilo
+con ``QueueListener`` le da formato y lo escribe en stdout. En el hilo que
+registra solo se ejecutan los filtros:
+
+  - contexto: añade ``update_id`` y ``user_id`` desde :func:`log_context`
+  - muestreo: LOG_SAMPLING="app=0.1,database=0.2" conserva esa fracción de los
+    registros INFO/DEBUG de cada logger (y sus hijos); WARNING o más, siempre
+
+El mensaje no se formatea en el hilo que registra: con
+``logger.info("Plan %s", plan_type)`` la interpolación ocurre en el hilo del
+listener, y no ocurre nunca si el registro se descarta por muestreo. Con
+LOG_JSON=true cada línea es un objeto JSON; si la cola se llena, los
+registros se descartan y se cuentan en lugar de bloquear.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+from config import Config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_log_context = contextvars.ContextVar('log_context', default={})
+
+@contextmanager
+def log_context(**fields):
+    """Campos añadidos a todos los registros emitidos dentro del bloque"""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        record.update_id = context.get('update_id')
+        record.user_id = context.get('user_id')
+        return True
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """'app=0.1,database=0.2' -> {'app': 0.1, 'database': 0.2}"""
+    rates = {}
+    for item in spec.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+class SamplingFilter(logging.Filter):
+    """Conserva una fracción de los registros INFO/DEBUG de los loggers configurados"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+        self._cache = {}  # nombre del logger -> fracción (None = sin muestreo)
+
+    def _rate(self, name: str) -> Optional[float]:
+        if name not in self._cache:
+            # La regla más específica gana: 'database' cubre también 'database.replicas'
+            matches = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + '.')]
+            self._cache[name] = self.rates[max(matches, key=len)] if matches else None
+        return self._cache[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler que no formatea en el hilo que registra y descarta si la cola está llena"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El listener vive en el mismo proceso: msg, args y exc_info viajan tal cual
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        for field in ('update_id', 'user_id'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+_sampling = None
+
+def configure_logging(level: str = None, json_output: bool = None, sampling: str = None):
+    """Instala el QueueHandler en el logger raíz y arranca el listener (una sola vez)"""
+    global _listener, _handler, _sampling
+    with _lock:
+        if _listener is not None:
+            return
+        level = level or Config.LOG_LEVEL
+        json_output = Config.LOG_JSON if json_output is None else json_output
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if json_output else logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        _handler = DeferredQueueHandler(log_queue)
+        _handler.addFilter(ContextFilter())
+        _sampling = SamplingFilter(parse_sampling(Config.LOG_SAMPLING if sampling is None else sampling))
+        _handler.addFilter(_sampling)
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        # Al salir se vacía la cola antes de terminar
+        atexit.register(_listener.stop)
+
+def logging_snapshot() -> dict:
+    return {
+        'queued': _handler.queue.qsize() if _handler else 0,
+        'dropped': _handler.dropped if _handler else 0,
+        'sampled_out': _sampling.sampled_out if _sampling else 0
+    }
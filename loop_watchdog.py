@@ -0,0 +1,157 @@
+"""Detector de bloqueos del event loop del bot.
+
+Un latido en el loop anota la hora cada ``interval`` segundos y mide cuánto
+se retrasa (lag). Un hilo vigilante comprueba el latido: si el loop lleva más
+de ``threshold`` sin latir, toma la pila del hilo del loop con
+``sys._current_frames()`` mientras sigue bloqueado, así la pila muestra la
+llamada síncrona culpable. Cuando el loop se recupera, el latido registra el
+bloqueo (duración, handler y pila), lo escribe en el log y lo cuenta.
+
+El coste en marcha normal es un latido y un despertar del hilo por intervalo,
+por lo que puede quedarse activo en producción. En pruebas:
+
+    async with detect_blocking(threshold=0.05) as watchdog:
+        await handle_water_amount(update, context)
+    watchdog.assert_no_blocking()
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from inspect import CO_COROUTINE
+from typing import NamedTuple, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Los frames de este directorio son código de la app (no de librerías)
+THIS_FILE = os.path.abspath(__file__)
+APP_DIR = os.path.dirname(THIS_FILE)
+
+class Stall(NamedTuple):
+    duration: float  # Segundos que el loop estuvo sin atender nada
+    handler: str  # Corrutina de la app más interna en la pila
+    location: str  # archivo:línea del frame de la app más interno
+    stack: str
+
+    def describe(self) -> str:
+        return f"{self.duration * 1000:.0f} ms en {self.handler} ({self.location})\n{self.stack}"
+
+def _frames(frame, app_only: bool):
+    """Frames desde el más interno hacia afuera (solo los de la app si ``app_only``)"""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename != THIS_FILE and (not app_only or filename.startswith(APP_DIR)):
+            yield frame
+        frame = frame.f_back
+
+class LoopWatchdog:
+    def __init__(self, threshold: float, interval: Optional[float] = None, recent: int = 20):
+        self.threshold = threshold
+        self.interval = interval or min(0.1, threshold / 2)
+        self.recent = deque(maxlen=recent)
+        self.stalls = 0
+        self.blocked_seconds = 0.0
+        self.max_blocked = 0.0
+        self.lag = 0.0
+        self.by_handler = Counter()
+        self._next_beat = 0.0  # Momento en que debería llegar el próximo latido
+        self._loop_thread_id = None
+        self._captured = None  # (handler, ubicación, pila) tomada durante el bloqueo en curso
+        self._running = False
+        self._heartbeat_task = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Arranca el latido y el hilo vigilante; se llama desde el loop a vigilar"""
+        if self._running:
+            return
+        self._running = True
+        self._loop_thread_id = threading.get_ident()
+        self._next_beat = time.monotonic() + self.interval
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, daemon=True, name='LoopWatchdogThread').start()
+
+    async def stop(self):
+        # Un latido más para registrar un bloqueo que acabe de terminar
+        await asyncio.sleep(self.interval)
+        self._running = False
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+
+    async def _heartbeat(self):
+        while self._running:
+            await asyncio.sleep(max(0.0, self._next_beat - time.monotonic()))
+            now = time.monotonic()
+            self.lag = max(0.0, now - self._next_beat)
+            self._next_beat = now + self.interval
+            if self.lag >= self.threshold:
+                self._record(self.lag)
+
+    def _watch(self):
+        while self._running:
+            time.sleep(self.interval / 2)
+            blocked = time.monotonic() - self._next_beat
+            if blocked >= self.threshold and self._captured is None:
+                self._captured = self._capture()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        # Sin frames de la app (p.ej. una prueba fuera del repo) se usa la pila completa
+        frames = list(_frames(frame, app_only=True)) or list(_frames(frame, app_only=False))
+        location = f"{os.path.basename(frames[0].f_code.co_filename)}:{frames[0].f_lineno}" if frames else 'desconocida'
+        handler = next((f.f_code.co_name for f in frames if f.f_code.co_flags & CO_COROUTINE), 'desconocido')
+        return handler, location, ''.join(traceback.format_stack(frame))
+
+    def _record(self, duration: float):
+        captured, self._captured = self._captured, None
+        # Sin captura el bloqueo terminó entre dos comprobaciones del vigilante
+        handler, location, stack = captured or ('desconocido', 'desconocida', '')
+        stall = Stall(duration, handler, location, stack)
+        with self._lock:
+            self.stalls += 1
+            self.blocked_seconds += duration
+            self.max_blocked = max(self.max_blocked, duration)
+            self.by_handler[handler] += 1
+            self.recent.append(stall)
+        logger.warning(f"Event loop bloqueado {stall.describe()}")
+
+    def assert_no_blocking(self):
+        with self._lock:
+            stalls = list(self.recent)
+        if stalls:
+            raise AssertionError("Llamadas bloqueantes en el loop:\n" + '\n'.join(s.describe() for s in stalls))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'threshold_ms': round(self.threshold * 1000),
+                'lag_ms': round(self.lag * 1000, 1),
+                'stalls': self.stalls,
+                'blocked_ms_total': round(self.blocked_seconds * 1000),
+                'max_blocked_ms': round(self.max_blocked * 1000),
+                'by_handler': dict(self.by_handler.most_common(10)),
+                'last': [
+                    {'duration_ms': round(s.duration * 1000), 'handler': s.handler, 'location': s.location}
+                    for s in list(self.recent)[-5:]
+                ]
+            }
+
+loop_watchdog = LoopWatchdog(Config.LOOP_BLOCK_THRESHOLD_MS / 1000)
+
+@asynccontextmanager
+async def detect_blocking(threshold: float = 0.05):
+    """Vigila el loop actual durante el bloque (pensado para pruebas)"""
+    watchdog = LoopWatchdog(threshold)
+    watchdog.start()
+    try:
+        yield watchdog
+    finally:
+        await watchdog.stop()
@@ -0,0 +1,95 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+from telegram import CallbackQuery, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class EditManager:
+    """Edita mensajes evitando llamadas a la Bot API que no cambian nada.
+
+    Recuerda, por (chat, mensaje), una huella del último contenido enviado y
+    la fecha de edición que devolvió Telegram. Si el nuevo contenido coincide
+    y el mensaje no se editó por otra vía (``edit_date`` distinto), la edición
+    se omite. Las ráfagas de pulsaciones de agua ya se agrupan antes de
+    editar (ver throttling.TapCoalescer).
+    """
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self._rendered = OrderedDict()  # (chat_id, message_id) -> (huella, edit_date)
+        self._lock = threading.Lock()
+        self.counters = {'sent': 0, 'skipped_identical': 0, 'not_modified': 0}
+
+    @staticmethod
+    def _fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup], parse_mode: Optional[str]) -> int:
+        return hash((text, parse_mode, reply_markup.to_json() if reply_markup else None))
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _is_current(self, key, fingerprint: int, edit_date) -> bool:
+        with self._lock:
+            rendered = self._rendered.get(key)
+            return rendered is not None and rendered == (fingerprint, edit_date)
+
+    def _remember(self, key, fingerprint: int, edit_date):
+        with self._lock:
+            self._rendered[key] = (fingerprint, edit_date)
+            self._rendered.move_to_end(key)
+            while len(self._rendered) > self.max_entries:
+                self._rendered.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._rendered.pop(key, None)
+
+    async def edit(self, query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                   parse_mode: Optional[str] = None):
+        message = query.message
+        if message is None:
+            # Mensajes inline: no hay (chat, mensaje) que recordar
+            await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+            self._count('sent')
+            return
+
+        key = (message.chat_id, message.message_id)
+        fingerprint = self._fingerprint(text, reply_markup, parse_mode)
+        if self._is_current(key, fingerprint, message.edit_date):
+            self._count('skipped_identical')
+            return
+
+        try:
+            edited = await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                self._forget(key)
+                raise
+            # Ya mostraba este contenido: se recuerda para no volver a intentarlo
+            self._count('not_modified')
+            self._remember(key, fingerprint, message.edit_date)
+            return
+        except Exception:
+            self._forget(key)
+            raise
+
+        self._count('sent')
+        self._remember(key, fingerprint, getattr(edited, 'edit_date', None))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'tracked_messages': len(self._rendered),
+                **self.counters
+            }
+
+edit_manager = EditManager(Config.EDIT_CACHE_SIZE)
+
+async def edit_message(query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                       parse_mode: Optional[str] = None):
+    """Sustituto de ``query.edit_message_text`` que omite ediciones sin cambios"""
+    await edit_manager.edit(query, text, reply_markup=reply_markup, parse_mode=parse_mode)
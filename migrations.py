@@ -0,0 +1,278 @@
+"""Migraciones versionadas del esquema.
+
+Se ejecutan como un paso separado del despliegue, nunca al importar la app:
+
+    python migrations.py upgrade   # aplica las migraciones pendientes
+    python migrations.py status    # muestra aplicadas y pendientes
+    python migrations.py check     # EXPLAIN de las consultas frecuentes (repository.hot_queries);
+                                   # falla si alguna recorre la tabla completa (útil en CI)
+
+En Heroku/Render el ``upgrade`` corre en el paso ``release`` del Procfile, antes
+de arrancar la nueva versión; la app se niega a arrancar si quedan pendientes.
+
+Cada migración aplicada queda registrada en la tabla schema_migrations. En
+Postgres los índices se crean con CREATE INDEX CONCURRENTLY, fuera de
+transacción, para no bloquear escrituras en producción; un índice que quedó
+inválido por una ejecución interrumpida se elimina y se vuelve a crear.
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, List, NamedTuple
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, inspect, select, text, update)
+from database import engine
+from models import Base, Payment, PaymentEvent
+from repository import hot_queries
+from logging_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock de Postgres: evita dos upgrades simultáneos
+MIGRATIONS_LOCK_ID = 726354001
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable
+    transactional: bool = True  # False: recibe una conexión en AUTOCOMMIT
+
+def _create_base_schema(conn):
+    """Crea las tablas que falten y añade las columnas nuevas a las existentes.
+
+    create_all usa el modelo actual y no altera tablas ya creadas; las
+    columnas que falten se añaden como nullables y el código trata NULL como
+    el valor por defecto. Las migraciones posteriores deben ser idempotentes.
+    """
+    Base.metadata.create_all(conn)
+    _add_missing_columns(conn)
+
+def _add_missing_columns(conn):
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {preparer.quote(table.name)} '
+                    f'ADD COLUMN {preparer.quote(column.name)} {column_type}'
+                ))
+                logger.info(f"Columna añadida: {table.name}.{column.name}")
+
+# Índices para los filtros de las rutas frecuentes: (nombre, tabla, columnas)
+HOT_QUERY_INDEXES = [
+    ('ix_plan_downloads_user_downloaded', 'plan_downloads', ('user_id', 'downloaded_at')),
+    ('ix_water_logs_user_timestamp', 'water_logs', ('user_id', 'timestamp')),
+    ('ix_user_settings_user_reminders', 'user_settings', ('user_id', 'water_reminders_enabled')),
+    ('ix_user_settings_timezone', 'user_settings', ('timezone',)),
+    ('ix_users_premium_expiry', 'users', ('premium_expiry',)),
+]
+
+def _create_index(conn, name: str, table: str, columns):
+    preparer = conn.dialect.identifier_preparer
+    column_list = ', '.join(preparer.quote(column) for column in columns)
+    if conn.dialect.name == 'postgresql':
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name"
+        ), {'name': name}).scalar()
+        if valid is False:
+            logger.warning(f"Índice inválido {name} (creación interrumpida); se vuelve a crear")
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {preparer.quote(name)}'))
+        conn.execute(text(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {preparer.quote(name)} '
+            f'ON {preparer.quote(table)} ({column_list})'
+        ))
+    else:
+        conn.execute(text(
+            f'CREATE INDEX IF NOT EXISTS {preparer.quote(name)} ON {preparer.quote(table)} ({column_list})'
+        ))
+    logger.info(f"Índice {name} listo en {table}({', '.join(columns)})")
+
+def _create_hot_query_indexes(conn):
+    for name, table, columns in HOT_QUERY_INDEXES:
+        _create_index(conn, name, table, columns)
+
+def _create_payment_inbox(conn):
+    """Bandeja persistente de eventos de pago y pagos sin usuario (user_id NULL)"""
+    PaymentEvent.__table__.create(conn, checkfirst=True)
+    _add_missing_columns(conn)
+
+    user_id = next(c for c in inspect(conn).get_columns('payments') if c['name'] == 'user_id')
+    if user_id['nullable']:
+        return
+    if conn.dialect.name == 'sqlite':
+        # SQLite no modifica restricciones de columnas: se reconstruye la tabla
+        columns = ', '.join(c['name'] for c in inspect(conn).get_columns('payments'))
+        conn.execute(text('ALTER TABLE payments RENAME TO payments_old'))
+        Payment.__table__.create(conn)
+        conn.execute(text(f'INSERT INTO payments ({columns}) SELECT {columns} FROM payments_old'))
+        conn.execute(text('DROP TABLE payments_old'))
+    else:
+        conn.execute(text('ALTER TABLE payments ALTER COLUMN user_id DROP NOT NULL'))
+
+# Diferencia fija de America/Puerto_Rico (sin horario de verano) con UTC
+LEGACY_LOCAL_OFFSET = timedelta(hours=4)
+
+def _timestamps_to_utc(conn):
+    """Pasa a UTC los payments.created_at que se guardaron en hora local.
+
+    El valor por defecto de las columnas DateTime era la hora de
+    America/Puerto_Rico (UTC-4) y el resto del código escribía UTC. Solo el
+    alta de pagos dependía de ese valor por defecto: se corrigen las filas
+    cuyo created_at quedó ~4 h antes de completed_at (que siempre se escribió
+    en UTC). En Postgres el valor ya se convertía a UTC al guardarlo y esas
+    filas no cumplen la condición. Los water_logs, users y plan_downloads de
+    las rutas en uso ya se escribían con datetime.utcnow().
+    """
+    payments = Payment.__table__
+    rows = conn.execute(
+        select(payments.c.id, payments.c.created_at, payments.c.completed_at)
+        .where(payments.c.created_at.isnot(None), payments.c.completed_at.isnot(None))
+    ).all()
+    fixed = 0
+    for row in rows:
+        if abs(row.completed_at - row.created_at - LEGACY_LOCAL_OFFSET) <= timedelta(minutes=30):
+            conn.execute(
+                update(payments).where(payments.c.id == row.id)
+                .values(created_at=row.created_at + LEGACY_LOCAL_OFFSET)
+            )
+            fixed += 1
+    logger.info(f"payments.created_at corregidos a UTC: {fixed}")
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'esquema_base', _create_base_schema),
+    Migration(2, 'indices_consultas_frecuentes', _create_hot_query_indexes, transactional=False),
+    Migration(3, 'bandeja_de_pagos', _create_payment_inbox),
+    Migration(4, 'propietario_de_difusiones', _add_missing_columns),
+    Migration(5, 'marcas_de_tiempo_utc', _timestamps_to_utc),
+]
+
+def applied_versions(conn) -> set:
+    """Versiones registradas; solo lee (sin schema_migrations no hay ninguna aplicada)"""
+    if not inspect(conn).has_table(schema_migrations.name):
+        return set()
+    return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+def pending_migrations() -> List[Migration]:
+    """Migraciones aún no aplicadas en la base de datos configurada"""
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+def _record(conn, migration: Migration):
+    conn.execute(schema_migrations.insert().values(
+        version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+    ))
+
+def upgrade() -> int:
+    """Aplica en orden las migraciones pendientes; devuelve cuántas se aplicaron"""
+    lock_conn = None
+    if engine.dialect.name == 'postgresql':
+        lock_conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        lock_conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATIONS_LOCK_ID})
+    try:
+        if os.getenv('RESET_DB_ON_START', 'false').lower() == 'true':
+            with engine.begin() as conn:
+                Base.metadata.drop_all(conn)  # ¡Cuidado! Esto borrará todas las tablas
+                schema_migrations.drop(conn, checkfirst=True)
+            logger.warning("⚠️ Base de datos reiniciada - TODAS LAS TABLAS ELIMINADAS")
+
+        with engine.begin() as conn:
+            schema_migrations.create(conn, checkfirst=True)
+
+        applied = 0
+        for migration in pending_migrations():
+            logger.info(f"Aplicando migración {migration.version}: {migration.name}")
+            if migration.transactional:
+                with engine.begin() as conn:
+                    migration.apply(conn)
+                    _record(conn, migration)
+            else:
+                with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    migration.apply(conn)
+                with engine.begin() as conn:
+                    _record(conn, migration)
+            applied += 1
+        return applied
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATIONS_LOCK_ID})
+            lock_conn.close()
+
+def explain(conn, query) -> List[str]:
+    """Plan de ejecución de una consulta, una línea por nodo"""
+    compiled = query.compile(dialect=conn.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [str(row[-1]) for row in rows]
+
+def is_full_scan(dialect: str, plan: List[str]) -> bool:
+    if dialect == 'sqlite':
+        return any(line.startswith('SCAN ') and 'USING' not in line for line in plan)
+    return any('Seq Scan' in line for line in plan)
+
+def check() -> int:
+    """Devuelve 1 si alguna consulta frecuente cae en un recorrido secuencial"""
+    dialect = engine.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        logger.warning(f"check no soportado para {dialect}")
+        return 0
+
+    failures = 0
+    with engine.connect() as conn:
+        if dialect == 'postgresql':
+            # Con tablas pequeñas el planificador prefiere Seq Scan aunque exista
+            # el índice; desactivarlo deja el Seq Scan solo si no hay alternativa
+            conn.execute(text('SET enable_seqscan = off'))
+        for name, query in hot_queries().items():
+            try:
+                plan = explain(conn, query)
+            except Exception as e:
+                failures += 1
+                logger.error(f"✗ {name}: no se pudo analizar ({e.__class__.__name__}); ¿faltan migraciones?")
+                conn.rollback()
+                continue
+            if is_full_scan(dialect, plan):
+                failures += 1
+                logger.error(f"✗ {name}: recorrido secuencial\n    " + '\n    '.join(plan))
+            else:
+                logger.info(f"✓ {name}: {plan[0]}")
+        conn.rollback()
+    return 1 if failures else 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos")
+    parser.add_argument('command', choices=('upgrade', 'status', 'check'))
+    args = parser.parse_args(argv)
+
+    configure_logging()
+
+    if args.command == 'upgrade':
+        applied = upgrade()
+        logger.info(f"Migraciones aplicadas: {applied}")
+        return 0
+    if args.command == 'status':
+        pending = {migration.version for migration in pending_migrations()}
+        for migration in MIGRATIONS:
+            state = 'pendiente' if migration.version in pending else 'aplicada'
+            logger.info(f"{migration.version:>4} {migration.name:<32} {state}")
+        return 0
+    return check()
+
+if __name__ == '__main__':
+    sys.exit(main())
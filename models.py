@@ -1,15 +1,19 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Float, Boolean, Date, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from zoneinfo import ZoneInfo  # Para Python 3.9+
 
-# Configuración de zona horaria UTC-4
-UTC_4 = ZoneInfo("America/Puerto_Rico")
+# Zona horaria por defecto para usuarios sin configuración propia
+DEFAULT_TIMEZONE = "America/Puerto_Rico"
 
 def utcnow():
-    """Función helper para obtener datetime actual en UTC-4"""
-    return datetime.now(UTC_4)
+    """Fecha y hora actual en UTC sin zona.
+
+    Es la convención de todas las columnas DateTime (igual que
+    ``datetime.utcnow()``); la hora local se calcula al leer con la zona del
+    usuario.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 Base = declarative_base()
 
@@ -25,11 +29,13 @@ class User(Base):
     weight = Column(Float)  # Peso en kg
     water_goal = Column(Float)  # Meta diaria de agua en ml
     current_water = Column(Float, default=0)  # Agua consumida hoy en ml
+    water_date = Column(Date, nullable=True)  # Día local al que corresponde current_water
     is_premium = Column(Boolean, default=False)
-    premium_expiry = Column(DateTime, nullable=True)
+    premium_expiry = Column(DateTime, nullable=True, index=True)
     registered_at = Column(DateTime, default=utcnow)
     last_water_reminder = Column(DateTime, nullable=True)
     language = Column(String(2), default='es')  # Código de idioma (ej: 'es', 'en')
+    is_blocked = Column(Boolean, default=False)  # El usuario bloqueó al bot (no recibe difusiones)
     
     # Relaciones
     water_logs = relationship("WaterLog", back_populates="user", cascade="all, delete-orphan")
@@ -40,6 +46,8 @@ class User(Base):
 class WaterLog(Base):
     """Registro detallado de consumo de agua"""
     __tablename__ = 'water_logs'
+    # Índices creados en despliegues existentes por migrations.py
+    __table_args__ = (Index('ix_water_logs_user_timestamp', 'user_id', 'timestamp'),)
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -53,6 +61,7 @@ class WaterLog(Base):
 class PlanDownload(Base):
     """Registro de descargas de planes nutricionales"""
     __tablename__ = 'plan_downloads'
+    __table_args__ = (Index('ix_plan_downloads_user_downloaded', 'user_id', 'downloaded_at'),)
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -62,34 +71,91 @@ class PlanDownload(Base):
     # Relación
     user = relationship("User", back_populates="plan_downloads")
 
+class PlanRotation(Base):
+    """Planes ya entregados a un usuario en una categoría (bitmap sobre el catálogo)"""
+    __tablename__ = 'plan_rotations'
+    
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    plan_type = Column(String(50), primary_key=True)
+    served = Column(LargeBinary, nullable=False, default=b'')  # Bit i = plan i del catálogo ya entregado
+
 class Payment(Base):
     """Registro de transacciones de pago"""
     __tablename__ = 'payments'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=True)  # NULL si el usuario no existe
+    telegram_id = Column(BigInteger, nullable=True)  # Usuario indicado por el proveedor
     amount = Column(Float, nullable=False)
     currency = Column(String(3), default='USD')  # Código ISO 4217
     payment_method = Column(String(20))  # Ej: 'stripe', 'paypal', etc.
     transaction_id = Column(String(100), unique=True)
-    status = Column(String(20), default='pending')  # Ej: 'pending', 'completed', 'failed'
+    status = Column(String(20), default='pending')  # Ej: 'pending', 'completed', 'failed', 'orphaned'
     created_at = Column(DateTime, default=utcnow)
     completed_at = Column(DateTime, nullable=True)
     
     # Relación
     user = relationship("User", back_populates="payments")
 
+class PaymentEvent(Base):
+    """Bandeja de entrada de eventos de pago verificados, pendientes de aplicar.
+
+    El webhook solo responde 200 al proveedor después de guardar aquí el
+    evento; un reinicio no pierde nada y los fallos se reintentan desde la tabla.
+    """
+    __tablename__ = 'payment_events'
+    
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(String(100), unique=True, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    amount = Column(Float, nullable=False)
+    currency = Column(String(3), default='USD')
+    payment_method = Column(String(20))
+    status = Column(String(20), default='pending', index=True)  # 'pending' o 'done'
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    received_at = Column(DateTime, nullable=False)  # UTC
+    processed_at = Column(DateTime, nullable=True)  # UTC
+
 class UserSettings(Base):
     """Configuraciones personalizadas del usuario"""
     __tablename__ = 'user_settings'
+    __table_args__ = (Index('ix_user_settings_user_reminders', 'user_id', 'water_reminders_enabled'),)
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), unique=True)
     water_reminders_enabled = Column(Boolean, default=True)
-    reminder_start_time = Column(String(5), default='08:00')  # Formato HH:MM (UTC-4)
-    reminder_end_time = Column(String(5), default='22:00')    # Formato HH:MM (UTC-4)
+    reminder_start_time = Column(String(5), default='08:00')  # Formato HH:MM (hora local del usuario)
+    reminder_end_time = Column(String(5), default='22:00')    # Formato HH:MM (hora local del usuario)
+    timezone = Column(String(50), default=DEFAULT_TIMEZONE, index=True)  # Zona IANA, ej: 'America/Bogota'
     reminder_interval = Column(Integer, default=60)  # Intervalo en minutos
     notification_preference = Column(String(20), default='silent')  # Ej: 'sound', 'vibrate', 'silent'
     
     # Relación
-    user = relationship("User", back_populates="settings")
\ No newline at end of file
+    user = relationship("User", back_populates="settings")
+
+class Broadcast(Base):
+    """Difusión de un mensaje a todos los usuarios, con punto de control para reanudar"""
+    __tablename__ = 'broadcasts'
+    
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    created_by = Column(BigInteger, nullable=True)  # telegram_id del administrador
+    status = Column(String(20), default='pending')  # Ej: 'pending', 'running', 'completed'
+    owner = Column(String(100), nullable=True)  # Instancia que la está enviando
+    heartbeat_at = Column(DateTime, nullable=True)  # UTC; último progreso del propietario
+    last_user_id = Column(Integer, default=0)  # Último users.id procesado
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    created_at = Column(DateTime, default=utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class ConversationState(Base):
+    """Estado de conversación pendiente de un usuario (ej: esperando su peso)"""
+    __tablename__ = 'conversation_states'
+    
+    telegram_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    state = Column(String(50), nullable=False)  # Ej: 'awaiting_weight'
+    data = Column(Text, nullable=True)  # JSON compacto con datos adicionales del paso
+    expires_at = Column(DateTime, nullable=False, index=True)  # UTC; pasado este momento se descarta
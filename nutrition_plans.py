@@ -1,82 +1,78 @@
-import random
-import os
-import json
-from pathlib import Path
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import CallbackContext
-from database import get_db_session, User, PlanDownload
-from keyboards import nutrition_plans_keyboard, main_menu_keyboard
+from sqlalchemy.exc import IntegrityError
+from database import get_db_session, get_read_session, User, PlanDownload
+from models import PlanRotation
+from keyboards import nutrition_plans_keyboard, main_menu_keyboard, back_to_menu_keyboard, plan_limit_keyboard
+from entitlements import is_premium
+from overload import overload_controller
+from repository import get_plan_user, count_downloads_since
+from stats import admin_stats
+from message_edits import edit_message
+from i18n import user_language, t
 from datetime import datetime
-import tempfile
 import logging
-from config import Config
+from plan_catalog import get_plans, has_active_plans, retired_plans, pick_unserved, decode_served, encode_served
 
-# Mapeo de tipos de plan a carpetas (debe coincidir con los nombres de tus carpetas en categorias/)
-PLAN_FOLDERS = {
-    'weightL': 'Perdida_de_Peso',
-    'weightG': 'Aumento_Muscular',
-    'maintenance': 'Mantenimiento',
-    'sports': 'Rendimiento_Deportivo',
-    'metabolic': 'Salud_Metabolica',
-    'aesthetic': 'Objetivos_Esteticos'
-}
-
-# Ruta a los archivos de IDs (debe estar en static/ids)
-IDS_FOLDER = os.path.join('static', 'ids')
+logger = logging.getLogger(__name__)
 
 async def handle_nutrition_plan_selection(update: Update, context: CallbackContext):
     """Muestra el menú de selección de planes nutricionales"""
     query = update.callback_query
     await query.answer()
     
-    await query.edit_message_text(
-        "📚 Selecciona el tipo de plan nutricional que deseas:\n\n"
-        "Cada plan está diseñado por expertos en nutrición para ayudarte a alcanzar tus metas.",
-        reply_markup=nutrition_plans_keyboard()
+    lang = user_language(query.from_user)
+    await edit_message(
+        query,
+        t('plans.menu', lang),
+        reply_markup=nutrition_plans_keyboard(lang)
     )
 
-async def get_random_plan_file(plan_type):
-    """Versión con manejo robusto de codificación"""
-    try:
-        folder_name = PLAN_FOLDERS.get(plan_type)
-        if not folder_name:
-            logging.error(f"Tipo de plan no reconocido: {plan_type}")
-            return None
-        
-        ids_file = Path('static') / 'ids' / f"{folder_name}.txt"
-        
-        # Abre el archivo con codificación latin-1 (que maneja bien los caracteres especiales)
+def _ensure_rotation_row(db, user_db_id: int, plan_type: str):
+    """Crea la fila de rotación si no existe, sin fallar si otra petición la creó a la vez"""
+    dialect = db.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        db.execute(
+            insert(PlanRotation)
+            .values(user_id=user_db_id, plan_type=plan_type, served=b'')
+            .on_conflict_do_nothing(index_elements=['user_id', 'plan_type'])
+        )
+    else:
         try:
-            with open(ids_file, 'r', encoding='latin-1') as f:
-                content = f.read()
-                
-                # Intenta parsear el JSON
-                try:
-                    ids_data = json.loads(content)
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error en JSON (posible BOM): {str(e)}")
-                    # Intenta eliminar BOM (Byte Order Mark) si existe
-                    content = content.encode('latin-1').decode('utf-8-sig')
-                    ids_data = json.loads(content)
-                
-                if not ids_data:
-                    logging.error(f"Archivo vacío: {ids_file}")
-                    return None
-                
-                file_name, file_id = random.choice(list(ids_data.items()))
-                return {'file_id': file_id, 'file_name': file_name}
-                
-        except UnicodeDecodeError:
-            # Fallback a utf-8 con manejo de errores
-            with open(ids_file, 'r', encoding='utf-8', errors='replace') as f:
-                ids_data = json.load(f)
-                file_name, file_id = random.choice(list(ids_data.items()))
-                return {'file_id': file_id, 'file_name': file_name}
-                
-    except Exception as e:
-        logging.error(f"Error inesperado en get_random_plan_file: {str(e)}", exc_info=True)
+            with db.begin_nested():
+                db.add(PlanRotation(user_id=user_db_id, plan_type=plan_type, served=b''))
+        except IntegrityError:
+            pass
+
+def choose_next_plan(db, user_db_id: int, plan_type: str):
+    """Elige un plan que el usuario aún no recibió en esta categoría.
+
+    El estado es un bitmap por (usuario, categoría) sobre los índices del
+    catálogo: una sola fila, sin consultar el historial de descargas. El
+    cambio queda pendiente en la sesión y se confirma junto con la descarga.
+    """
+    plans = get_plans(plan_type)
+    if not has_active_plans(plan_type):
+        logger.error(f"Sin planes para el tipo: {plan_type}")
         return None
 
+    # Dos pulsaciones seguidas del primer plan de una categoría pueden llegar
+    # a la vez: la fila se inserta con ON CONFLICT en lugar de db.add()
+    rotation = db.get(PlanRotation, (user_db_id, plan_type))
+    if rotation is None:
+        _ensure_rotation_row(db, user_db_id, plan_type)
+        rotation = db.get(PlanRotation, (user_db_id, plan_type))
+
+    index, served = pick_unserved(decode_served(rotation.served), len(plans), retired=retired_plans(plan_type))
+    rotation.served = encode_served(served, len(plans))
+
+    file_name, file_id = plans[index]
+    return {'file_id': file_id, 'file_name': file_name}
+
 async def send_random_plan(update: Update, context: CallbackContext):
     """Envía un plan nutricional aleatorio usando los file_ids de Telegram"""
     query = update.callback_query
@@ -84,42 +80,42 @@ async def send_random_plan(update: Update, context: CallbackContext):
     
     plan_type = query.data.split('_')[1]
     user_id = query.from_user.id
-    logging.info(f"Buscando plan {plan_type} para usuario {user_id}")
+    lang = user_language(query.from_user)
+    logger.info("Buscando plan %s para usuario %s", plan_type, user_id)
     
-    db = get_db_session()
-    user = db.query(User).filter_by(telegram_id=user_id).first()
+    # Lecturas (usuario y cupo diario) en una sesión que puede ir a una réplica
+    read_db = get_read_session()
+    try:
+        user = get_plan_user(read_db, user_id)
+        downloads_today = None
+        if user and not is_premium(user_id):
+            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+            downloads_today = count_downloads_since(read_db, user.id, today)
+    finally:
+        read_db.close()
     
     if not user:
-        await query.edit_message_text("Usuario no encontrado.")
+        await edit_message(query, t('errors.user_not_found', lang))
         return
     
     # Límite de descargas para no premium
-    if not user.is_premium:
-        downloads_today = db.query(PlanDownload).filter(
-            PlanDownload.user_id == user.id,
-            PlanDownload.downloaded_at >= datetime.utcnow().date()
-        ).count()
-        
-        if downloads_today >= 3:
-            await query.edit_message_text(
-                "⚠️ Límite de descargas alcanzado (3/día).\n"
-                "Hazte Premium para descargas ilimitadas.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🌟 Hazte Premium", callback_data='premium')],
-                    [InlineKeyboardButton("🔙 Menú principal", callback_data='main_menu')]
-                ])
-            )
-            return
+    if downloads_today is not None and downloads_today >= 3:
+        await edit_message(
+            query,
+            t('plans.limit_reached', lang, limit=3),
+            reply_markup=plan_limit_keyboard(lang)
+        )
+        return
     
+    db = get_db_session()
     try:
-        plan_data = await get_random_plan_file(plan_type)
+        plan_data = choose_next_plan(db, user.id, plan_type)
         
         if not plan_data:
-            await query.edit_message_text(
-                "⚠️ No hay planes disponibles ahora.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Menú principal", callback_data='main_menu')]
-                ])
+            await edit_message(
+                query,
+                t('plans.none_available', lang),
+                reply_markup=back_to_menu_keyboard(lang)
             )
             return
         
@@ -130,35 +126,38 @@ async def send_random_plan(update: Update, context: CallbackContext):
             downloaded_at=datetime.utcnow()
         ))
         db.commit()
+        admin_stats.record_download(user_id, plan_type)
         
         # Enviar documento usando el file_id
         await context.bot.send_document(
             chat_id=user_id,
             document=plan_data['file_id'],
             filename=plan_data['file_name'],
-            caption=f"📄 Plan de {plan_type.replace('_', ' ')}"
+            caption=t('plans.caption', lang, plan=plan_type.replace('_', ' '))
         )
         
-        # Mensaje final
-        await context.bot.send_message(  
-            chat_id=user_id,  
-            text=random.choice([  
-                f"¡Listo, {user.first_name}! 📂\n\n¿En qué más puedo ayudarte?",  
-                f"¡Perfecto, {user.first_name}! 💡\n\n¿Qué hacemos ahora?",  
-                f"¡Genial, {user.first_name}! 🌟\n\n¿Necesitas algo más?"   
-            ]),  
-            reply_markup=main_menu_keyboard(),  
-            parse_mode="HTML"  
+        # Mensaje final (cosmético: se aplaza si el bot está sobrecargado)
+        first_name = user.first_name
+        await overload_controller.run_nonessential(
+            lambda: context.bot.send_message(
+                chat_id=user_id,
+                text=t('plans.done', lang, name=first_name),
+                reply_markup=main_menu_keyboard(lang),
+                parse_mode="HTML"
+            ),
+            description='mensaje final del plan'
         )
         
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
-        await query.edit_message_text(
-            "⚠️ Error al generar tu plan. Inténtalo más tarde.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Menú principal", callback_data='main_menu')]
-            ])
+        logger.error(f"Error: {str(e)}")
+        db.rollback()
+        await edit_message(
+            query,
+            t('plans.error', lang),
+            reply_markup=back_to_menu_keyboard(lang)
         )
+    finally:
+        db.close()
 
 # Exportación explícita para evitar errores de importación
 __all__ = ['handle_nutrition_plan_selection', 'send_random_plan']
\ No newline at end of file
@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from telegram import Update
+from config import Config
+from i18n import user_language, t
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de admisión (menor = se atiende antes)
+CRITICAL = 0  # registros de peso/agua: nunca se descartan
+NORMAL = 1
+
+CRITICAL_CALLBACKS = re.compile(r'^(water_amount_[0-9]+|register_weight)$')
+WEIGHT_TEXT = re.compile(r'^\d+([,.]\d+)?$')
+
+def update_priority(update: Update) -> int:
+    """Prioridad de un update según lo que escribe: peso y agua van primero"""
+    if update.callback_query:
+        return CRITICAL if CRITICAL_CALLBACKS.match(update.callback_query.data or '') else NORMAL
+    message = update.message
+    if message and message.text and WEIGHT_TEXT.match(message.text.strip()):
+        return CRITICAL
+    return NORMAL
+
+class PriorityGate:
+    """Limita los handlers simultáneos; al liberarse un hueco entra el de mayor prioridad"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []  # heap de (prioridad, orden de llegada, future)
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Si el hueco ya se había cedido a esta espera, se pasa al siguiente
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)  # El hueco pasa directamente al siguiente
+                return
+        self.active -= 1
+
+class OverloadController:
+    """Detecta sobrecarga (updates pendientes y retraso del loop) y decide qué se descarta.
+
+    Con sobrecarga, los callbacks no críticos se responden al instante con un
+    aviso de "ocupado" sin ejecutar el handler, y los mensajes cosméticos se
+    aplazan hasta que baje la carga. Los registros de peso/agua siempre se
+    admiten y pasan delante en la cola.
+    """
+
+    def __init__(self, max_pending: int, max_lag: float, max_concurrent: int, defer_max_age: float):
+        self.max_pending = max_pending
+        self.max_lag = max_lag
+        self.max_concurrent = max_concurrent
+        self.defer_max_age = defer_max_age
+        self.pending = 0
+        self.lag = 0.0
+        self.counters = {
+            'admitted': 0,
+            'admitted_critical': 0,
+            'shed_callbacks': 0,
+            'plain_greetings': 0,
+            'deferred': 0,
+            'deferred_sent': 0,
+            'deferred_dropped': 0
+        }
+        self._lock = threading.Lock()
+        self._gate = None
+        self._deferred_tasks = set()
+
+    @classmethod
+    def from_config(cls) -> 'OverloadController':
+        return cls(
+            max_pending=Config.OVERLOAD_MAX_PENDING,
+            max_lag=Config.OVERLOAD_MAX_LAG_MS / 1000,
+            max_concurrent=Config.OVERLOAD_MAX_CONCURRENT,
+            defer_max_age=Config.OVERLOAD_DEFER_MAX_AGE
+        )
+
+    @property
+    def overloaded(self) -> bool:
+        return self.pending > self.max_pending or self.lag > self.max_lag
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    # Contabilidad de updates recibidos: ``enter`` en el hilo del servidor web
+    # y ``leave`` cuando el handler termina en el loop
+    def enter(self):
+        with self._lock:
+            self.pending += 1
+
+    def leave(self):
+        with self._lock:
+            self.pending -= 1
+
+    async def monitor_loop_lag(self, interval: float = 0.5):
+        """Mide cuánto se retrasa el loop respecto a un sleep programado (media móvil)"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            delay = max(0.0, time.monotonic() - started - interval)
+            self.lag = self.lag * 0.7 + delay * 0.3
+
+    @asynccontextmanager
+    async def admit(self, priority: int):
+        """Reserva un hueco de ejecución respetando la prioridad del update"""
+        if self._gate is None:
+            self._gate = PriorityGate(self.max_concurrent)
+        self.count('admitted_critical' if priority == CRITICAL else 'admitted')
+        await self._gate.acquire(priority)
+        try:
+            yield
+        finally:
+            self._gate.release()
+
+    async def process(self, application, update: Update):
+        """Procesa un update aplicando la política de descarte y prioridad"""
+        priority = update_priority(update)
+        if priority != CRITICAL and update.callback_query and self.overloaded:
+            self.count('shed_callbacks')
+            await update.callback_query.answer(t('overload.busy', user_language(update.effective_user)))
+            return
+
+        async with self.admit(priority):
+            await application.process_update(update)
+
+    async def run_nonessential(self, coro_factory, description: str = 'mensaje'):
+        """Ejecuta un envío cosmético ahora o, con sobrecarga, cuando baje la carga.
+
+        ``coro_factory`` se llama sin argumentos y devuelve la corrutina a
+        ejecutar. Si la sobrecarga dura más de ``defer_max_age`` segundos el
+        envío se descarta.
+        """
+        if not self.overloaded:
+            await coro_factory()
+            return
+
+        self.count('deferred')
+        task = asyncio.get_running_loop().create_task(self._run_later(coro_factory, description))
+        self._deferred_tasks.add(task)
+        task.add_done_callback(self._deferred_tasks.discard)
+
+    async def _run_later(self, coro_factory, description: str):
+        deadline = time.monotonic() + self.defer_max_age
+        while self.overloaded and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+
+        if self.overloaded:
+            self.count('deferred_dropped')
+            logger.info(f"Sobrecarga persistente, se descarta {description} aplazado")
+            return
+        try:
+            await coro_factory()
+            self.count('deferred_sent')
+        except Exception as e:
+            logger.warning(f"Error enviando {description} aplazado: {e}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'overloaded': self.overloaded,
+            'pending': self.pending,
+            'loop_lag_ms': round(self.lag * 1000, 1),
+            'waiting': len(self._gate) if self._gate else 0,
+            'deferred_in_flight': len(self._deferred_tasks),
+            **counters
+        }
+
+overload_controller = OverloadController.from_config()
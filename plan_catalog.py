@@ -0,0 +1,100 @@
+import json
+import logging
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Mapeo de tipos de plan a carpetas (debe coincidir con los nombres de tus carpetas en categorias/)
+PLAN_FOLDERS = {
+    'weightL': 'Perdida_de_Peso',
+    'weightG': 'Aumento_Muscular',
+    'maintenance': 'Mantenimiento',
+    'sports': 'Rendimiento_Deportivo',
+    'metabolic': 'Salud_Metabolica',
+    'aesthetic': 'Objetivos_Esteticos'
+}
+
+# Ruta a los archivos de IDs (debe estar en static/ids)
+IDS_FOLDER = os.path.join('static', 'ids')
+
+logger = logging.getLogger(__name__)
+
+_catalog: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+_retired: Dict[str, int] = {}  # plan_type -> bitmap de índices retirados
+_catalog_lock = threading.Lock()
+
+def read_ids_file(path: str) -> dict:
+    """Lee un archivo de ids; los hechos a mano pueden venir en latin-1 o con BOM"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        return json.loads(raw.decode('utf-8-sig'))
+    except UnicodeDecodeError:
+        return json.loads(raw.decode('latin-1'))
+
+def load_catalog() -> Dict[str, List[Tuple[str, Optional[str]]]]:
+    """Carga (una vez) todos los archivos de ids: plan_type -> [(nombre, file_id)] en orden del archivo.
+
+    El orden del archivo define el índice de cada plan; upload_plans.py añade
+    los archivos nuevos al final y deja los eliminados como ``null``
+    (lápida), así los índices existentes nunca cambian. El catálogo se lee
+    solo al arrancar: lo subido después se ve tras reiniciar el bot.
+    """
+    with _catalog_lock:
+        if not _catalog:
+            for plan_type, folder_name in PLAN_FOLDERS.items():
+                path = os.path.join(IDS_FOLDER, f"{folder_name}.txt")
+                try:
+                    _catalog[plan_type] = list(read_ids_file(path).items())
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error cargando catálogo {path}: {e}")
+                    _catalog[plan_type] = []
+                _retired[plan_type] = sum(
+                    1 << index for index, (_, file_id) in enumerate(_catalog[plan_type]) if not file_id
+                )
+            active = {k: sum(1 for _, file_id in v if file_id) for k, v in _catalog.items()}
+            logger.info(f"Catálogo de planes cargado: {active}")
+        return _catalog
+
+def get_plans(plan_type: str) -> List[Tuple[str, Optional[str]]]:
+    """Planes de la categoría por índice; los retirados tienen file_id None"""
+    return load_catalog().get(plan_type, [])
+
+def retired_plans(plan_type: str) -> int:
+    """Bitmap de los índices retirados (lápidas) de la categoría"""
+    load_catalog()
+    return _retired.get(plan_type, 0)
+
+def has_active_plans(plan_type: str) -> bool:
+    return any(file_id for _, file_id in get_plans(plan_type))
+
+def decode_served(data: Optional[bytes]) -> int:
+    return int.from_bytes(data or b'', 'little')
+
+def encode_served(served: int, size: int) -> bytes:
+    return served.to_bytes((size + 7) // 8, 'little')
+
+def pick_unserved(served: int, size: int, rng=random, retired: int = 0) -> Tuple[int, int]:
+    """Elige al azar un índice aún no entregado y devuelve (índice, bitmap actualizado).
+
+    Los índices retirados cuentan como entregados y nunca se eligen. Cuando
+    todos los planes de la categoría ya se entregaron, la bolsa se vacía y se
+    empieza una nueva ronda. Los bits fuera del catálogo se descartan.
+    """
+    full = (1 << size) - 1
+    retired &= full
+    if retired == full:
+        raise ValueError("Todos los planes de la categoría están retirados")
+    served = (served | retired) & full
+    if served == full:
+        served = retired
+
+    remaining = rng.randrange(size - bin(served).count('1'))
+    for index in range(size):
+        if not served >> index & 1:
+            if remaining == 0:
+                # Las lápidas no se guardan: un plan que vuelva al catálogo está disponible
+                return index, (served | (1 << index)) & ~retired
+            remaining -= 1
+    raise AssertionError("bitmap inconsistente")
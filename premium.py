@@ -1,32 +1,47 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
-from database import get_db_session, User, Payment
-from keyboards import premium_options_keyboard
+from database import get_db_session, SessionFactory, User, Payment
+from models import PaymentEvent
+from keyboards import premium_options_keyboard, back_to_menu_keyboard
 from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+import json
+import logging
+import threading
+import time
 import stripe
 from config import Config
+from entitlements import remember_user
+from stats import admin_stats
+from message_edits import edit_message
+from i18n import DEFAULT_LANGUAGE, language_cache, user_language, t
+
+logger = logging.getLogger(__name__)
 
 stripe.api_key = Config.STRIPE_API_KEY
 
+PREMIUM_DAYS = 30  # Duración de la suscripción pagada
+PREMIUM_PRICE = 9.99  # USD
+
+# Eventos de Stripe que activan o renuevan premium
+HANDLED_PAYMENT_EVENTS = ('checkout.session.completed', 'invoice.paid')
+
 async def handle_premium_payment(update: Update, context: CallbackContext):
     """Muestra las opciones de pago para premium"""
     query = update.callback_query
+    lang = user_language(update.effective_user)
     if query is None:
         # Si no es una callback query, responder adecuadamente
-        await update.message.reply_text("Por favor usa los botones del menú para interactuar con el bot.")
+        await update.message.reply_text(t('premium.use_buttons', lang))
         return
     
     await query.answer()
     
-    await query.edit_message_text(
-        "🌟 ¡Conviértete en usuario Premium! 🌟\n\n"
-        "Beneficios:\n"
-        "✅ Descargas ilimitadas de planes nutricionales\n"
-        "✅ Acceso a contenido exclusivo\n"
-        "✅ Soporte prioritario\n\n"
-        "Precio: $9.99 USD/mes\n\n"
-        "Selecciona tu método de pago:",
-        reply_markup=premium_options_keyboard()
+    await edit_message(
+        query,
+        t('premium.offer', lang, price=PREMIUM_PRICE),
+        reply_markup=premium_options_keyboard(lang)
     )
 
 def create_stripe_payment_link(user_id: int):
@@ -47,7 +62,9 @@ def create_stripe_payment_link(user_id: int):
             mode='subscription',
             success_url=f'https://t.me/nutribot?start=payment_success_{user_id}',
             cancel_url='https://t.me/nutribot?start=payment_cancel',
-            metadata={'user_id': user_id}
+            metadata={'user_id': user_id},
+            # Las renovaciones (invoice.paid) solo conocen los metadatos de la suscripción
+            subscription_data={'metadata': {'user_id': user_id}}
         )
         return session.url
     except Exception as e:
@@ -60,22 +77,24 @@ async def handle_payment_method(update: Update, context: CallbackContext):
     await query.answer()
     payment_method = query.data.split('_')[1]
     user_id = query.from_user.id
+    lang = user_language(query.from_user)
     
     if payment_method == 'credit_card':
         payment_url = create_stripe_payment_link(user_id)
         if payment_url:
-            await query.edit_message_text(
-                "💳 Pago con tarjeta de crédito\n\n"
-                "Haz clic en el siguiente enlace para completar tu pago seguro con Stripe:",
+            await edit_message(
+                query,
+                t('premium.card_payment', lang),
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔗 Pagar con Stripe", url=payment_url)],
-                    [InlineKeyboardButton("🔙 Atrás", callback_data='premium')]
+                    [InlineKeyboardButton(t('kb.pay_stripe', lang), url=payment_url)],
+                    [InlineKeyboardButton(t('kb.back', lang), callback_data='premium')]
                 ])
             )
         else:
-            await query.edit_message_text(
-                "⚠️ Error al procesar el pago. Por favor, inténtalo de nuevo más tarde.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Menú principal", callback_data='main_menu')]])
+            await edit_message(
+                query,
+                t('premium.payment_error', lang),
+                reply_markup=back_to_menu_keyboard(lang)
             )
     
     elif payment_method == 'paypal':
@@ -86,25 +105,310 @@ async def handle_payment_method(update: Update, context: CallbackContext):
         # Implementar lógica de criptomonedas
         pass
 
-def process_payment_success(user_id: int):
-    """Actualiza el estado del usuario a premium después de un pago exitoso"""
+def verify_payment_signature(payload: bytes, signature: str) -> bool:
+    """Verifica la firma Stripe-Signature del webhook de pagos"""
+    if not Config.STRIPE_WEBHOOK_SECRET:
+        logger.error("STRIPE_WEBHOOK_SECRET no configurado; se rechazan los webhooks de pago")
+        return False
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode('utf-8'),
+            signature,
+            Config.STRIPE_WEBHOOK_SECRET,
+            tolerance=stripe.Webhook.DEFAULT_TOLERANCE
+        )
+        return True
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError):
+        return False
+
+def parse_payment_event(event: dict) -> Optional[Dict]:
+    """Extrae los datos del pago de un evento de Stripe (None si no aplica)"""
+    event_type = event.get('type')
+    if event_type not in HANDLED_PAYMENT_EVENTS:
+        return None
+
+    obj = (event.get('data') or {}).get('object') or {}
+    if event_type == 'checkout.session.completed':
+        if obj.get('payment_status') != 'paid':
+            return None
+        amount = obj.get('amount_total')
+        metadata = obj.get('metadata') or {}
+    else:
+        # La primera factura ya llega como checkout.session.completed
+        if obj.get('billing_reason') != 'subscription_cycle':
+            return None
+        amount = obj.get('amount_paid')
+        metadata = (obj.get('subscription_details') or {}).get('metadata') or obj.get('metadata') or {}
+
+    user_id = metadata.get('user_id')
+    if not user_id or not obj.get('id'):
+        logger.warning(f"Evento de pago {event.get('id')} sin user_id u objeto; ignorado")
+        return None
+    # Los metadatos son texto libre: un user_id inválido no debe provocar
+    # reintentos eternos del proveedor
+    try:
+        telegram_id = int(user_id)
+    except (TypeError, ValueError):
+        logger.warning(f"Evento de pago {event.get('id')} con user_id inválido {user_id!r}; ignorado")
+        return None
+
+    return {
+        'transaction_id': obj['id'],
+        'telegram_id': telegram_id,
+        'amount': amount / 100 if amount is not None else PREMIUM_PRICE,
+        'currency': (obj.get('currency') or 'usd').upper(),
+        'payment_method': 'stripe'
+    }
+
+def fulfill_payments(payments: List[Dict]) -> List[Dict]:
+    """Activa premium y registra los pagos en una sola transacción.
+
+    El ``transaction_id`` único de ``Payment`` hace que los reintentos del
+    proveedor sean no-ops. Devuelve solo los pagos aplicados en esta llamada.
+    """
+    unique = {}
+    for payment in payments:
+        unique.setdefault(payment['transaction_id'], payment)
+    if not unique:
+        return []
+
     db = get_db_session()
-    user = db.query(User).filter_by(telegram_id=user_id).first()
-    
-    if user:
-        user.is_premium = True
-        user.premium_expiry = datetime.utcnow() + timedelta(days=30)  # 1 mes
-        db.commit()
-        
-        # Registrar el pago
-        db.add(Payment(
-            user_id=user.id,
-            amount=9.99,
-            payment_method='stripe',
-            status='completed',
-            completed_at=datetime.utcnow()
-        ))
+    try:
+        existing = {
+            transaction_id for (transaction_id,) in
+            db.query(Payment.transaction_id).filter(Payment.transaction_id.in_(list(unique)))
+        }
+        pending = [p for transaction_id, p in unique.items() if transaction_id not in existing]
+        if not pending:
+            return []
+
+        users = {
+            user.telegram_id: user for user in
+            db.query(User).filter(User.telegram_id.in_({p['telegram_id'] for p in pending}))
+        }
+
+        now = datetime.utcnow()
+        fulfilled = []
+        for payment in pending:
+            user = users.get(payment['telegram_id'])
+            if not user:
+                # Se registra igualmente para poder conciliarlo después
+                logger.warning(f"Pago {payment['transaction_id']} para usuario desconocido {payment['telegram_id']}")
+                db.add(Payment(
+                    user_id=None,
+                    telegram_id=payment['telegram_id'],
+                    amount=payment['amount'],
+                    currency=payment.get('currency', 'USD'),
+                    payment_method=payment.get('payment_method', 'stripe'),
+                    transaction_id=payment['transaction_id'],
+                    status='orphaned',
+                    created_at=now
+                ))
+                continue
+
+            # Las renovaciones anticipadas extienden la suscripción vigente
+            base = user.premium_expiry if user.is_premium and user.premium_expiry and user.premium_expiry > now else now
+            payment['activated'] = not user.is_premium
+            user.is_premium = True
+            user.premium_expiry = base + timedelta(days=PREMIUM_DAYS)
+
+            db.add(Payment(
+                user_id=user.id,
+                telegram_id=user.telegram_id,
+                amount=payment['amount'],
+                currency=payment.get('currency', 'USD'),
+                payment_method=payment.get('payment_method', 'stripe'),
+                transaction_id=payment['transaction_id'],
+                status='completed',
+                created_at=now,
+                completed_at=now
+            ))
+            fulfilled.append(payment)
+
         db.commit()
-        
+
+        for payment in fulfilled:
+            remember_user(users[payment['telegram_id']])
+            admin_stats.record_payment(payment['telegram_id'], payment['amount'], payment.pop('activated'))
+        return fulfilled
+    except IntegrityError:
+        # Otro proceso registró alguno de estos pagos entre la consulta y el commit
+        db.rollback()
+        if len(unique) == 1:
+            return []
+        fulfilled = []
+        for payment in unique.values():
+            fulfilled.extend(fulfill_payments([payment]))
+        return fulfilled
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def process_payment_success(user_id: int, transaction_id: str, amount: float = PREMIUM_PRICE,
+                            payment_method: str = 'stripe') -> bool:
+    """Actualiza el estado del usuario a premium después de un pago exitoso.
+
+    Devuelve False si el usuario no existe o el pago ya estaba registrado.
+    """
+    fulfilled = fulfill_payments([{
+        'transaction_id': transaction_id,
+        'telegram_id': user_id,
+        'amount': amount,
+        'payment_method': payment_method
+    }])
+    return bool(fulfilled)
+
+async def notify_premium_activated(bot, telegram_id: int):
+    """Avisa al usuario de que su suscripción premium está activa"""
+    try:
+        await bot.send_message(
+            chat_id=telegram_id,
+            text=t('premium.activated', language_cache.get(telegram_id) or DEFAULT_LANGUAGE)
+        )
+    except Exception as e:
+        logger.error(f"Error notificando premium a {telegram_id}: {e}")
+
+class PaymentInbox:
+    """Bandeja persistente para los eventos del webhook de pagos.
+
+    El endpoint guarda el evento en ``payment_events`` y solo entonces responde
+    200; si no puede guardarlo responde 503 y el proveedor reintenta. Un hilo
+    dedicado (fuera del loop del bot) aplica los eventos pendientes por lotes.
+    Un lote que falla queda pendiente y se reintenta con espera creciente:
+    nunca se descarta un evento ya confirmado al proveedor, y los que quedaron
+    pendientes por un reinicio se aplican al arrancar.
+    """
+
+    ALERT_ATTEMPTS = 5  # A partir de aquí cada fallo se registra como crítico
+    MAX_BACKOFF = 300  # Segundos
+
+    def __init__(self, batch_size: int = Config.PAYMENT_BATCH_SIZE, poll_interval: float = 30,
+                 on_fulfilled: Optional[Callable[[Dict], None]] = None):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.on_fulfilled = on_fulfilled
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._failures = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='PaymentWorkerThread')
+            self._thread.start()
+
+    def receive(self, payload: bytes, signature: str) -> Tuple[str, int]:
+        """Atiende una llamada del webhook de pagos; devuelve (cuerpo, código HTTP)"""
+        if not verify_payment_signature(payload, signature):
+            logger.warning("Firma inválida en el webhook de pagos")
+            return "Invalid signature", 400
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return "Invalid payload", 400
+
+        # Sin 200 hasta que el evento está guardado: si falla, el proveedor reintenta
+        if not self.store(event):
+            return "unavailable", 503
+        return "ok", 200
+
+    def store(self, event: dict) -> bool:
+        """Guarda un evento ya verificado. Devuelve False si no se pudo persistir."""
+        payment = parse_payment_event(event)
+        if payment is None:
+            return True  # Evento irrelevante: se confirma sin procesar
+        db = SessionFactory()
+        try:
+            db.add(PaymentEvent(
+                transaction_id=payment['transaction_id'],
+                telegram_id=payment['telegram_id'],
+                amount=payment['amount'],
+                currency=payment.get('currency', 'USD'),
+                payment_method=payment.get('payment_method', 'stripe'),
+                status='pending',
+                attempts=0,
+                received_at=datetime.utcnow()
+            ))
+            db.commit()
+        except IntegrityError:
+            # Reenvío del proveedor: el evento ya está en la bandeja
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudo guardar el evento de pago {payment['transaction_id']}: {e}")
+            return False
+        finally:
+            db.close()
+        self._wakeup.set()
         return True
-    return False
\ No newline at end of file
+
+    def _run(self):
+        while True:
+            processed = self.process_pending()
+            if processed is None:
+                # Fallo: espera creciente antes de reintentar el mismo lote
+                time.sleep(min(2 ** self._failures, self.MAX_BACKOFF))
+            elif processed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def process_pending(self) -> Optional[int]:
+        """Aplica un lote de eventos pendientes; devuelve cuántos o None si falló"""
+        # Sesión propia: fulfill_payments usa la sesión del hilo y la cierra
+        db = SessionFactory()
+        try:
+            # SKIP LOCKED: con varias instancias cada una toma eventos distintos
+            events = (
+                db.query(PaymentEvent)
+                .filter(PaymentEvent.status == 'pending')
+                .order_by(PaymentEvent.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not events:
+                db.commit()
+                return 0
+
+            batch = [{
+                'transaction_id': event.transaction_id,
+                'telegram_id': event.telegram_id,
+                'amount': event.amount,
+                'currency': event.currency,
+                'payment_method': event.payment_method
+            } for event in events]
+            try:
+                fulfilled = fulfill_payments(batch)
+            except Exception as e:
+                self._failures += 1
+                log = logger.critical if self._failures >= self.ALERT_ATTEMPTS else logger.error
+                log(f"Error aplicando lote de {len(batch)} pagos (intento {self._failures}): {e}")
+                for event in events:
+                    event.attempts = (event.attempts or 0) + 1
+                    event.last_error = str(e)[:500]
+                db.commit()
+                return None
+
+            now = datetime.utcnow()
+            for event in events:
+                event.status = 'done'
+                event.processed_at = now
+            db.commit()
+            self._failures = 0
+        except Exception as e:
+            db.rollback()
+            self._failures += 1
+            logger.error(f"Error leyendo la bandeja de pagos: {e}")
+            return None
+        finally:
+            db.close()
+
+        logger.info(f"Lote de pagos procesado: {len(fulfilled)} nuevos de {len(batch)} eventos")
+        if self.on_fulfilled:
+            for payment in fulfilled:
+                try:
+                    self.on_fulfilled(payment)
+                except Exception as e:
+                    logger.error(f"Error en callback de pago {payment['transaction_id']}: {e}")
+        return len(events)
@@ -0,0 +1,113 @@
+"""Profiler por muestreo bajo demanda (ver /debug/profile).
+
+Toma muestras de la pila de todos los hilos (workers de waitress,
+BotManagerLoop, KeepAliveThread...) con ``sys._current_frames()`` a una
+frecuencia fija y devuelve el resultado en formato "collapsed stacks", una
+línea por pila con su número de muestras, listo para flamegraph.pl o
+speedscope:
+
+    BotManagerLoop;run;_run_once;handle_water_amount (water_reminders.py:395) 42
+
+La vista ``tasks`` muestrea en cambio las corrutinas pendientes del loop del
+bot (``asyncio.all_tasks``), útil para ver en qué ``await`` esperan los
+handlers. El muestreo no instrumenta el código: el coste es proporcional a la
+frecuencia y solo existe mientras hay un perfil en curso. Solo puede haber
+uno a la vez.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from config import Config
+
+class ProfilerBusy(RuntimeError):
+    """Ya hay un perfil en curso"""
+
+def _label(code, lineno: Optional[int] = None) -> str:
+    location = f"{os.path.basename(code.co_filename)}:{lineno or code.co_firstlineno}"
+    return f"{code.co_name} ({location})"
+
+def _thread_stack(frame) -> list:
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def _task_stack(task: asyncio.Task) -> list:
+    """Cadena de corrutinas de una tarea, de la externa a la que está esperando"""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None:
+        code = getattr(coro, 'cr_code', None) or getattr(coro, 'gi_code', None)
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if code is None:
+            stack.append(type(coro).__name__)
+            break
+        stack.append(_label(code, frame.f_lineno if frame else None))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return stack
+
+class SamplingProfiler:
+    def __init__(self, max_seconds: float = 60, hz: float = 100):
+        self.max_seconds = max_seconds
+        self.hz = hz
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, view: str = 'threads', loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+        """Muestrea durante ``seconds`` y devuelve las pilas colapsadas"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("Ya hay un perfil en curso")
+        try:
+            seconds = min(max(seconds, 0.1), self.max_seconds)
+            if view == 'tasks':
+                samples = self._sample_tasks(seconds, loop)
+            else:
+                samples = self._sample_threads(seconds)
+        finally:
+            self._lock.release()
+        return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    def _sample_threads(self, seconds: float) -> Counter:
+        samples = Counter()
+        me = threading.get_ident()
+        interval = 1 / self.hz
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    name = names.get(ident, f"thread-{ident}")
+                    samples[';'.join([name] + _thread_stack(frame))] += 1
+            time.sleep(interval)
+        return samples
+
+    def _sample_tasks(self, seconds: float, loop: Optional[asyncio.AbstractEventLoop]) -> Counter:
+        if loop is None or not loop.is_running():
+            raise RuntimeError("El loop del bot no está en marcha")
+
+        async def collect():
+            return [
+                ';'.join([f"task:{task.get_name()}"] + _task_stack(task))
+                for task in asyncio.all_tasks() if task is not asyncio.current_task()
+            ]
+
+        samples = Counter()
+        # Las tareas se leen desde el propio loop; con el loop bloqueado la muestra se pierde
+        interval = max(1 / self.hz, 0.01)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                stacks = asyncio.run_coroutine_threadsafe(collect(), loop).result(timeout=1)
+            except Exception:
+                samples['loop no disponible'] += 1
+            else:
+                samples.update(stacks)
+            time.sleep(interval)
+        return samples
+
+sampling_profiler = SamplingProfiler(Config.PROFILE_MAX_SECONDS, Config.PROFILE_HZ)
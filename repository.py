@@ -0,0 +1,134 @@
+"""Consultas de solo lectura para las rutas más frecuentes.
+
+Devuelven tuplas con nombre con las columnas justas en lugar de entidades
+``User`` completas: sin identity map, sin estado de sesión y sin relaciones,
+lo que reduce CPU y memoria por fila (ver bench_projections.py). Son de solo
+lectura; las escrituras se hacen con UPDATE explícitos o con el ORM.
+
+Cada consulta se construye con una función ``*_query`` que usan tanto la app
+como ``python migrations.py check`` (ver ``hot_queries``), así el EXPLAIN se
+hace sobre las mismas sentencias que se ejecutan en producción.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional
+from sqlalchemy import func, select
+from models import User, UserSettings, PlanDownload, WaterLog, ConversationState
+from i18n import DEFAULT_LANGUAGE, language_cache, normalize_language
+
+# Tamaño de los bloques IN en las consultas por lotes
+BATCH_SIZE = 1000
+
+class HydrationState(NamedTuple):
+    telegram_id: int
+    current_water: float
+    water_goal: Optional[float]
+    weight: Optional[float]
+    reminders_enabled: bool
+
+class PlanUser(NamedTuple):
+    id: int
+    telegram_id: int
+    first_name: Optional[str]
+
+# Construida una vez: cada llamada solo añade el WHERE
+_HYDRATION_QUERY = (
+    select(
+        User.telegram_id,
+        func.coalesce(User.current_water, 0),
+        User.water_goal,
+        User.weight,
+        # Sin configuración cuenta como recordatorios activos
+        func.coalesce(UserSettings.water_reminders_enabled, True)
+    )
+    .select_from(User)
+    .outerjoin(UserSettings, UserSettings.user_id == User.id)
+)
+
+def hydration_query(telegram_id: int):
+    return _HYDRATION_QUERY.where(User.telegram_id == telegram_id)
+
+def registered_query(telegram_id: int):
+    return select(User.id).where(User.telegram_id == telegram_id).limit(1)
+
+def plan_user_query(telegram_id: int):
+    return select(User.id, User.telegram_id, User.first_name).where(User.telegram_id == telegram_id)
+
+def downloads_since_query(user_db_id: int, since: datetime):
+    return select(func.count(PlanDownload.id)).where(
+        PlanDownload.user_id == user_db_id,
+        PlanDownload.downloaded_at >= since
+    )
+
+def last_water_log_query(user_db_id: int):
+    """Momento del último registro de agua (para deducir el día de usuarios antiguos)"""
+    return select(func.max(WaterLog.timestamp)).where(WaterLog.user_id == user_db_id)
+
+def expired_premium_condition(now: datetime) -> tuple:
+    """Filtro de las suscripciones vencidas (lo usa el UPDATE del barrido de expiración)"""
+    return (
+        User.is_premium.is_(True),
+        User.premium_expiry.isnot(None),
+        User.premium_expiry <= now
+    )
+
+def expired_premium_query(now: datetime):
+    return select(User.telegram_id).where(*expired_premium_condition(now))
+
+def expired_states_condition(now: datetime):
+    """Filtro de los estados de conversación caducados (lo usa el DELETE de la purga)"""
+    return ConversationState.expires_at <= now
+
+def hot_queries(now: Optional[datetime] = None) -> dict:
+    """Consultas frecuentes de la app con valores de ejemplo, para EXPLAIN"""
+    now = now or datetime.utcnow()
+    return {
+        'estado_hidratacion': hydration_query(1),
+        'usuario_registrado': registered_query(1),
+        'usuario_del_plan': plan_user_query(1),
+        'descargas_del_dia': downloads_since_query(1, now),
+        'ultimo_registro_agua': last_water_log_query(1),
+        'premium_vencido': expired_premium_query(now),
+        'estados_expirados': select(ConversationState.telegram_id).where(expired_states_condition(now)),
+    }
+
+def get_hydration_state(db, telegram_id: int) -> Optional[HydrationState]:
+    """Estado de hidratación de un usuario, o None si no está registrado"""
+    row = db.execute(hydration_query(telegram_id)).first()
+    return HydrationState._make(row) if row else None
+
+def get_hydration_states(db, telegram_ids: Iterable[int]) -> Dict[int, HydrationState]:
+    """Estado de hidratación de varios usuarios, en bloques de BATCH_SIZE"""
+    telegram_ids = list(telegram_ids)
+    states = {}
+    for start in range(0, len(telegram_ids), BATCH_SIZE):
+        chunk = telegram_ids[start:start + BATCH_SIZE]
+        for row in db.execute(_HYDRATION_QUERY.where(User.telegram_id.in_(chunk))):
+            state = HydrationState._make(row)
+            states[state.telegram_id] = state
+    return states
+
+def is_registered(db, telegram_id: int) -> bool:
+    """¿Existe el usuario? Solo lee el id, sin cargar la entidad"""
+    return db.execute(registered_query(telegram_id)).first() is not None
+
+def get_plan_user(db, telegram_id: int) -> Optional[PlanUser]:
+    """Columnas necesarias para enviar un plan"""
+    row = db.execute(plan_user_query(telegram_id)).first()
+    return PlanUser._make(row) if row else None
+
+def count_downloads_since(db, user_db_id: int, since: datetime) -> int:
+    """Descargas de planes de un usuario desde una fecha, con un COUNT directo"""
+    return db.execute(downloads_since_query(user_db_id, since)).scalar_one()
+
+def recent_languages_query(limit: int):
+    return select(User.telegram_id, User.language).order_by(User.id.desc()).limit(limit)
+
+def warm_language_cache(db) -> int:
+    """Precarga en una consulta el idioma de los usuarios más recientes"""
+    rows = db.execute(recent_languages_query(language_cache.max_entries)).all()
+    # Los más antiguos primero: los recientes quedan al final de la LRU
+    language_cache.set_many(
+        (telegram_id, normalize_language(language) or DEFAULT_LANGUAGE)
+        for telegram_id, language in reversed(rows)
+    )
+    return len(rows)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import func, select, union
+from telegram.ext import CallbackContext
+from database import get_read_session, User, WaterLog, PlanDownload, Payment
+from models import DEFAULT_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# Los contadores "de hoy" usan el día local de la zona por defecto del bot
+STATS_TZ = ZoneInfo(DEFAULT_TIMEZONE)
+
+def _today() -> date:
+    return datetime.now(STATS_TZ).date()
+
+def _day_start_utc(day: date) -> datetime:
+    """Inicio del día local en UTC sin zona (como se guardan los timestamps, ver models.utcnow)"""
+    local_start = datetime.combine(day, datetime.min.time(), tzinfo=STATS_TZ)
+    return local_start.astimezone(timezone.utc).replace(tzinfo=None)
+
+class AdminStats:
+    """Estadísticas de operación mantenidas incrementalmente en memoria.
+
+    Cada ruta de escritura suma su parte al confirmar; leerlas no consulta la
+    base de datos, así el tiempo de respuesta no depende del volumen de datos.
+    Una reconciliación periódica recalcula los valores reales (incluye las
+    escrituras de otras instancias) y conserva los incrementos ocurridos
+    mientras se ejecutaba.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = _today()
+        self.users_total = 0
+        self.premium_active = 0
+        self.downloads_by_plan = Counter()
+        self._reset_day()
+        self.reconciled_at = None
+        self._delta = None  # Incrementos durante una reconciliación en curso
+
+    def _reset_day(self):
+        self.downloads_today = 0
+        self.water_ml_today = 0.0
+        self.water_logs_today = 0
+        self.payments_today = 0
+        self.revenue_today = 0.0
+        self.active_today = set()
+
+    def _roll_day(self):
+        today = _today()
+        if today != self._day:
+            self._day = today
+            self._reset_day()
+
+    def _apply(self, target, **changes):
+        for name, value in changes.items():
+            if name == 'downloads_by_plan':
+                target[name].update(value)
+            elif name == 'active_today':
+                target[name].add(value)
+            else:
+                target[name] = target.get(name, 0) + value
+
+    def _record(self, **changes):
+        with self._lock:
+            self._roll_day()
+            current = self.__dict__
+            self._apply(current, **changes)
+            if self._delta is not None:
+                self._apply(self._delta, **changes)
+
+    # Rutas de escritura
+    def record_registration(self):
+        self._record(users_total=1)
+
+    def record_download(self, telegram_id: int, plan_type: str):
+        self._record(downloads_today=1, downloads_by_plan={plan_type: 1}, active_today=telegram_id)
+
+    def record_water(self, telegram_id: int, amount: float):
+        self._record(water_ml_today=amount, water_logs_today=1, active_today=telegram_id)
+
+    def record_payment(self, telegram_id: int, amount: float, activated: bool):
+        self._record(payments_today=1, revenue_today=amount, premium_active=1 if activated else 0,
+                     active_today=telegram_id)
+
+    def record_premium_expired(self, count: int):
+        self._record(premium_active=-count)
+
+    def _query(self, day: date) -> dict:
+        """Valores exactos desde la base de datos (réplica si está configurada)"""
+        since = _day_start_utc(day)
+        db = get_read_session()
+        try:
+            users_total = db.execute(select(func.count(User.id))).scalar_one()
+            # La marca is_premium es lo que mantienen los pagos y el barrido de expiraciones
+            premium_active = db.execute(
+                select(func.count(User.id)).where(User.is_premium.is_(True))
+            ).scalar_one()
+            downloads_by_plan = Counter(dict(db.execute(
+                select(PlanDownload.plan_type, func.count(PlanDownload.id)).group_by(PlanDownload.plan_type)
+            ).all()))
+            downloads_today = db.execute(
+                select(func.count(PlanDownload.id)).where(PlanDownload.downloaded_at >= since)
+            ).scalar_one()
+            water_logs_today, water_ml_today = db.execute(
+                select(func.count(WaterLog.id), func.coalesce(func.sum(WaterLog.amount), 0)).where(
+                    WaterLog.timestamp >= since, WaterLog.is_daily_reset.isnot(True)
+                )
+            ).one()
+            payments_today, revenue_today = db.execute(
+                select(func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0)).where(
+                    Payment.created_at >= since, Payment.status == 'completed'
+                )
+            ).one()
+            active_ids = union(
+                select(WaterLog.user_id).where(WaterLog.timestamp >= since, WaterLog.is_daily_reset.isnot(True)),
+                select(PlanDownload.user_id).where(PlanDownload.downloaded_at >= since),
+                select(Payment.user_id).where(Payment.created_at >= since)
+            ).subquery()
+            active_today = set(db.execute(
+                select(User.telegram_id).where(User.id.in_(select(active_ids.c[0])))
+            ).scalars())
+        finally:
+            db.close()
+        return {
+            'users_total': users_total,
+            'premium_active': premium_active,
+            'downloads_by_plan': downloads_by_plan,
+            'downloads_today': downloads_today,
+            'water_logs_today': water_logs_today,
+            'water_ml_today': float(water_ml_today),
+            'payments_today': payments_today,
+            'revenue_today': float(revenue_today),
+            'active_today': active_today
+        }
+
+    def reconcile(self):
+        """Recalcula los contadores desde la base de datos (costoso: solo en segundo plano)"""
+        with self._lock:
+            self._roll_day()
+            day = self._day
+            self._delta = {'downloads_by_plan': Counter(), 'active_today': set()}
+        try:
+            values = self._query(day)
+        except Exception:
+            with self._lock:
+                self._delta = None
+            raise
+
+        with self._lock:
+            delta, self._delta = self._delta, None
+            if self._day != day:
+                return  # Cambió el día durante la consulta; se reconcilia en la próxima
+            for name, value in values.items():
+                setattr(self, name, value)
+            self._apply(self.__dict__, **{
+                name: value for name, value in delta.items()
+                if name not in ('downloads_by_plan', 'active_today')
+            })
+            self.downloads_by_plan.update(delta['downloads_by_plan'])
+            self.active_today |= delta['active_today']
+            self.reconciled_at = datetime.utcnow()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._roll_day()
+            return {
+                'day': self._day.isoformat(),
+                'users_total': self.users_total,
+                'active_today': len(self.active_today),
+                'premium_active': self.premium_active,
+                'downloads_today': self.downloads_today,
+                'downloads_by_plan': dict(self.downloads_by_plan),
+                'water_ml_today': round(self.water_ml_today, 1),
+                'water_logs_today': self.water_logs_today,
+                'payments_today': self.payments_today,
+                'revenue_today': round(self.revenue_today, 2),
+                'reconciled_at': self.reconciled_at.isoformat() if self.reconciled_at else None
+            }
+
+admin_stats = AdminStats()
+
+async def reconcile_admin_stats(context: CallbackContext):
+    """Job periódico: corrige la deriva de los contadores contra la base de datos"""
+    try:
+        # Las consultas de agregación no deben bloquear el loop del bot
+        await asyncio.to_thread(admin_stats.reconcile)
+    except Exception as e:
+        logger.error(f"Error reconciliando estadísticas: {e}")
@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+# Los módulos leen DATABASE_URL al importarse: se fija antes de cualquier import
+_tmp_dir = tempfile.mkdtemp(prefix='nutrition_bot_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+os.environ.setdefault('DATABASE_REPLICA_URLS', '')
+
+import pytest
+from sqlalchemy import delete
+
+import migrations
+from database import SessionFactory, engine
+from models import Base
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    migrations.upgrade()
+    yield
+    engine.dispose()
+
+@pytest.fixture
+def db():
+    """Sesión propia sobre una base vacía"""
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(delete(table))
+    session = SessionFactory()
+    try:
+        yield session
+    finally:
+        session.close()
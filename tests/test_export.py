@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import export_data
+from models import User
+
+def insert_users(db, count):
+    db.add_all([User(telegram_id=1000 + i, first_name=f'u{i}') for i in range(count)])
+    db.commit()
+
+def exported_ids(out_dir):
+    with gzip.open(os.path.join(out_dir, 'users.jsonl.gz'), 'rt', encoding='utf-8') as f:
+        return [json.loads(line)['telegram_id'] for line in f]
+
+def interrupt_after_first_chunk(monkeypatch):
+    """Bloques de 2 filas; la exportación falla al pedir el segundo"""
+    real_stream_rows = export_data.stream_rows
+
+    def failing_stream_rows(query):
+        for index, rows in enumerate(real_stream_rows(query, chunk_rows=2)):
+            if index == 1:
+                raise ConnectionError('conexión perdida')
+            yield rows
+
+    monkeypatch.setattr(export_data, 'stream_rows', failing_stream_rows)
+
+def test_resume_after_interrupted_chunk(db, tmp_path, monkeypatch):
+    insert_users(db, 5)
+    out_dir = str(tmp_path)
+    interrupt_after_first_chunk(monkeypatch)
+    with pytest.raises(ConnectionError):
+        export_data.main(['--out', out_dir, '--tables', 'users'])
+
+    # Un bloque a medio escribir tras el punto de control se descarta al reanudar
+    with open(os.path.join(out_dir, 'users.jsonl.gz'), 'ab') as f:
+        f.write(b'\x1f\x8b basura')
+
+    monkeypatch.undo()
+    assert export_data.main(['--out', out_dir, '--tables', 'users', '--resume']) == 0
+    assert exported_ids(out_dir) == [1000 + i for i in range(5)]
+
+def test_resume_without_output_file_starts_over(db, tmp_path, monkeypatch):
+    insert_users(db, 5)
+    out_dir = str(tmp_path)
+    interrupt_after_first_chunk(monkeypatch)
+    with pytest.raises(ConnectionError):
+        export_data.main(['--out', out_dir, '--tables', 'users'])
+    os.remove(os.path.join(out_dir, 'users.jsonl.gz'))
+
+    monkeypatch.undo()
+    assert export_data.main(['--out', out_dir, '--tables', 'users', '--resume']) == 0
+    assert exported_ids(out_dir) == [1000 + i for i in range(5)]
+
+def test_resume_refuses_other_filters(db, tmp_path, monkeypatch):
+    insert_users(db, 3)
+    out_dir = str(tmp_path)
+    interrupt_after_first_chunk(monkeypatch)
+    with pytest.raises(ConnectionError):
+        export_data.main(['--out', out_dir, '--tables', 'users'])
+
+    monkeypatch.undo()
+    with pytest.raises(SystemExit):
+        export_data.main(['--out', out_dir, '--tables', 'users', '--resume', '--format', 'csv'])
+    assert not os.path.exists(os.path.join(out_dir, 'users.csv.gz'))
@@ -0,0 +1,17 @@
+import pytest
+
+from i18n import CatalogError, compile_catalogs
+
+BASE = {'plans.done': ['¡Listo, {name}!', '¡Perfecto, {name}!']}
+
+def test_variants_may_use_part_of_the_fields():
+    sources = {'es': BASE, 'en': {'plans.done': ['Done, {name}!', 'Perfect!']}}
+    assert compile_catalogs(sources, 'es')['en'] == sources['en']
+
+@pytest.mark.parametrize('variants', [
+    ['Done!', 'Perfect!'],                 # falta {name}
+    ['Done, {name}!', 'Perfect, {user}!']  # campo desconocido
+])
+def test_variants_must_use_the_default_fields(variants):
+    with pytest.raises(CatalogError):
+        compile_catalogs({'es': BASE, 'en': {'plans.done': variants}}, 'es')
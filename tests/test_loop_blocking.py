@@ -0,0 +1,71 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import water_reminders
+from loop_watchdog import detect_blocking
+from models import User
+
+class FakeQuery:
+    """CallbackQuery mínima: registra las ediciones en lugar de llamar a Telegram"""
+
+    def __init__(self, telegram_id: int, data: str):
+        self.from_user = SimpleNamespace(id=telegram_id, language_code='es')
+        self.data = data
+        self.message = None
+        self.edits = []
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None, parse_mode=None):
+        self.edits.append(text)
+
+def tap(telegram_id: int, amount: int):
+    query = FakeQuery(telegram_id, f'water_amount_{amount}')
+    update = SimpleNamespace(callback_query=query, effective_user=query.from_user)
+    return query, update, SimpleNamespace(job_queue=None)
+
+def add_user(db, telegram_id):
+    db.add(User(telegram_id=telegram_id, current_water=0, water_goal=2000))
+    db.commit()
+
+def test_handle_water_amount_does_not_block_the_loop(db):
+    add_user(db, 501)
+    query, update, context = tap(501, 250)
+
+    async def run():
+        async with detect_blocking(threshold=0.05) as watchdog:
+            started = time.monotonic()
+            await water_reminders.handle_water_amount(update, context)
+            elapsed = time.monotonic() - started
+        watchdog.assert_no_blocking()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    # La primera pulsación se aplica sin esperar la ventana de agrupación
+    assert elapsed < water_reminders.water_taps.window
+    assert db.query(User.current_water).filter_by(telegram_id=501).scalar() == 250
+    assert query.edits
+
+def test_detect_blocking_reports_sync_call_in_handler(db, monkeypatch):
+    add_user(db, 502)
+    roll_over = water_reminders.roll_over_water_day
+
+    def slow_roll_over(*args, **kwargs):
+        time.sleep(0.2)  # Llamada síncrona lenta dentro del handler
+        return roll_over(*args, **kwargs)
+
+    monkeypatch.setattr(water_reminders, 'roll_over_water_day', slow_roll_over)
+    _, update, context = tap(502, 250)
+
+    async def run():
+        async with detect_blocking(threshold=0.05) as watchdog:
+            await water_reminders.handle_water_amount(update, context)
+        return watchdog
+
+    watchdog = asyncio.run(run())
+    with pytest.raises(AssertionError, match='handle_water_amount'):
+        watchdog.assert_no_blocking()
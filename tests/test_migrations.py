@@ -0,0 +1,27 @@
+from sqlalchemy import text
+
+import migrations
+from database import engine
+from repository import hot_queries
+
+def test_no_pending_migrations_after_upgrade():
+    assert migrations.pending_migrations() == []
+
+def test_hot_queries_use_indexes():
+    with engine.connect() as conn:
+        for name, query in hot_queries().items():
+            plan = migrations.explain(conn, query)
+            assert not migrations.is_full_scan('sqlite', plan), f"{name}: {plan}"
+
+def test_check_detects_missing_index():
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_plan_downloads_user_downloaded'))
+    # sqlite3 guarda las sentencias preparadas por conexión, con el plan anterior
+    engine.dispose()
+    try:
+        assert migrations.check() == 1
+    finally:
+        with engine.begin() as conn:
+            migrations._create_index(conn, 'ix_plan_downloads_user_downloaded', 'plan_downloads',
+                                     ('user_id', 'downloaded_at'))
+    assert migrations.check() == 0
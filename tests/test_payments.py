@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import premium
+from config import Config
+from models import Payment, PaymentEvent, User
+from premium import PaymentInbox, fulfill_payments, parse_payment_event
+
+SECRET = 'whsec_test'
+
+def checkout_event(transaction_id, user_id, amount_total=999):
+    return {
+        'id': f'evt_{transaction_id}',
+        'type': 'checkout.session.completed',
+        'data': {'object': {
+            'id': transaction_id,
+            'payment_status': 'paid',
+            'amount_total': amount_total,
+            'currency': 'usd',
+            'metadata': {'user_id': user_id}
+        }}
+    }
+
+def sign(payload: bytes, secret: str = SECRET) -> str:
+    timestamp = int(time.time())
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def payment(transaction_id, telegram_id):
+    return {'transaction_id': transaction_id, 'telegram_id': telegram_id, 'amount': 9.99}
+
+@pytest.fixture
+def webhook_secret(monkeypatch):
+    monkeypatch.setattr(Config, 'STRIPE_WEBHOOK_SECRET', SECRET)
+
+def test_parse_ignores_non_numeric_user_id():
+    assert parse_payment_event(checkout_event('cs_1', 'abc')) is None
+    assert parse_payment_event(checkout_event('cs_1', '42'))['telegram_id'] == 42
+
+def test_duplicate_transaction_is_applied_once(db):
+    db.add(User(telegram_id=10))
+    db.commit()
+
+    assert len(fulfill_payments([payment('cs_dup', 10), payment('cs_dup', 10)])) == 1
+    assert fulfill_payments([payment('cs_dup', 10)]) == []
+
+    db.expire_all()
+    user = db.query(User).filter_by(telegram_id=10).one()
+    assert db.query(Payment).filter_by(transaction_id='cs_dup').count() == 1
+    assert user.is_premium
+    assert (user.premium_expiry - user.registered_at).days <= premium.PREMIUM_DAYS
+
+def test_unknown_user_is_recorded_as_orphaned(db):
+    assert fulfill_payments([payment('cs_orphan', 777)]) == []
+    orphan = db.query(Payment).filter_by(transaction_id='cs_orphan').one()
+    assert (orphan.user_id, orphan.telegram_id, orphan.status) == (None, 777, 'orphaned')
+
+def test_batch_is_fulfilled_in_one_transaction(db, monkeypatch):
+    db.add_all([User(telegram_id=11), User(telegram_id=12)])
+    db.commit()
+    inbox = PaymentInbox()
+    assert inbox.store(checkout_event('cs_a', '11'))
+    assert inbox.store(checkout_event('cs_b', '12'))
+
+    # Si el commit falla no se aplica ningún pago del lote y siguen pendientes
+    session = premium.get_db_session()  # Sesión del hilo que usará fulfill_payments
+
+    def fail():
+        raise OperationalError('COMMIT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(session, 'commit', fail, raising=False)
+    assert inbox.process_pending() is None
+    db.expire_all()
+    assert db.query(User).filter(User.is_premium.is_(True)).count() == 0
+    assert {e.status for e in db.query(PaymentEvent)} == {'pending'}
+
+    monkeypatch.undo()
+    assert inbox.process_pending() == 2
+    db.expire_all()
+    assert db.query(User).filter(User.is_premium.is_(True)).count() == 2
+    assert {e.status for e in db.query(PaymentEvent)} == {'done'}
+
+def test_webhook_stores_each_event_once(db, webhook_secret):
+    inbox = PaymentInbox()
+    payload = json.dumps(checkout_event('cs_webhook', '13')).encode()
+    assert inbox.receive(payload, sign(payload)) == ('ok', 200)
+    assert inbox.receive(payload, sign(payload)) == ('ok', 200)
+    assert db.query(PaymentEvent).filter_by(transaction_id='cs_webhook').count() == 1
+
+def test_webhook_rejects_bad_signature(db, webhook_secret):
+    inbox = PaymentInbox()
+    payload = json.dumps(checkout_event('cs_forged', '13')).encode()
+    assert inbox.receive(payload, sign(payload, secret='whsec_other')) == ('Invalid signature', 400)
+    assert inbox.receive(payload, '') == ('Invalid signature', 400)
+    assert db.query(PaymentEvent).count() == 0
+
+def test_webhook_acks_invalid_user_id(db, webhook_secret):
+    # Un user_id no numérico se confirma sin guardar: Stripe no lo reintenta
+    inbox = PaymentInbox()
+    payload = json.dumps(checkout_event('cs_bad_user', 'abc')).encode()
+    assert inbox.receive(payload, sign(payload)) == ('ok', 200)
+    assert db.query(PaymentEvent).count() == 0
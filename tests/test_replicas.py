@@ -0,0 +1,83 @@
+import os
+
+import pytest
+from sqlalchemy import select
+
+import database
+from database import ReadSessionFactory, ReplicaRouter, SessionFactory, build_engine, user_scope
+from models import Base, User
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    """Segunda base SQLite que hace de réplica, con un usuario que la primaria no tiene"""
+    replica_engine = build_engine(f"sqlite:///{os.path.join(tmp_path, 'replica.db')}")
+    Base.metadata.create_all(replica_engine)
+    with replica_engine.begin() as conn:
+        conn.execute(User.__table__.insert().values(telegram_id=999, first_name='réplica'))
+
+    router = ReplicaRouter([replica_engine], max_lag=5, check_interval=60)
+    monkeypatch.setattr(database, 'replica_router', router)
+    yield router
+    replica_engine.dispose()
+
+def names(session):
+    return set(session.execute(select(User.first_name)).scalars())
+
+def test_read_session_uses_replica(db, replica):
+    db.add(User(telegram_id=1, first_name='primaria'))
+    db.commit()
+
+    read_db = ReadSessionFactory()
+    try:
+        assert names(read_db) == {'réplica'}
+    finally:
+        read_db.close()
+    assert replica.reads == [1]
+
+def test_write_session_and_use_primary_stay_on_primary(db, replica):
+    db.add(User(telegram_id=1, first_name='primaria'))
+    db.commit()
+    assert names(db) == {'primaria'}
+
+    read_db = ReadSessionFactory()
+    try:
+        query = select(User.first_name).execution_options(use_primary=True)
+        assert set(read_db.execute(query).scalars()) == {'primaria'}
+    finally:
+        read_db.close()
+    assert replica.reads == [0]
+
+def test_user_reads_own_writes_from_primary(db, replica):
+    with user_scope(4242):
+        write_db = SessionFactory()
+        try:
+            write_db.add(User(telegram_id=4242, first_name='primaria'))
+            write_db.commit()
+        finally:
+            write_db.close()
+
+        read_db = ReadSessionFactory()
+        try:
+            assert names(read_db) == {'primaria'}
+        finally:
+            read_db.close()
+    assert replica.snapshot()['primary_reads'] == 1
+
+    # Otro usuario sin escrituras recientes sigue leyendo de la réplica
+    with user_scope(4343):
+        read_db = ReadSessionFactory()
+        try:
+            assert names(read_db) == {'réplica'}
+        finally:
+            read_db.close()
+
+def test_unhealthy_replica_falls_back_to_primary(db, replica):
+    db.add(User(telegram_id=1, first_name='primaria'))
+    db.commit()
+    replica.healthy[0] = False
+
+    read_db = ReadSessionFactory()
+    try:
+        assert names(read_db) == {'primaria'}
+    finally:
+        read_db.close()
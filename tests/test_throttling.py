@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import throttling
+from throttling import TapCoalescer, UserRateLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj manual para throttling.time.monotonic"""
+    now = [1000.0]
+    monkeypatch.setattr(throttling.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_rate_limiter_burst_then_refill(clock):
+    limiter = UserRateLimiter(rate=2, burst=3)
+    assert [limiter.allow(1) for _ in range(4)] == [True, True, True, False]
+    # Otro usuario tiene su propio bucket
+    assert limiter.allow(2)
+
+    clock[0] += 0.5  # 0.5 s a 2 fichas/s: una ficha
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
+
+    # Tras mucho tiempo el bucket no supera la ráfaga
+    clock[0] += 60
+    assert [limiter.allow(1) for _ in range(4)] == [True, True, True, False]
+    assert limiter.counters == {'allowed': 8, 'limited': 3, 'warned': 0}
+
+def test_rate_limiter_warns_once_per_interval(clock):
+    limiter = UserRateLimiter(rate=1, burst=1, warn_interval=10)
+    limiter.allow(1)
+    assert not limiter.allow(1)
+    assert limiter.should_warn(1)
+    assert not limiter.should_warn(1)
+    clock[0] += 10
+    assert limiter.should_warn(1)
+
+def test_lone_tap_is_applied_at_once():
+    async def main():
+        coalescer = TapCoalescer(window=0.05)
+        return await coalescer.collect('user', 250)
+    assert asyncio.run(main()) == [250]
+
+def test_burst_is_merged_into_one_flush():
+    async def main():
+        coalescer = TapCoalescer(window=0.05)
+        first = await coalescer.collect('user', 1)
+        rest = await asyncio.gather(*(coalescer.collect('user', v) for v in (2, 3, 4)))
+        other = await coalescer.collect('other', 9)
+        return first, rest, other, coalescer.counters
+    first, rest, other, counters = asyncio.run(main())
+    assert first == [1]
+    assert rest == [[2, 3, 4], None, None]
+    assert other == [9]
+    assert counters == {'taps': 5, 'flushes': 3, 'coalesced': 2}
@@ -0,0 +1,107 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from upload_plans import CategoryUploader, file_sha256
+
+FOLDER = 'Mantenimiento'
+
+class StubBot:
+    """Bot mínimo: devuelve un file_id por archivo y falla los intentos indicados"""
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})  # nombre -> intentos que fallan
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_document(self, chat_id, document, filename, **kwargs):
+        self.calls.append(filename)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.failures.get(filename, 0) > 0:
+                self.failures[filename] -= 1
+                raise ConnectionError('timeout')
+            return SimpleNamespace(document=SimpleNamespace(file_id=f'id_{filename}'))
+        finally:
+            self.in_flight -= 1
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, 'sleep', lambda delay: real_sleep(0))
+
+@pytest.fixture
+def dirs(tmp_path):
+    source_dir = tmp_path / 'planes' / FOLDER
+    source_dir.mkdir(parents=True)
+    ids_dir = tmp_path / 'ids'
+    ids_dir.mkdir()
+    return source_dir, ids_dir
+
+def write_pdfs(source_dir, contents):
+    for name, content in contents.items():
+        (source_dir / name).write_bytes(content)
+
+def run(bot, source_dir, ids_dir, concurrency=2, **kwargs):
+    async def main():
+        uploader = CategoryUploader(bot, 1, FOLDER, source_dir, ids_dir,
+                                    asyncio.Semaphore(concurrency), **kwargs)
+        await uploader.run()
+        return uploader
+    return asyncio.run(main())
+
+def read_json(path):
+    return json.loads(path.read_text(encoding='utf-8'))
+
+def test_concurrent_upload_with_retry(dirs):
+    source_dir, ids_dir = dirs
+    write_pdfs(source_dir, {'a.pdf': b'A', 'b.pdf': b'B', 'c.pdf': b'C', 'd.pdf': b'D', 'copia.pdf': b'A'})
+    bot = StubBot(failures={'b.pdf': 1})
+
+    uploader = run(bot, source_dir, ids_dir)
+
+    assert (uploader.uploaded, uploader.failed) == (4, 0)
+    assert bot.max_in_flight == 2
+    assert sorted(bot.calls) == ['a.pdf', 'b.pdf', 'b.pdf', 'c.pdf', 'd.pdf']
+    # El duplicado reutiliza el file_id sin subirse
+    assert read_json(ids_dir / f'{FOLDER}.txt') == {
+        'a.pdf': 'id_a.pdf', 'b.pdf': 'id_b.pdf', 'c.pdf': 'id_c.pdf',
+        'copia.pdf': 'id_a.pdf', 'd.pdf': 'id_d.pdf'
+    }
+    manifest = read_json(ids_dir / f'{FOLDER}.manifest.json')
+    assert manifest['b.pdf'] == {'sha256': file_sha256(source_dir / 'b.pdf'), 'file_id': 'id_b.pdf'}
+
+def test_failed_upload_is_left_out_and_retried_next_run(dirs):
+    source_dir, ids_dir = dirs
+    write_pdfs(source_dir, {'a.pdf': b'A', 'b.pdf': b'B'})
+
+    uploader = run(StubBot(failures={'b.pdf': 3}), source_dir, ids_dir)
+    assert (uploader.uploaded, uploader.failed) == (1, 1)
+    assert read_json(ids_dir / f'{FOLDER}.txt') == {'a.pdf': 'id_a.pdf'}
+
+    # Reanudación: solo se sube lo que faltaba
+    bot = StubBot()
+    uploader = run(bot, source_dir, ids_dir)
+    assert bot.calls == ['b.pdf']
+    assert (uploader.uploaded, uploader.skipped) == (1, 1)
+    assert read_json(ids_dir / f'{FOLDER}.txt') == {'a.pdf': 'id_a.pdf', 'b.pdf': 'id_b.pdf'}
+
+def test_existing_order_is_kept_and_pruned_files_become_tombstones(dirs):
+    source_dir, ids_dir = dirs
+    (ids_dir / f'{FOLDER}.txt').write_text(
+        json.dumps({'viejo.pdf': 'id_viejo', 'b.pdf': 'id_b_manual'}), encoding='utf-8'
+    )
+    write_pdfs(source_dir, {'a.pdf': b'A', 'b.pdf': b'B'})
+
+    bot = StubBot()
+    run(bot, source_dir, ids_dir, prune=True)
+
+    # b.pdf ya estaba publicado a mano: no se vuelve a subir
+    assert bot.calls == ['a.pdf']
+    ids = read_json(ids_dir / f'{FOLDER}.txt')
+    assert list(ids.items()) == [('viejo.pdf', None), ('b.pdf', 'id_b_manual'), ('a.pdf', 'id_a.pdf')]
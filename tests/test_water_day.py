@@ -0,0 +1,55 @@
+from datetime import date, datetime, timezone
+
+from database import roll_over_water_day
+from models import User, UserSettings, WaterLog
+
+def add_user(db, telegram_id, tz, current_water=750, water_date=None):
+    user = User(telegram_id=telegram_id, current_water=current_water, water_date=water_date)
+    db.add(user)
+    db.flush()
+    db.add(UserSettings(user_id=user.id, timezone=tz))
+    db.commit()
+    return user
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_no_reset_before_local_midnight(db):
+    # 04:59 UTC son las 23:59 del 9 de marzo en Bogotá (UTC-5)
+    add_user(db, 1, 'America/Bogota', water_date=date(2026, 3, 9))
+    assert roll_over_water_day(db, 1, utc(2026, 3, 10, 4, 59)) is False
+    assert db.query(User.current_water).filter_by(telegram_id=1).scalar() == 750
+
+def test_reset_after_local_midnight_logs_naive_utc(db):
+    user = add_user(db, 1, 'America/Bogota', water_date=date(2026, 3, 9))
+    assert roll_over_water_day(db, 1, utc(2026, 3, 10, 5, 1)) is True
+
+    db.expire_all()
+    user = db.get(User, user.id)
+    assert user.current_water == 0
+    assert user.water_date == date(2026, 3, 10)
+    log = db.query(WaterLog).filter_by(user_id=user.id, is_daily_reset=True).one()
+    assert log.amount == 750
+    assert log.timestamp == datetime(2026, 3, 10, 5, 1)
+
+def test_same_instant_depends_on_user_timezone(db):
+    # 15:30 UTC: ya es el 2 de enero en Tokio, todavía el 1 en Bogotá
+    add_user(db, 1, 'Asia/Tokyo', water_date=date(2026, 1, 1))
+    add_user(db, 2, 'America/Bogota', water_date=date(2026, 1, 1))
+    now = utc(2026, 1, 1, 15, 30)
+    assert roll_over_water_day(db, 1, now) is True
+    assert roll_over_water_day(db, 2, now) is False
+
+def test_reset_happens_once_per_day(db):
+    add_user(db, 1, 'America/Puerto_Rico', water_date=date(2026, 3, 9))
+    assert roll_over_water_day(db, 1, utc(2026, 3, 10, 4, 0)) is True
+    assert roll_over_water_day(db, 1, utc(2026, 3, 10, 12, 0)) is False
+    assert db.query(WaterLog).filter_by(is_daily_reset=True).count() == 1
+
+def test_legacy_user_day_comes_from_last_log_in_utc(db):
+    # Sin water_date: el último registro (14:00 UTC) son las 23:00 en Tokio
+    user = add_user(db, 1, 'Asia/Tokyo')
+    db.add(WaterLog(user_id=user.id, amount=750, timestamp=datetime(2026, 1, 1, 14, 0)))
+    db.commit()
+    assert roll_over_water_day(db, 1, utc(2026, 1, 1, 14, 30)) is False
+    assert roll_over_water_day(db, 1, utc(2026, 1, 1, 15, 30)) is True
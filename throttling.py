@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, CallbackContext
+from config import Config
+from i18n import user_language, t
+
+logger = logging.getLogger(__name__)
+
+class UserRateLimiter:
+    """Token bucket por usuario: ``rate`` fichas por segundo con ráfagas de hasta ``burst``.
+
+    Los buckets viven en un OrderedDict acotado a ``max_users`` (se descartan
+    los menos recientes; un bucket descartado vuelve lleno, que es su estado
+    tras un rato de inactividad).
+    """
+
+    def __init__(self, rate: float, burst: float, max_users: int = 50000, warn_interval: float = 10):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.warn_interval = warn_interval
+        self._buckets = OrderedDict()  # user_id -> [fichas, última recarga, último aviso]
+        self._lock = threading.Lock()
+        self.counters = {'allowed': 0, 'limited': 0, 'warned': 0}
+
+    @classmethod
+    def from_config(cls) -> 'UserRateLimiter':
+        return cls(
+            rate=Config.RATE_LIMIT_RATE,
+            burst=Config.RATE_LIMIT_BURST,
+            max_users=Config.RATE_LIMIT_MAX_USERS
+        )
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = [self.burst, now, 0.0]
+                self._buckets[user_id] = bucket
+                while len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.counters['allowed'] += 1
+                return True
+            self.counters['limited'] += 1
+            return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """Un aviso por intervalo: avisar en cada update limitado duplicaría el tráfico"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None or now - bucket[2] < self.warn_interval:
+                return False
+            bucket[2] = now
+            self.counters['warned'] += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tracked_users': len(self._buckets),
+                **self.counters
+            }
+
+class TapCoalescer:
+    """Agrupa pulsaciones repetidas de un mismo usuario dentro de una ventana corta.
+
+    Una pulsación sin ventana abierta se aplica al instante (recibe ``[valor]``)
+    y abre la ventana. La primera que llega con la ventana abierta espera a
+    que se cierre y recibe la lista de valores acumulados; las demás solo suman
+    su valor y reciben None. Así una pulsación aislada no espera nada y una
+    ráfaga produce como mucho una escritura y una edición por ventana.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._open_until = {}  # clave -> fin de la ventana abierta (time.monotonic)
+        self._pending = {}  # clave -> valores que esperan al cierre de la ventana
+        self.counters = {'taps': 0, 'flushes': 0, 'coalesced': 0}
+
+    def _open_window(self, key: Hashable):
+        until = self._open_until[key] = time.monotonic() + self.window
+        asyncio.get_running_loop().call_later(self.window, self._close_window, key, until)
+
+    def _close_window(self, key: Hashable, until: float):
+        if self._open_until.get(key) == until:
+            del self._open_until[key]
+
+    async def collect(self, key: Hashable, value) -> Optional[List]:
+        self.counters['taps'] += 1
+        values = self._pending.get(key)
+        if values is not None:
+            values.append(value)
+            self.counters['coalesced'] += 1
+            return None
+
+        until = self._open_until.get(key)
+        if until is None:
+            self._open_window(key)
+            self.counters['flushes'] += 1
+            return [value]
+
+        values = self._pending[key] = [value]
+        try:
+            await asyncio.sleep(max(0.0, until - time.monotonic()))
+        finally:
+            self._pending.pop(key, None)
+        # La escritura acumulada abre la siguiente ventana
+        self._open_window(key)
+        self.counters['flushes'] += 1
+        return values
+
+    def snapshot(self) -> dict:
+        return {'window_s': self.window, 'open_windows': len(self._open_until), **self.counters}
+
+rate_limiter = UserRateLimiter.from_config()
+water_taps = TapCoalescer(Config.WATER_TAP_WINDOW)
+
+async def enforce_rate_limit(update: Update, context: CallbackContext):
+    """Handler del grupo -1: descarta los updates de un usuario que supera su cuota"""
+    user = update.effective_user
+    if user is None or rate_limiter.allow(user.id):
+        return
+
+    if update.callback_query and rate_limiter.should_warn(user.id):
+        try:
+            await update.callback_query.answer(t('throttle.slow_down', user_language(user)))
+        except Exception as e:
+            logger.debug(f"No se pudo avisar del límite a {user.id}: {e}")
+    raise ApplicationHandlerStop
+
+def throttling_snapshot() -> dict:
+    return {'rate_limit': rate_limiter.snapshot(), 'water_taps': water_taps.snapshot()}
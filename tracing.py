@@ -0,0 +1,251 @@
+"""Trazas por update en formato Zipkin v2 (JSON).
+
+Cada update recibido en el webhook abre una traza con spans para la espera
+hasta el loop del bot (``queue_wait``), la ejecución del handler, cada
+sentencia SQL y cada llamada a la Bot API. Las trazas se exportan desde un
+hilo propio a un archivo JSON Lines (una lista de spans por línea) o a un
+colector compatible con Zipkin (``POST /api/v2/spans``), nunca desde el loop.
+
+Muestreo:
+  - TRACE_SAMPLE_RATE: fracción de updates que se exportan (0 desactiva).
+  - TRACE_SLOW_MS: si es > 0 se registran todos los updates y se exportan
+    además los que superen ese tiempo total (colas lentas de latencia).
+Sin ninguna de las dos, las funciones de este módulo no hacen nada.
+"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import requests
+from sqlalchemy import event
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'nutrition_bot'
+
+# Longitud máxima del SQL guardado en un span
+MAX_STATEMENT_LENGTH = 300
+
+_current_span = contextvars.ContextVar('trace_current_span', default=None)
+
+def _now_us() -> int:
+    return int(time.time() * 1_000_000)
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'timestamp', 'duration', 'tags', '_started')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str] = None, kind: Optional[str] = None,
+                 tags: Optional[Dict] = None, timestamp: Optional[int] = None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.timestamp = timestamp if timestamp is not None else _now_us()
+        self.duration = None
+        self.tags = {key: str(value) for key, value in (tags or {}).items()}
+        self._started = time.perf_counter()
+
+    def tag(self, key: str, value):
+        self.tags[key] = str(value)
+
+    def elapsed_us(self) -> int:
+        return int((time.perf_counter() - self._started) * 1_000_000)
+
+    def finish(self, duration_us: Optional[int] = None):
+        if self.duration is not None:
+            return
+        if duration_us is None:
+            duration_us = self.elapsed_us()
+        self.duration = max(duration_us, 1)
+        self.trace.spans.append(self)
+
+    def child(self, name: str, kind: Optional[str] = None, **tags) -> 'Span':
+        return Span(self.trace, name, parent_id=self.span_id, kind=kind, tags=tags)
+
+    def to_zipkin(self) -> dict:
+        span = {
+            'traceId': self.trace.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'localEndpoint': {'serviceName': SERVICE_NAME}
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        if self.tags:
+            span['tags'] = self.tags
+        return span
+
+class Trace:
+    """Spans terminados de un update; el span raíz abarca desde la recepción hasta el final"""
+
+    def __init__(self, name: str, sampled: bool, **tags):
+        self.trace_id = secrets.token_hex(16)
+        self.sampled = sampled
+        self.spans = []  # list.append es atómico: los spans pueden cerrarse desde varios hilos
+        self.root = Span(self, name, kind='SERVER', tags=tags)
+
+class TraceExporter:
+    """Exporta trazas desde un hilo propio; si la cola se llena, se descartan"""
+
+    def __init__(self, path: str, collector_url: str = '', maxsize: int = 1000, batch_size: int = 50):
+        self.path = path
+        self.collector_url = collector_url
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def submit(self, spans: List[dict]):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True, name='TraceExporterThread')
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _next_batch(self) -> List[List[dict]]:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                if self.collector_url:
+                    response = requests.post(
+                        self.collector_url,
+                        json=[span for trace in batch for span in trace],
+                        timeout=10
+                    )
+                    response.raise_for_status()
+                else:
+                    with open(self.path, 'a', encoding='utf-8') as trace_file:
+                        for trace in batch:
+                            trace_file.write(json.dumps(trace, separators=(',', ':')) + '\n')
+                self.exported += len(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Error exportando {len(batch)} trazas: {e}")
+
+class Tracer:
+    def __init__(self, sample_rate: float, slow_ms: float, exporter: TraceExporter):
+        self.sample_rate = sample_rate
+        self.slow_us = slow_ms * 1000
+        self.exporter = exporter
+
+    @classmethod
+    def from_config(cls) -> 'Tracer':
+        exporter = TraceExporter(
+            Config.TRACE_FILE,
+            collector_url=Config.TRACE_COLLECTOR_URL,
+            maxsize=Config.TRACE_QUEUE_SIZE
+        )
+        return cls(Config.TRACE_SAMPLE_RATE, Config.TRACE_SLOW_MS, exporter)
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_us > 0
+
+    def start_trace(self, name: str, **tags) -> Optional[Trace]:
+        """Abre una traza o devuelve None si este update no se registra"""
+        if not self.enabled:
+            return None
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_us <= 0:
+            return None
+        return Trace(name, sampled, **tags)
+
+    def finish_trace(self, trace: Optional[Trace]):
+        if trace is None:
+            return
+        trace.root.finish()
+        if trace.sampled or trace.root.duration >= self.slow_us > 0:
+            self.exporter.submit([span.to_zipkin() for span in trace.spans])
+
+    @contextmanager
+    def activate(self, span: Optional[Span]):
+        """Hace de ``span`` el padre de los spans creados en este contexto"""
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    @contextmanager
+    def span(self, name: str, kind: Optional[str] = None, **tags):
+        """Span hijo del actual; sin traza activa no hace nada y devuelve None"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = parent.child(name, kind=kind, **tags)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.tag('error', e.__class__.__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+
+    def snapshot(self) -> dict:
+        return {
+            'sample_rate': self.sample_rate,
+            'slow_ms': self.slow_us / 1000,
+            'exported': self.exporter.exported,
+            'dropped': self.exporter.dropped,
+            'errors': self.exporter.errors
+        }
+
+tracer = Tracer.from_config()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is not None:
+        context._trace_span = parent.child('sql', kind='CLIENT', **{
+            'db.system': conn.dialect.name,
+            'db.statement': statement[:MAX_STATEMENT_LENGTH]
+        })
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, '_trace_span', None)
+    if span is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.tag('db.rowcount', cursor.rowcount)
+        span.finish()
+
+def _handle_error(exception_context):
+    span = getattr(exception_context.execution_context, '_trace_span', None)
+    if span is not None:
+        span.tag('error', exception_context.original_exception.__class__.__name__)
+        span.finish()
+
+def instrument_engine(engine):
+    """Un span por sentencia SQL ejecutada dentro de una traza activa"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
@@ -0,0 +1,218 @@
+"""Sube en bloque los PDFs de planes y regenera el catálogo static/ids.
+
+Estructura esperada del directorio de origen (una carpeta por categoría de
+PLAN_FOLDERS):
+
+    planes/
+        Perdida_de_Peso/*.pdf
+        Aumento_Muscular/*.pdf
+        ...
+
+Uso:
+    python upload_plans.py --source planes --chat-id -1001234567890
+    python upload_plans.py --source planes --chat-id 1 --base-url http://localhost:8081/bot
+
+Cada archivo subido se anota en static/ids/<Carpeta>.manifest.json con su
+hash SHA-256, de modo que una ejecución interrumpida se reanuda sin volver a
+subir lo ya enviado y los archivos sin cambios nunca se suben dos veces.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from telegram import Bot
+from config import Config
+from plan_catalog import PLAN_FOLDERS, IDS_FOLDER, read_ids_file
+from logging_setup import configure_logging
+
+logger = logging.getLogger('upload_plans')
+
+def file_sha256(path: Path) -> str:
+    """Hash del contenido del archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def atomic_write_json(path: Path, data: dict):
+    """Escribe JSON en un temporal del mismo directorio y lo renombra (os.replace es atómico)"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # ASCII para que el lector (latin-1 / utf-8) obtenga siempre los mismos nombres
+            json.dump(data, f, indent=4, ensure_ascii=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def load_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    return read_ids_file(path)
+
+class CategoryUploader:
+    """Sincroniza la carpeta local de una categoría con su archivo de ids"""
+
+    def __init__(self, bot: Bot, chat_id: int, folder_name: str, source_dir: Path, ids_dir: Path,
+                 semaphore: asyncio.Semaphore, force: bool = False, prune: bool = False):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.folder_name = folder_name
+        self.source_dir = source_dir
+        self.ids_path = ids_dir / f"{folder_name}.txt"
+        self.manifest_path = ids_dir / f"{folder_name}.manifest.json"
+        self.semaphore = semaphore
+        self.force = force
+        self.prune = prune
+        self.uploaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self._lock = asyncio.Lock()
+
+    async def run(self):
+        ids_data = load_json(self.ids_path)
+        manifest = load_json(self.manifest_path)
+        files = sorted(self.source_dir.glob('*.pdf'))
+        hashes = {path: file_sha256(path) for path in files}
+
+        # Ids ya publicados sin hash (catálogo hecho a mano): se asumen vigentes
+        if not self.force:
+            for path in files:
+                if path.name in ids_data and path.name not in manifest:
+                    manifest[path.name] = {'sha256': hashes[path], 'file_id': ids_data[path.name]}
+
+        by_hash = {entry['sha256']: entry['file_id'] for entry in manifest.values()}
+        pending = {}  # sha256 -> primer archivo con ese contenido
+        duplicates = []
+        for path in files:
+            sha256 = hashes[path]
+            entry = manifest.get(path.name)
+            if entry and entry['sha256'] == sha256 and not self.force:
+                self.skipped += 1
+            elif sha256 in by_hash and not self.force:
+                # Mismo contenido con otro nombre: se reutiliza el file_id
+                manifest[path.name] = {'sha256': sha256, 'file_id': by_hash[sha256]}
+                self.skipped += 1
+            elif sha256 in pending:
+                duplicates.append(path)
+            else:
+                pending[sha256] = path
+
+        await asyncio.gather(*(self._upload(path, sha256, manifest) for sha256, path in pending.items()))
+
+        for path in duplicates:
+            uploaded = manifest.get(pending[hashes[path]].name)
+            if uploaded and uploaded['sha256'] == hashes[path]:
+                manifest[path.name] = dict(uploaded)
+                self.skipped += 1
+        atomic_write_json(self.manifest_path, manifest)
+
+        # Se conserva el orden existente (los índices del catálogo no cambian)
+        # y los archivos nuevos se añaden al final. Con --prune los eliminados
+        # quedan como lápida (null): los bitmaps de PlanRotation indexan por
+        # posición y quitar la entrada desplazaría a todos los planes siguientes.
+        local_names = {path.name for path in files}
+        new_ids = {}
+        for name, file_id in ids_data.items():
+            if self.prune and name not in local_names:
+                new_ids[name] = None
+                continue
+            new_ids[name] = manifest[name]['file_id'] if name in manifest else file_id
+        for path in files:
+            if path.name in manifest and path.name not in new_ids:
+                new_ids[path.name] = manifest[path.name]['file_id']
+
+        atomic_write_json(self.ids_path, new_ids)
+        logger.info(
+            f"{self.folder_name}: {self.uploaded} subidos, {self.skipped} sin cambios, "
+            f"{self.failed} fallidos, {sum(1 for v in new_ids.values() if v)} en catálogo"
+        )
+
+    async def _upload(self, path: Path, sha256: str, manifest: dict):
+        async with self.semaphore:
+            for attempt in range(3):
+                try:
+                    with open(path, 'rb') as f:
+                        message = await self.bot.send_document(
+                            chat_id=self.chat_id,
+                            document=f,
+                            filename=path.name,
+                            disable_notification=True,
+                            read_timeout=120,
+                            write_timeout=120
+                        )
+                    break
+                except Exception as e:
+                    logger.warning(f"Error subiendo {path.name} (intento {attempt + 1}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+            else:
+                self.failed += 1
+                return
+
+        async with self._lock:
+            manifest[path.name] = {'sha256': sha256, 'file_id': message.document.file_id}
+            # Punto de control: una ejecución interrumpida no vuelve a subir este archivo
+            atomic_write_json(self.manifest_path, manifest)
+        self.uploaded += 1
+        logger.info(f"Subido {self.folder_name}/{path.name}")
+
+async def upload_catalog(args) -> int:
+    folders = [PLAN_FOLDERS[args.category]] if args.category else list(PLAN_FOLDERS.values())
+    source = Path(args.source)
+    ids_dir = Path(args.ids_dir)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    bot_kwargs = {'token': args.token}
+    if args.base_url:
+        bot_kwargs['base_url'] = args.base_url
+        bot_kwargs['base_file_url'] = args.base_url.replace('/bot', '/file/bot')
+
+    started = time.monotonic()
+    failed = 0
+    async with Bot(**bot_kwargs) as bot:
+        for folder_name in folders:
+            source_dir = source / folder_name
+            if not source_dir.is_dir():
+                logger.warning(f"Carpeta no encontrada, se omite: {source_dir}")
+                continue
+            uploader = CategoryUploader(
+                bot, args.chat_id, folder_name, source_dir, ids_dir, semaphore,
+                force=args.force, prune=args.prune
+            )
+            await uploader.run()
+            failed += uploader.failed
+
+    logger.info(f"Catálogo actualizado en {time.monotonic() - started:.1f}s")
+    return 1 if failed else 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Sube PDFs de planes y regenera static/ids")
+    parser.add_argument('--source', required=True, help="Directorio con una carpeta por categoría")
+    parser.add_argument('--chat-id', type=int, required=True, help="Chat de almacenamiento donde se suben los PDFs")
+    parser.add_argument('--category', choices=sorted(PLAN_FOLDERS), help="Solo esta categoría")
+    parser.add_argument('--concurrency', type=int, default=4, help="Subidas simultáneas")
+    parser.add_argument('--ids-dir', default=IDS_FOLDER)
+    parser.add_argument('--token', default=Config.TELEGRAM_TOKEN)
+    parser.add_argument('--base-url', help="URL base de una Bot API local o de pruebas (ej: http://localhost:8081/bot)")
+    parser.add_argument('--force', action='store_true', help="Vuelve a subir aunque el contenido no haya cambiado")
+    parser.add_argument('--prune', action='store_true',
+                        help="Retira del catálogo los archivos que ya no existen (quedan como lápida)")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if not args.token:
+        parser.error("Falta TELEGRAM_TOKEN (variable de entorno o --token)")
+    return asyncio.run(upload_catalog(args))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,8 @@ from typing import Optional, Dict, Any
 from telegram import Update, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 from database import get_db_session, User
+from entitlements import is_premium
+from i18n import DEFAULT_LANGUAGE, language_cache, t
 import logging
 import pytz
 
@@ -64,17 +66,18 @@ def create_pagination_keyboard(
     current_page: int, 
     total_pages: int, 
     prefix: str,
-    additional_buttons: list = None
+    additional_buttons: list = None,
+    lang: str = DEFAULT_LANGUAGE
 ) -> InlineKeyboardMarkup:
     """Crea un teclado de paginación"""
     buttons = []
     
     # Botones de navegación
     if current_page > 1:
-        buttons.append(InlineKeyboardButton("⬅ Anterior", callback_data=f"{prefix}_{current_page-1}"))
+        buttons.append(InlineKeyboardButton(t('kb.previous', lang), callback_data=f"{prefix}_{current_page-1}"))
     
     if current_page < total_pages:
-        buttons.append(InlineKeyboardButton("Siguiente ➡", callback_data=f"{prefix}_{current_page+1}"))
+        buttons.append(InlineKeyboardButton(t('kb.next', lang), callback_data=f"{prefix}_{current_page+1}"))
     
     # Botones adicionales si se proporcionan
     if additional_buttons:
@@ -88,32 +91,20 @@ def error_handler(update: Update, context: CallbackContext):
     logger.error(f"Error durante la actualización {update}: {error}")
     
     if update.effective_message:
-        update.effective_message.reply_text(
-            "⚠️ Ocurrió un error inesperado. Por favor, inténtalo de nuevo más tarde."
-        )
+        lang = get_user_language(update.effective_user.id) if update.effective_user else DEFAULT_LANGUAGE
+        update.effective_message.reply_text(t('errors.generic', lang))
 
 def is_user_premium(user_id: int) -> bool:
     """Verifica si un usuario tiene suscripción premium activa"""
-    db = get_db_session()
     try:
-        user = db.query(User).filter_by(telegram_id=user_id).first()
-        if not user:
-            return False
-            
-        return user.is_premium and (
-            not user.premium_expiry or 
-            user.premium_expiry > datetime.utcnow()
-        )
+        return is_premium(user_id)
     except Exception as e:
         logger.error(f"Error al verificar premium: {e}")
         return False
-    finally:
-        db.close()
 
 def get_user_language(user_id: int, default: str = 'es') -> str:
-    """Obtiene el idioma preferido del usuario"""
-    user = get_user(user_id)
-    return user.language if user and user.language else default
+    """Obtiene el idioma preferido del usuario (desde la caché de i18n, sin consultar la base de datos)"""
+    return language_cache.get(user_id) or default
 
 def build_menu(buttons: list, n_cols: int = 2, header_buttons=None, footer_buttons=None) -> list:
     """Construye un menú de botones organizados en columnas"""
@@ -1,69 +1,85 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import CallbackContext
-from database import get_db_session, User, WaterLog, UserSettings
-from keyboards import water_amount_keyboard, water_progress_keyboard, water_reminder_keyboard, weight_input_keyboard
-from datetime import datetime, timedelta, time
-from typing import Optional
-from zoneinfo import ZoneInfo
+from database import get_db_session, get_read_session, roll_over_water_day, local_date, user_scope, User, WaterLog, UserSettings
+from keyboards import (
+    water_amount_keyboard, water_progress_keyboard, water_reminder_keyboard, weight_input_keyboard,
+    back_to_menu_keyboard, reminders_cancelled_keyboard
+)
+from models import DEFAULT_TIMEZONE, utcnow
+from datetime import datetime, timedelta, time, timezone
+from typing import Optional, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from sqlalchemy import or_, update
+from bot_api import traffic_class, BULK
+from conversation_state import conversation_states, AWAITING_WEIGHT
+from repository import HydrationState, get_hydration_state, is_registered
+from stats import admin_stats
+from throttling import water_taps
+from message_edits import edit_message
+from i18n import DEFAULT_LANGUAGE, language_cache, user_language, t
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Configuración de zona horaria (UTC-4)
-TZ = ZoneInfo("America/Puerto_Rico")  # Ejemplo de zona UTC-4 (también sirve America/Santiago en horario estándar)
+# Zona horaria por defecto (UTC-4) para usuarios sin configuración propia
+TZ = ZoneInfo(DEFAULT_TIMEZONE)
 
-def get_local_time():
-    """Obtiene la hora actual en UTC-4"""
-    return datetime.now(TZ)
+def get_timezone(tz_name: Optional[str]) -> ZoneInfo:
+    """Devuelve la zona horaria del usuario o la zona por defecto si no es válida"""
+    if not tz_name:
+        return TZ
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"Zona horaria inválida '{tz_name}', usando {DEFAULT_TIMEZONE}")
+        return TZ
+
+def get_local_time(tz: ZoneInfo = TZ):
+    """Obtiene la hora actual en la zona indicada (UTC-4 por defecto)"""
+    return datetime.now(tz)
 
+async def handle_set_timezone(update: Update, context: CallbackContext):
+    """Manejador del comando /zona_horaria <Zona IANA>"""
+    user_id = update.effective_user.id
+    lang = user_language(update.effective_user)
+    if not context.args:
+        await update.message.reply_text(t('timezone.prompt', lang))
+        return
+
+    tz_name = context.args[0].strip()
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        await update.message.reply_text(t('timezone.unknown', lang))
+        return
 
-async def reset_daily_water(context: CallbackContext):
-    """Reinicia el contador de agua para todos los usuarios a medianoche UTC-4"""
     db = get_db_session()
     try:
-        # Solo ejecutar si es medianoche en UTC-4
-        now = get_local_time()
-        if now.hour != 0 or now.minute > 5:  # Ventana de 5 minutos después de medianoche
-            return
-            
-        users = db.query(User).filter(User.water_goal.isnot(None)).all()
-        
-        if not users:
-            logger.info("No hay usuarios para reiniciar")
+        user = db.query(User).filter_by(telegram_id=user_id).first()
+        if not user:
+            await update.message.reply_text(t('register.required', lang))
             return
-            
-        for user in users:
-            try:
-                settings = db.query(UserSettings).filter_by(user_id=user.id).first()
-                if settings and not settings.water_reminders_enabled:
-                    continue
-                
-                log = WaterLog(
-                    user_id=user.id,
-                    amount=user.current_water,
-                    is_daily_reset=True,
-                    timestamp=datetime.utcnow()
-                )
-                db.add(log)
-                
-                user.current_water = 0
-                user.last_water_reminder = None
-                
-                if settings and settings.water_reminders_enabled:
-                    await restart_water_reminders(context, user.telegram_id)
-                    
-            except Exception as e:
-                logger.error(f"Error reiniciando usuario {user.telegram_id}: {e}")
-                continue
-                
+
+        settings = db.query(UserSettings).filter_by(user_id=user.id).first()
+        if not settings:
+            settings = UserSettings(user_id=user.id)
+            db.add(settings)
+        settings.timezone = tz_name
         db.commit()
-        logger.info(f"Reinicio diario completado para {len(users)} usuarios a las {now}")
-        
     except Exception as e:
-        logger.error(f"Error crítico en reset_daily_water: {e}")
+        logger.error(f"Error guardando zona horaria: {e}")
         db.rollback()
+        await update.message.reply_text(t('timezone.error', lang))
+        return
     finally:
         db.close()
+
+    await update.message.reply_text(t(
+        'timezone.updated', lang,
+        timezone=tz_name,
+        time=get_local_time(ZoneInfo(tz_name)).strftime('%H:%M')
+    ))
+    await restart_water_reminders(context, user_id)
         
 
 async def handle_register_weight(update: Update, context: CallbackContext):
@@ -71,12 +87,13 @@ async def handle_register_weight(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
-    context.user_data['awaiting_weight'] = True
-    await query.edit_message_text(
-        "⚖️ *Registro de Peso* ⚖️\n\n"
-        "Por favor ingresa tu peso actual en kilogramos (ejemplo: 68.5):\n\n"
-        "⚠️ Solo el número, sin unidades o texto adicional.",
-        reply_markup=weight_input_keyboard(),
+    # Estado persistente: sobrevive a reinicios y lo ve cualquier instancia
+    conversation_states.set(query.from_user.id, AWAITING_WEIGHT)
+    lang = user_language(query.from_user)
+    await edit_message(
+        query,
+        t('weight.prompt', lang),
+        reply_markup=weight_input_keyboard(lang),
         parse_mode='Markdown'
     )
 
@@ -87,13 +104,11 @@ async def check_user_registered(update: Update, context: CallbackContext) -> boo
     user = update.effective_user
     db = None
     try:
-        db = get_db_session()
-        user_record = db.query(User).filter_by(telegram_id=user.id).first()
-        
-        if not user_record:
+        db = get_read_session()
+        if not is_registered(db, user.id):
             logger.warning(f"Usuario no registrado intentando acceder: {user.id}")
             await update.callback_query.answer(
-                "⚠️ Debes registrarte primero con /start",
+                t('register.required', user_language(user)),
                 show_alert=True
             )
             return False
@@ -101,7 +116,7 @@ async def check_user_registered(update: Update, context: CallbackContext) -> boo
     except Exception as e:
         logger.error(f"Error verificando registro: {e}")
         await update.callback_query.answer(
-            "🔴 Error verificando tu registro. Intenta más tarde.",
+            t('register.check_error', user_language(user)),
             show_alert=True
         )
         return False
@@ -112,10 +127,11 @@ async def check_user_registered(update: Update, context: CallbackContext) -> boo
 
 async def handle_weight_input(update: Update, context: CallbackContext):
     """Maneja la entrada del peso del usuario con validación mejorada"""
-    if 'awaiting_weight' not in context.user_data:
+    user_id = update.message.from_user.id
+    if conversation_states.get_state(user_id) != AWAITING_WEIGHT:
         return  # No hacer nada si no estamos esperando un peso
     
-    user_id = update.message.from_user.id
+    lang = user_language(update.message.from_user)
     db = None
     try:
         weight_str = update.message.text.replace(',', '.').strip()
@@ -127,6 +143,7 @@ async def handle_weight_input(update: Update, context: CallbackContext):
             raise ValueError("Peso fuera de rango")
             
         db = get_db_session()
+        roll_over_water_day(db, user_id)
         user = db.query(User).filter_by(telegram_id=user_id).first()
         
         if user:
@@ -136,35 +153,108 @@ async def handle_weight_input(update: Update, context: CallbackContext):
             db.commit()
             
             # Limpiar estado
-            del context.user_data['awaiting_weight']
+            conversation_states.clear(user_id)
             
             await update.message.reply_text(
-                f"✅ Peso actualizado: {weight} kg\n"
-                f"💧 Nueva meta diaria: {user.water_goal:.0f} ml",
-                reply_markup=water_progress_keyboard()
+                t('weight.updated', lang, weight=weight, goal=user.water_goal),
+                reply_markup=water_progress_keyboard(lang)
             )
             
             await restart_water_reminders(context, user_id)
             
     except ValueError:
         await update.message.reply_text(
-            "⚠️ Formato inválido. Ingresa solo el número (ej: 68.5)",
-            reply_markup=weight_input_keyboard()
+            t('weight.invalid', lang),
+            reply_markup=weight_input_keyboard(lang)
         )
     except Exception as e:
         logger.error(f"Error registrando peso: {e}")
         await update.message.reply_text(
-            "🔴 Error al registrar peso. Intenta más tarde.",
-            reply_markup=weight_input_keyboard()
+            t('weight.error', lang),
+            reply_markup=weight_input_keyboard(lang)
         )
     finally:
         if db:
             db.close()
             
+def parse_reminder_time(value: Optional[str], default: time) -> time:
+    """Convierte 'HH:MM' a time, usando el valor por defecto si no es válido"""
+    try:
+        return datetime.strptime(value, '%H:%M').time()
+    except (TypeError, ValueError):
+        return default
+
+def reminder_config(settings: Optional[UserSettings]) -> dict:
+    """Datos del job de recordatorio: ventana, intervalo y zona horaria del usuario"""
+    return {
+        'start': (settings.reminder_start_time if settings else None) or '08:00',
+        'end': (settings.reminder_end_time if settings else None) or '22:00',
+        'interval': (settings.reminder_interval if settings else None) or 60,
+        'timezone': (settings.timezone if settings else None) or DEFAULT_TIMEZONE
+    }
+
+def next_reminder_time(now: datetime, start: time, end: time, interval_minutes: int,
+                       skip_today: bool = False) -> datetime:
+    """Calcula el próximo recordatorio dentro de la ventana [start, end] del usuario.
+
+    Los recordatorios caen en start + k * intervalo; fuera de la ventana se
+    salta directamente al inicio de la siguiente. ``now`` debe tener zona
+    horaria. Con ``skip_today`` se ignora la ventana en curso (meta cumplida).
+    Ventanas que cruzan la medianoche (p.ej. 20:00-02:00) son válidas.
+    """
+    tz = now.tzinfo
+    interval = timedelta(minutes=max(int(interval_minutes), 1))
+    candidates = []
+    for day_offset in (-1, 0, 1, 2):
+        day = now.date() + timedelta(days=day_offset)
+        window_start = datetime.combine(day, start, tzinfo=tz)
+        window_end = datetime.combine(day, end, tzinfo=tz)
+        if window_end <= window_start:
+            window_end += timedelta(days=1)
+
+        if skip_today and window_start <= now:
+            continue
+        if now < window_start:
+            candidates.append(window_start)
+        elif now < window_end:
+            candidate = window_start + ((now - window_start) // interval + 1) * interval
+            if candidate <= window_end:
+                candidates.append(candidate)
+    return min(candidates)
+
+def schedule_water_reminder(job_queue, user_id: int, config: dict, skip_today: bool = False):
+    """Programa un único recordatorio en el próximo instante válido de la ventana"""
+    tz = get_timezone(config['timezone'])
+    when = next_reminder_time(
+        get_local_time(tz),
+        parse_reminder_time(config['start'], time(8, 0)),
+        parse_reminder_time(config['end'], time(22, 0)),
+        config['interval'],
+        skip_today=skip_today
+    )
+    job_queue.run_once(
+        callback=send_water_reminder,
+        when=when,
+        chat_id=user_id,
+        data={'user_id': user_id, **config},
+        name=f"water_reminder_{user_id}"
+    )
+    return when
+
+def postpone_water_reminders(job_queue, user_id: int):
+    """Mueve los recordatorios al inicio de la ventana de mañana (meta alcanzada)"""
+    jobs = job_queue.get_jobs_by_name(f"water_reminder_{user_id}")
+    for job in jobs:
+        job.schedule_removal()
+    if jobs:
+        config = {key: jobs[0].data[key] for key in ('start', 'end', 'interval', 'timezone')}
+        schedule_water_reminder(job_queue, user_id, config, skip_today=True)
+
 async def restart_water_reminders(context: CallbackContext, user_id: int):
-    """Reinicia los recordatorios en horario UTC-4"""
+    """Reprograma los recordatorios tras un cambio de configuración del usuario"""
     db = get_db_session()
     try:
+        roll_over_water_day(db, user_id)
         user = db.query(User).filter_by(telegram_id=user_id).first()
         if not user or not user.water_goal:
             return
@@ -177,31 +267,56 @@ async def restart_water_reminders(context: CallbackContext, user_id: int):
         
         # Programar nuevos recordatorios si están habilitados
         if not settings or settings.water_reminders_enabled:
-            interval = settings.reminder_interval if settings else 60  # minutos
-            
-            # Calcular primera ejecución (dentro de horario UTC-4)
-            now = get_local_time()
-            start_time = time(8, 0)  # 8:00 AM UTC-4
-            first_run = datetime.combine(now.date(), start_time, tzinfo=TZ)
-            
-            # Si ya pasó la hora de hoy, programar para mañana
-            if now.time() > start_time:
-                first_run += timedelta(days=1)
-            
-            context.job_queue.run_repeating(
-                callback=send_water_reminder,
-                interval=timedelta(minutes=interval),
-                first=first_run,
-                chat_id=user_id,
-                data={'user_id': user_id},
-                name=f"water_reminder_{user_id}"
+            config = reminder_config(settings)
+            when = schedule_water_reminder(
+                context.job_queue, user_id, config,
+                skip_today=user.current_water >= user.water_goal
+            )
+            logger.info(
+                f"Recordatorios programados para usuario {user_id} cada {config['interval']} minutos "
+                f"entre {config['start']} y {config['end']} ({config['timezone']}); próximo: {when}"
             )
-            logger.info(f"Recordatorios programados para usuario {user_id} cada {interval} minutos (UTC-4)")
     except Exception as e:
         logger.error(f"Error reiniciando recordatorios: {e}")
     finally:
         db.close()
 
+def restore_water_reminders(job_queue) -> int:
+    """Reprograma al arrancar los recordatorios de todos los usuarios con meta.
+
+    Los jobs viven en memoria; sin esto un reinicio dejaría sin recordatorios
+    a quien no vuelva a escribir al bot. La meta cumplida solo cuenta si es
+    del día local en curso.
+    """
+    db = get_db_session()
+    try:
+        rows = (
+            db.query(User.telegram_id, User.current_water, User.water_goal, User.water_date, UserSettings)
+            .outerjoin(UserSettings, UserSettings.user_id == User.id)
+            .filter(
+                User.water_goal.isnot(None),
+                User.is_blocked.isnot(True),
+                or_(UserSettings.id.is_(None), UserSettings.water_reminders_enabled.is_(True))
+            )
+            .all()
+        )
+    finally:
+        db.close()
+
+    now_utc = datetime.now(timezone.utc)
+    scheduled = 0
+    for telegram_id, current_water, water_goal, water_date, settings in rows:
+        if job_queue.get_jobs_by_name(f"water_reminder_{telegram_id}"):
+            continue
+        config = reminder_config(settings)
+        goal_met = (
+            water_date == local_date(config['timezone'], now_utc)
+            and (current_water or 0) >= water_goal
+        )
+        schedule_water_reminder(job_queue, telegram_id, config, skip_today=goal_met)
+        scheduled += 1
+    return scheduled
+
 
 
 def calculate_water_goal(weight_kg: float) -> float:
@@ -218,19 +333,22 @@ async def handle_water_reminder(update: Update, context: CallbackContext):
         
     db = None
     try:
-        db = get_db_session()
-        user = db.query(User).filter_by(telegram_id=query.from_user.id).first()
+        db = get_read_session()
+        roll_over_water_day(db, query.from_user.id)
+        state = get_hydration_state(db, query.from_user.id)
         
-        if not user or not user.weight:
+        if not state or not state.weight:
             await handle_register_weight(update, context)
             return
     
-        await show_water_progress(query, user)
+        await show_water_progress(query, state)
     except Exception as e:
         logger.error(f"Error en handle_water_reminder: {e}")
-        await query.edit_message_text(
-            "⚠️ Error al procesar tu solicitud. Intenta nuevamente.",
-            reply_markup=water_reminder_keyboard()
+        lang = user_language(query.from_user)
+        await edit_message(
+            query,
+            t('water.request_error', lang),
+            reply_markup=water_reminder_keyboard(lang)
         )
     finally:
         if db:
@@ -241,40 +359,43 @@ async def handle_water_progress(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
-    db = get_db_session()
-    user = db.query(User).filter_by(telegram_id=query.from_user.id).first()
+    db = get_read_session()
+    try:
+        roll_over_water_day(db, query.from_user.id)
+        state = get_hydration_state(db, query.from_user.id)
+    finally:
+        db.close()
     
-    if not user:
-        await query.edit_message_text("❌ No se encontraron tus datos. Por favor, reinicia el bot.")
+    if not state:
+        await edit_message(query, t('water.no_data', user_language(query.from_user)))
         return
     
-    await show_water_progress(query, user)
+    await show_water_progress(query, state)
 
-async def show_water_progress(query, user: User):
+async def show_water_progress(query, user: Union[User, HydrationState]):
     """Muestra el progreso con gráfica mejorada"""
+    lang = user_language(query.from_user)
     try:
         progress = min((user.current_water / user.water_goal) * 100, 100)
         progress_bar = "🟩" * int(progress / 10) + "⬜" * (10 - int(progress / 10))
         
-        message = (
-            "💧 *Progreso de Hidratación* 💧\n\n"
-            f"🚰 Consumido hoy: `{user.current_water:.0f} ml`\n"
-            f"🎯 Meta diaria: `{user.water_goal:.0f} ml`\n"
-            f"📊 Progreso: `{progress:.1f}%`\n\n"
-            f"{progress_bar}\n\n"
-            f"⏱ Próximo recordatorio en 1 hora"
+        message = t(
+            'water.progress', lang,
+            current=user.current_water, goal=user.water_goal, progress=progress, bar=progress_bar
         )
         
-        await query.edit_message_text(
+        await edit_message(
+            query,
             text=message,
-            reply_markup=water_progress_keyboard(),
+            reply_markup=water_progress_keyboard(lang),
             parse_mode='Markdown'
         )
     except Exception as e:
         logger.error(f"Error mostrando progreso: {e}")
-        await query.edit_message_text(
-            "⚠️ Error mostrando progreso",
-            reply_markup=water_progress_keyboard()
+        await edit_message(
+            query,
+            t('water.progress_error', lang),
+            reply_markup=water_progress_keyboard(lang)
         )
     
 
@@ -283,24 +404,32 @@ async def handle_water_amount(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
+    # La primera pulsación se aplica al instante; las que siguen dentro de la
+    # ventana se suman en una sola escritura y una sola edición
+    amounts = await water_taps.collect(query.from_user.id, float(query.data.split('_')[-1]))
+    if amounts is None:
+        return
+    
+    lang = user_language(query.from_user)
     db = get_db_session()
     try:
-        user = db.query(User).filter_by(telegram_id=query.from_user.id).first()
+        # Primer registro del día: se cierra antes el día anterior
+        roll_over_water_day(db, query.from_user.id)
+        # FOR UPDATE: otra instancia no puede sumar entre la lectura y el commit
+        user = db.query(User).filter_by(telegram_id=query.from_user.id).with_for_update().first()
         if not user:
-            await query.edit_message_text("❌ Usuario no encontrado")
+            await edit_message(query, t('errors.user_not_found', lang))
             return
             
         if user.current_water >= user.water_goal:
-            await query.edit_message_text(
-                "🎉 ¡Ya alcanzaste tu meta diaria!",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🏠 Menú principal", callback_data='main_menu')]
-                ])
+            await edit_message(
+                query,
+                t('water.goal_already_reached', lang),
+                reply_markup=back_to_menu_keyboard(lang)
             )
             return
             
-        amount = float(query.data.split('_')[-1])
-        new_amount = min(user.current_water + amount, user.water_goal)
+        new_amount = min(user.current_water + sum(amounts), user.water_goal)
         added_amount = new_amount - user.current_water
         user.current_water = new_amount
         
@@ -308,128 +437,116 @@ async def handle_water_amount(update: Update, context: CallbackContext):
         log = WaterLog(
             user_id=user.id,
             amount=added_amount,
-            timestamp=datetime.utcnow()
+            timestamp=utcnow()
         )
         db.add(log)
         db.commit()
+        admin_stats.record_water(user.telegram_id, added_amount)
         
         if user.current_water >= user.water_goal:
-            await query.edit_message_text(
-                "🎉 ¡Meta alcanzada! ¡Buen trabajo!",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🏠 Menú principal", callback_data='main_menu')]
-                ])
+            await edit_message(
+                query,
+                t('water.goal_reached', lang),
+                reply_markup=back_to_menu_keyboard(lang)
             )
-            # Cancelar recordatorios hasta mañana
-            for job in context.job_queue.get_jobs_by_name(f"water_reminder_{user.telegram_id}"):
-                job.schedule_removal()
+            # Sin recordatorios hasta la ventana de mañana
+            postpone_water_reminders(context.job_queue, user.telegram_id)
         else:
             await show_water_progress(query, user)
             
     except Exception as e:
         logger.error(f"Error registrando agua: {e}")
-        await query.edit_message_text(
-            "⚠️ Error al registrar. Intenta nuevamente.",
-            reply_markup=water_progress_keyboard()
+        await edit_message(
+            query,
+            t('water.log_error', lang),
+            reply_markup=water_progress_keyboard(lang)
         )
     finally:
         if db: db.close()
 
 async def start_water_reminders(context: CallbackContext, user_id: int):
-    """Configura los recordatorios periódicos con manejo robusto de errores"""
+    """Asegura que el usuario tenga su recordatorio programado (sin reprogramar si ya existe)"""
     try:
         if not hasattr(context, 'job_queue') or not context.job_queue:
             logger.error("JobQueue no disponible")
             raise RuntimeError("JobQueue no configurado")
         
-        # Cancelar jobs existentes para este usuario
-        current_jobs = context.job_queue.get_jobs_by_name(f"water_reminder_{user_id}")
-        for job in current_jobs:
-            job.schedule_removal()
-        
-        # Programar recordatorios horarios
-        context.job_queue.run_repeating(
-            callback=send_water_reminder,
-            interval=3600,  # 1 hora
-            first=3600,       # Primera ejecución en 10 segundos
-            chat_id=user_id,
-            data={'user_id': user_id},
-            name=f"water_reminder_{user_id}"
-        )
-        
-        # Programar reinicio diario a las 00:00 (si no existe ya)
-        if not any(job.name == "daily_reset" for job in context.job_queue.jobs()):
-            context.job_queue.run_daily(
-                callback=reset_daily_water,
-                time=datetime.strptime("09:00", "%H:%M").time(),
-                name="daily_reset"
-            )
+        # La programación solo cambia cuando cambia la configuración
+        if context.job_queue.get_jobs_by_name(f"water_reminder_{user_id}"):
+            return
         
-        logger.info(f"Recordatorios configurados para usuario {user_id}")
+        await restart_water_reminders(context, user_id)
         
     except Exception as e:
         logger.error(f"Error crítico al configurar recordatorios: {e}")
         raise
 
 async def send_water_reminder(context: CallbackContext):
-    """Envía recordatorios respetando horario UTC-4"""
+    """Envía un recordatorio y programa el siguiente dentro de la ventana del usuario"""
+    with user_scope(context.job.data['user_id']):
+        await _send_water_reminder(context)
+
+async def _send_water_reminder(context: CallbackContext):
     job = context.job
     user_id = job.data['user_id']
-    db = get_db_session()
+    tz = get_timezone(job.data['timezone'])
+    reschedule = True
+    goal_met = False
+    db = get_read_session()
     try:
-        user = db.query(User).filter_by(telegram_id=user_id).first()
-        if not user or not user.water_goal:
+        roll_over_water_day(db, user_id)
+        user = get_hydration_state(db, user_id)
+        if not user or not user.water_goal or not user.reminders_enabled:
+            reschedule = False
             return
             
-        settings = db.query(UserSettings).filter_by(user_id=user.id).first()
-        
-        # Verificar si los recordatorios están habilitados
-        if settings and not settings.water_reminders_enabled:
-            return
-            
-        # Verificar horario permitido (08:00-22:00 UTC-4)
-        now = get_local_time().time()
-        start = time(8, 0)  # 8:00 AM UTC-4
-        end = time(22, 0)   # 10:00 PM UTC-4
-        
-        if not (start <= now <= end):
-            return
-            
-        # Verificar si ya alcanzó la meta
+        # Si ya alcanzó la meta no hay más recordatorios hoy
         if user.current_water >= user.water_goal:
+            goal_met = True
             return
             
         # Enviar recordatorio
         progress = min((user.current_water / user.water_goal) * 100, 100)
         progress_bar = "🟩" * int(progress / 10) + "⬜" * (10 - int(progress / 10))
+        # Sin update: el idioma solo puede salir de la caché
+        lang = language_cache.get(user_id) or DEFAULT_LANGUAGE
         
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"💧 ⏰ *Recordatorio de Hidratación* ⏰ 💧\n\n"
-                 f"Es hora de tomar agua para mantenerte hidratado/a!\n\n"
-                 f"Progreso actual: {user.current_water:.0f}/{user.water_goal:.0f} ml\n"
-                 f"{progress_bar} {progress:.0f}%\n\n"
-                 f"🕘 Hora actual: {get_local_time().strftime('%H:%M')} (UTC-4)",
-            reply_markup=water_reminder_keyboard(),
-            parse_mode='Markdown'
+        with traffic_class(BULK):
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=t(
+                    'water.reminder', lang,
+                    current=user.current_water, goal=user.water_goal, bar=progress_bar,
+                    progress=progress, time=get_local_time(tz).strftime('%H:%M')
+                ),
+                reply_markup=water_reminder_keyboard(lang),
+                parse_mode='Markdown'
+            )
+        db.execute(
+            update(User)
+            .where(User.telegram_id == user_id)
+            .values(last_water_reminder=datetime.utcnow())
+            .execution_options(synchronize_session=False)
         )
-        user.last_water_reminder = datetime.utcnow()
         db.commit()
     except Exception as e:
         logger.error(f"Error enviando recordatorio a {user_id}: {e}")
     finally:
         db.close()
+        if reschedule:
+            schedule_water_reminder(context.job_queue, user_id, job.data, skip_today=goal_met)
         
 async def cancel_water_reminders(update: Update, context: CallbackContext):
     """Cancela recordatorios y actualiza la configuración"""
     query = update.callback_query
     await query.answer()
     
+    lang = user_language(query.from_user)
     db = get_db_session()
     try:
         user = db.query(User).filter_by(telegram_id=query.from_user.id).first()
         if not user:
-            await query.edit_message_text("❌ Usuario no encontrado")
+            await edit_message(query, t('errors.user_not_found', lang))
             return
             
         settings = db.query(UserSettings).filter_by(user_id=user.id).first()
@@ -443,16 +560,14 @@ async def cancel_water_reminders(update: Update, context: CallbackContext):
             job.schedule_removal()
             jobs_removed += 1
             
-        message = "🔕 Recordatorios desactivados" if jobs_removed > 0 else "ℹ️ No tenías recordatorios activos"
-        await query.edit_message_text(
+        message = t('reminders.cancelled' if jobs_removed > 0 else 'reminders.none_active', lang)
+        await edit_message(
+            query,
             text=message,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("💧 Ver progreso", callback_data='water_progress')],
-                [InlineKeyboardButton("🏠 Menú principal", callback_data='main_menu')]
-            ])
+            reply_markup=reminders_cancelled_keyboard(lang)
         )
     except Exception as e:
         logger.error(f"Error cancelando recordatorios: {e}")
-        await query.edit_message_text("⚠️ Error al desactivar recordatorios")
+        await edit_message(query, t('reminders.cancel_error', lang))
     finally:
         if db: db.close()